@@ -1,32 +1,213 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import calendar
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import (Blueprint, Flask, Response, current_app, g, render_template, request, redirect, url_for, session, flash,
+                   jsonify, stream_with_context)
+from werkzeug.local import LocalProxy
+from bulk_upload import iter_transfer_rows
 from db import Database
+from events import EventBus
+from export import FORMATS, stream_export
+from loan_queue import LoanDecisionQueue
+from metrics import Metrics
+from money import Money
+from passwords import PasswordHasher
+from sharding import ShardedDatabase
+
+# Кредитный продукт, который предлагается на дашборде (ставка хранится в loan_products)
+LOAN_PRODUCT = 'cash'
+
+# Сколько операций истории показывать за раз (дальше - подгрузка через /api/history)
+HISTORY_PAGE_SIZE = 20
+
+# Технический предел срока заявки (месяцев) - чтобы число помещалось в INTEGER;
+# длинные сроки отклоняет автоскоринг (loan_queue.MAX_TERM)
+MAX_LOAN_TERM = 1200
+
+# Заявок на странице менеджера; решения по пачкам применяются в фоне
+MANAGER_PAGE_SIZE = 50
+
+bank = Blueprint('bank', __name__, cli_group=None)
+
+
+def default_config():
+    """Настройки развертывания из окружения.
+
+    BANK_PASSWORD_ALGO и др. - стоимость хеширования паролей (см. passwords.py).
+    BANK_METRICS=0 выключает метрики маршрутов и методов Database (/metrics, /admin/metrics);
+    BANK_PROFILE_RATE - доля запросов под cProfile (по умолчанию только ?profile=1 у админа).
+    BANK_SHARDS > 1 - клиенты распределяются по нескольким файлам SQLite (см. sharding.py);
+    число шардов задается один раз при создании базы.
+    BANK_SHARED_CACHE=1 - для нескольких воркеров на одной базе: снимок дашборда из кэша
+    сверяется с версией в базе (один запрос на попадание), и запись одного воркера сразу видна
+    в остальных. Без него попадание бесплатно, а чужие записи видны через TTL кэша (30 с).
+    BANK_EVENTS=1 включает обновление дашборда в реальном времени (/events, см. events.py).
+    Открытый поток держит поток воркера, поэтому включать только под gunicorn -k gthread/gevent:
+    синхронный воркер с открытой вкладкой клиента больше не обслуживает запросы.
+    BANK_EVENT_SUBSCRIBERS - открытых потоков на процесс, BANK_EVENT_BUFFER - байт
+    неотправленных событий на поток.
+    """
+    env = os.environ
+    return {
+        'BANK_DATABASE': env.get('BANK_DATABASE', 'bank_system.db'),
+        'BANK_SHARDS': int(env.get('BANK_SHARDS', 1)),
+        'BANK_SHARED_CACHE': env.get('BANK_SHARED_CACHE', '0') == '1',
+        'BANK_METRICS': env.get('BANK_METRICS', '1') != '0',
+        'BANK_PROFILE_RATE': float(env.get('BANK_PROFILE_RATE', 0)),
+        'BANK_PASSWORD_ALGO': env.get('BANK_PASSWORD_ALGO', 'scrypt'),
+        'BANK_SCRYPT_N': int(env.get('BANK_SCRYPT_N', 2 ** 14)),
+        'BANK_PBKDF2_ITERATIONS': int(env.get('BANK_PBKDF2_ITERATIONS', 200_000)),
+        'BANK_HASH_CONCURRENCY': int(env.get('BANK_HASH_CONCURRENCY', 4)),
+        'BANK_EVENTS': env.get('BANK_EVENTS', '0') == '1',
+        'BANK_EVENT_SUBSCRIBERS': int(env.get('BANK_EVENT_SUBSCRIBERS', 10_000)),
+        'BANK_EVENT_BUFFER': int(env.get('BANK_EVENT_BUFFER', 64 * 1024)),
+    }
+
+
+class Services:
+    """База, метрики, шина событий и очередь решений по кредитам одного приложения.
+
+    База открывается при первом обращении (первый запрос воркера), и открытие - только проверка
+    версии схемы одним чтением: старт воркера не ждет блокировку записи. Миграции и начальных
+    пользователей один раз применяет flask init-db (init_db()).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.hasher = PasswordHasher(algorithm=config['BANK_PASSWORD_ALGO'], n=config['BANK_SCRYPT_N'],
+                                     iterations=config['BANK_PBKDF2_ITERATIONS'],
+                                     max_concurrent=config['BANK_HASH_CONCURRENCY'])
+        self.metrics = Metrics(profile_rate=config['BANK_PROFILE_RATE']) if config['BANK_METRICS'] else None
+        self.events = EventBus(max_subscribers=config['BANK_EVENT_SUBSCRIBERS'],
+                               max_bytes=config['BANK_EVENT_BUFFER']) if config['BANK_EVENTS'] else None
+        self._db = None
+        self._loan_decisions = None
+        self._lock = threading.Lock()
 
-app = Flask(__name__)
-app.secret_key = 'super_secret_key_bank_moneta' # Для работы сессий
-db = Database()
+    def open_database(self, migrate=False):
+        options = dict(history_page_size=HISTORY_PAGE_SIZE, hasher=self.hasher, metrics=self.metrics,
+                       events=self.events, shared_cache=self.config['BANK_SHARED_CACHE'], seed=migrate, migrate=migrate)
+        if self.config['BANK_SHARDS'] > 1:
+            return ShardedDatabase(self.config['BANK_DATABASE'], shards=self.config['BANK_SHARDS'], recover=not migrate, **options)
+        return Database(self.config['BANK_DATABASE'], **options)
 
-# Настройка комиссии банка (15%)
-LOAN_RATE = 0.15 
+    @property
+    def db(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    started = time.perf_counter()
+                    self._db = self.open_database()
+                    # Время открытия видно в /metrics как вызов open_database
+                    if self.metrics:
+                        self.metrics.observe_call('open_database', time.perf_counter() - started)
+        return self._db
+
+    @property
+    def loan_decisions(self):
+        if self._loan_decisions is None:
+            db = self.db
+            with self._lock:
+                if self._loan_decisions is None:
+                    self._loan_decisions = LoanDecisionQueue(db)
+        return self._loan_decisions
+
+    def release_connection(self):
+        # Соединение потока возвращается в пул после каждого запроса; неоткрытую базу не открывает
+        if self._db is not None:
+            self._db.release_connection()
+
+    def init_db(self):
+        """Миграции, диапазоны id шардов и начальные пользователи; возвращает версию схемы"""
+        db = self.open_database(migrate=True)
+        with self._lock:
+            self._db = self._db or db
+        return db.check_schema()
+
+
+def services():
+    return current_app.extensions['bank']
+
+
+# Прокси к объектам текущего приложения: маршруты обращаются к ним как к глобальным именам
+db = LocalProxy(lambda: services().db)
+loan_decisions = LocalProxy(lambda: services().loan_decisions)
+
+
+def create_app(config=None):
+    """Приложение банка; config дополняет default_config(). Базу не открывает."""
+    app = Flask(__name__)
+    app.secret_key = 'super_secret_key_bank_moneta' # Для работы сессий
+    app.config.update(default_config())
+    app.config.update(config or {})
+    app.extensions['bank'] = Services(app.config)
+    app.register_blueprint(bank)
+    return app
 
 # --- Декораторы и утилиты ---
+@bank.before_app_request
+def start_request_timer():
+    metrics = services().metrics
+    if metrics is None: return
+    g.request_started = time.perf_counter()
+    # query_string проверяется как байты: разбор request.args на каждом запросе заметен в накладных расходах
+    if (metrics.profile_rate and random.random() < metrics.profile_rate) or \
+            (b'profile=1' in request.query_string and request.args.get('profile') == '1' and session.get('role') == 'admin'):
+        g.request_profile = metrics.start_profile()
+
+@bank.after_app_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@bank.teardown_app_request
+def record_request(exc):
+    started = g.pop('request_started', None)
+    if started is None: return
+    seconds = time.perf_counter() - started
+    # Шаблон маршрута, а не путь: /manager/jobs/<int:job_id> - одна серия, а не по серии на id
+    rule = request.url_rule
+    route, method = rule.rule if rule else 'unmatched', request.method
+    metrics = services().metrics
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        metrics.finish_profile(profile, route, method, seconds)
+    metrics.observe_request(route, method, g.pop('response_status', 500), seconds)
+
+@bank.teardown_app_request
+def release_connection(exc):
+    services().release_connection()
+
+@bank.app_template_filter('tenge')
+def tenge_filter(tiyn, decimals=0, grouping=True):
+    # Суммы хранятся в тиынах; в шаблонах выводятся в тенге
+    if tiyn is None: return ''
+    text = Money(tiyn).format(decimals)
+    return text if grouping else text.replace(',', '')
+
 def login_required(role=None):
     # Простая проверка авторизации внутри роутов
     if 'user' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     if role and session.get('role') != role:
         return "Доступ запрещен", 403
     return None
 
-@app.route('/')
+@bank.route('/')
 def index():
     if 'user' in session:
         role = session['role']
-        if role == 'client': return redirect(url_for('client_dash'))
-        if role == 'manager': return redirect(url_for('manager_dash'))
-        if role == 'admin': return redirect(url_for('admin_dash'))
-    return redirect(url_for('login'))
+        if role == 'client': return redirect(url_for('.client_dash'))
+        if role == 'manager': return redirect(url_for('.manager_dash'))
+        if role == 'admin': return redirect(url_for('.admin_dash'))
+    return redirect(url_for('.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bank.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -37,102 +218,200 @@ def login():
             # Проверка блокировки
             if user['is_blocked']:
                 session['blocked_user'] = username # Запоминаем для апелляции
-                return redirect(url_for('blocked'))
+                return redirect(url_for('.blocked'))
             
             session['user'] = user['username']
             session['role'] = user['role']
             session['name'] = user['name']
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
         else:
             flash('Неверный логин или пароль', 'danger')
             
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bank.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         if db.create_user(request.form['username'], request.form['password'], 'client', 
                           request.form['name'], request.form['email']):
             flash('Регистрация успешна! Войдите.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         else:
             flash('Логин уже занят', 'danger')
     return render_template('register.html')
 
-@app.route('/logout')
+@bank.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/blocked', methods=['GET', 'POST'])
+@bank.route('/blocked', methods=['GET', 'POST'])
 def blocked():
     username = session.get('blocked_user')
-    if not username: return redirect(url_for('login'))
+    if not username: return redirect(url_for('.login'))
     
     if request.method == 'POST':
         message = request.form['message']
         db.create_appeal(username, message)
         flash('Апелляция отправлена администратору.', 'info')
         session.pop('blocked_user', None)
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
         
     return render_template('blocked.html', username=username)
 
 # --- CLIENT Routes ---
-@app.route('/dashboard')
+@bank.route('/dashboard')
 def client_dash():
     check = login_required('client')
     if check: return check
     
-    accounts = db.get_client_accounts(session['user'])
-    history = db.get_history(session['user'])
-    loans = db.get_client_loans(session['user']) 
+    # Счета, первая страница истории и кредиты - из кэша снимков (сбрасывается при изменениях)
+    snapshot = db.get_client_dashboard(session['user'])
     
     # Передаем loan_rate в шаблон, чтобы клиент видел процентную ставку
     return render_template('client.html', 
-                           accounts=accounts, 
-                           history=history, 
-                           loans=loans, 
+                           accounts=snapshot['accounts'], 
+                           history=snapshot['history'], 
+                           history_cursor=snapshot['history_cursor'],
+                           loans=snapshot['loans'], 
                            user=session['name'],
-                           loan_rate=int(LOAN_RATE * 100)) # Передаем как целое число (15)
+                           live_updates=services().events is not None,
+                           loan_rate=round(db.get_loan_product(LOAN_PRODUCT)['annual_rate'] * 100)) # Передаем как целое число (15)
+
+@bank.route('/events')
+def client_events():
+    check = login_required('client')
+    if check: return check
+    # Поток text/event-stream: балансы, новые операции и кредиты клиента после каждой проводки.
+    # Ответ держит поток воркера, пока открыт: под gunicorn нужен -k gthread или gevent (см. events.py)
+    events = services().events
+    if events is None:
+        return 'Обновления в реальном времени выключены (BANK_EVENTS=0)', 404
+    subscription = events.subscribe(session['user'])
+    if subscription is None:
+        return Response('retry: 30000\n\n', status=503, mimetype='text/event-stream')
+    if request.headers.get('Last-Event-ID'):
+        # Переподключение: пропущенные события не хранятся - страница перечитывается целиком
+        subscription.resync()
+    # Генератор не обращается к запросу и сессии - stream_with_context не нужен
+    return Response(subscription.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _parse_date(value):
+    return int(datetime.strptime(value, "%Y-%m-%d").timestamp()) if value else None
+
+@bank.route('/api/history')
+def api_history():
+    check = login_required('client')
+    if check: return check
+    try:
+        limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 200))
+        since = _parse_date(request.args.get('from'))
+        until = _parse_date(request.args.get('to'))
+        if until is not None:
+            until += 24 * 3600  # дата "по" включительно
+        types = [t for t in request.args.get('type', '').split(',') if t]
+        rows, next_cursor = db.get_history(session['user'], limit=limit, cursor=request.args.get('cursor'),
+                                           types=types, since=since, until=until)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры'}), 400
+
+    return jsonify({
+        # amount - в тиынах (целое число)
+        'items': [{k: row[k] for k in ('id', 'account_number', 'type', 'amount', 'description', 'timestamp')} for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+def _statement_period(args):
+    """?month=YYYY-MM или ?from=YYYY-MM-DD&to=YYYY-MM-DD (по умолчанию - текущий месяц)"""
+    if args.get('from') or args.get('to'):
+        day_from = datetime.strptime(args.get('from', ''), "%Y-%m-%d").date()
+        day_to = datetime.strptime(args.get('to', ''), "%Y-%m-%d").date()
+    else:
+        month = datetime.strptime(args.get('month') or datetime.now().strftime("%Y-%m"), "%Y-%m").date()
+        day_from = month
+        day_to = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+    if day_from > day_to:
+        raise ValueError("Начало периода позже конца")
+    return day_from.isoformat(), day_to.isoformat()
 
-@app.route('/transaction', methods=['POST'])
+@bank.route('/api/statement')
+def api_statement():
+    check = login_required('client')
+    if check: return check
+    try:
+        day_from, day_to = _statement_period(request.args)
+    except ValueError:
+        return jsonify({'error': 'Некорректный период'}), 400
+    # Выписка строится по дневным агрегатам, суммы - в тиынах
+    statement = db.get_statement(session['user'], request.args.get('account', ''), day_from, day_to)
+    if statement is None:
+        return jsonify({'error': 'Счет не найден'}), 404
+    statement['days'] = [dict(day) for day in statement['days']]
+    return jsonify(statement)
+
+@bank.route('/transaction', methods=['POST'])
 def transaction():
     action = request.form['action']
     acc_num = request.form['account_number']
+    try:
+        amount = Money.parse(request.form.get('amount'))
+    except ValueError:
+        flash('Некорректная сумма', 'danger')
+        return redirect(url_for('.client_dash'))
     
     if action == 'deposit':
-        amount = float(request.form['amount'])
-        db.deposit(acc_num, amount)
-        flash('Баланс пополнен', 'success')
+        res = db.deposit(acc_num, amount)
+        flash('Баланс пополнен' if res.ok else res.message, 'success' if res.ok else 'danger')
         
     elif action == 'transfer':
         to_acc = request.form['to_account']
-        amount = float(request.form['amount'])
         res = db.transfer(acc_num, to_acc, amount)
-        flash(res, 'success' if res == 'Успешно' else 'danger')
+        flash(res.message, 'success' if res.ok else 'danger')
         
-    return redirect(url_for('client_dash'))
+    return redirect(url_for('.client_dash'))
+
+@bank.route('/bulk_transfer', methods=['POST'])
+def bulk_transfer():
+    check = login_required('client')
+    if check: return check
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': 'Файл не передан'}), 400
+
+    try:
+        results = db.bulk_transfer(iter_transfer_rows(file), owner=session['user'])
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'error': 'Некорректный формат файла'}), 400
 
-@app.route('/loan_request', methods=['POST'])
+    succeeded = sum(1 for r in results if r.ok)
+    return jsonify({
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'rows': [{'row': i + 1, 'status': r.status.value, 'message': r.message} for i, r in enumerate(results)],
+    })
+
+@bank.route('/loan_request', methods=['POST'])
 def loan_request():
     try:
-        amount = float(request.form['amount'])
+        amount = Money.parse(request.form['amount'])
         term = int(request.form['term'])
     except ValueError:
         flash('Некорректные данные', 'danger')
-        return redirect(url_for('client_dash'))
-    
-    # Расчет полной суммы возврата для уведомления пользователя
-    total_repayment = amount * (1 + LOAN_RATE)
+        return redirect(url_for('.client_dash'))
+    if amount <= 0 or not 0 < term <= MAX_LOAN_TERM:
+        flash('Некорректные данные', 'danger')
+        return redirect(url_for('.client_dash'))
     
-    # В БД передаем базовые данные, математику начисления сделаем внутри метода request_loan
-    db.request_loan(session['user'], amount, term)
+    # Ставка берется из продукта, ежемесячный платеж - аннуитетный (см. loans.py)
+    payment = db.request_loan(session['user'], amount, term, LOAN_PRODUCT)
+    total_repayment = Money(payment * term)
     
-    flash(f'Заявка на {amount:,.0f} ₸ отправлена. С учетом комиссии ({int(LOAN_RATE*100)}%) к возврату: {total_repayment:,.0f} ₸', 'info')
-    return redirect(url_for('client_dash'))
+    flash(f'Заявка на {amount.format()} ₸ отправлена. Ежемесячный платеж: {payment.format()} ₸, всего к возврату по графику: {total_repayment.format()} ₸', 'info')
+    return redirect(url_for('.client_dash'))
 
-@app.route('/repay_loan', methods=['POST'])
+@bank.route('/repay_loan', methods=['POST'])
 def repay_loan():
     check = login_required('client')
     if check: return check
@@ -140,61 +419,294 @@ def repay_loan():
     loan_id = request.form.get('loan_id')
     account_number = request.form.get('account_number')
     try:
-        amount = float(request.form.get('amount'))
-    except (ValueError, TypeError):
+        amount = Money.parse(request.form.get('amount'))
+    except ValueError:
         flash('Некорректная сумма', 'danger')
-        return redirect(url_for('client_dash'))
+        return redirect(url_for('.client_dash'))
 
     result = db.repay_loan(loan_id, account_number, amount)
 
-    if result['success']:
+    if result.ok:
         flash('Платеж по кредиту успешно выполнен!', 'success')
     else:
-        flash(f"Ошибка: {result['message']}", 'danger')
+        flash(f"Ошибка: {result.message}", 'danger')
 
-    return redirect(url_for('client_dash'))
+    return redirect(url_for('.client_dash'))
 
-@app.route('/create_account')
+@bank.route('/create_account')
 def create_account():
     db.create_account(session['user'], 'Текущий')
-    return redirect(url_for('client_dash'))
+    return redirect(url_for('.client_dash'))
 
 # --- MANAGER Routes ---
-@app.route('/manager')
+def _loan_filters(args):
+    # Фильтры списка заявок из query string / формы (пустые значения игнорируются)
+    filters = {}
+    if args.get('username'):
+        filters['username'] = args['username']
+    for key in ('min_amount', 'max_amount'):
+        if args.get(key):
+            filters[key] = Money.parse(args[key])
+    return filters
+
+@bank.route('/manager')
 def manager_dash():
     check = login_required('manager')
     if check: return check
-    loans = db.get_loans('pending')
-    return render_template('manager.html', loans=loans)
+    try:
+        filters = _loan_filters(request.args)
+        after_id = request.args.get('after', type=int)
+    except ValueError:
+        filters, after_id = {}, None
+    loans = db.get_loans('pending', limit=MANAGER_PAGE_SIZE + 1, after_id=after_id, **filters)
+    next_after = loans[MANAGER_PAGE_SIZE - 1]['id'] if len(loans) > MANAGER_PAGE_SIZE else None
+    # В шаблон (поля формы, ссылка на следующую страницу) - фильтры в том виде, как их ввели
+    raw_filters = {key: request.args[key] for key in ('username', 'min_amount', 'max_amount') if key in filters}
+    return render_template('manager.html', loans=loans[:MANAGER_PAGE_SIZE], pending_total=db.count_loans('pending'),
+                           filters=raw_filters, next_after=next_after)
 
-@app.route('/process_loan/<int:loan_id>/<decision>')
+@bank.route('/process_loan/<int:loan_id>/<decision>')
 def process_loan(loan_id, decision):
+    check = login_required('manager')
+    if check: return check
     db.process_loan(loan_id, decision)
-    return redirect(url_for('manager_dash'))
+    return redirect(url_for('.manager_dash'))
+
+def _loan_ids(ids):
+    # Только список id: строка "12" иначе разбиралась бы посимвольно в заявки 1 и 2
+    if ids is None:
+        return []
+    if not isinstance(ids, list) or any(isinstance(i, (bool, float)) for i in ids):
+        raise TypeError('loan_ids - список целых чисел')
+    return [int(i) for i in ids]
+
+@bank.route('/manager/decide', methods=['POST'])
+def decide_loans():
+    """Пакетное решение: выбранные заявки (loan_ids) или все подходящие под фильтр (all=1)"""
+    check = login_required('manager')
+    if check: return check
+    data = request.get_json(silent=True) or request.form
+    decision = data.get('decision')
+    if decision not in ('approved', 'rejected'):
+        return jsonify({'error': 'Неизвестное решение'}), 400
+    try:
+        if data.get('all'):
+            job_id = loan_decisions.submit_matching(decision, **_loan_filters(data))
+        else:
+            ids = data.get('loan_ids') if request.is_json else request.form.getlist('loan_ids')
+            job_id = loan_decisions.submit(_loan_ids(ids), decision)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректные параметры'}), 400
+
+    if request.is_json:
+        return jsonify({'job_id': job_id, 'status_url': url_for('.loan_job', job_id=job_id)}), 202
+    flash(f'Задание #{job_id} поставлено в очередь', 'info')
+    return redirect(url_for('.manager_dash'))
+
+@bank.route('/manager/auto_score', methods=['POST'])
+def auto_score_loans():
+    check = login_required('manager')
+    if check: return check
+    job_id = loan_decisions.submit_auto_score()
+    if request.is_json:
+        return jsonify({'job_id': job_id, 'status_url': url_for('.loan_job', job_id=job_id)}), 202
+    flash(f'Автоскоринг запущен (задание #{job_id})', 'info')
+    return redirect(url_for('.manager_dash'))
+
+@bank.route('/manager/jobs/<int:job_id>')
+def loan_job(job_id):
+    check = login_required('manager')
+    if check: return check
+    job = loan_decisions.job(job_id)
+    if not job:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job)
 
 # --- ADMIN Routes ---
-@app.route('/admin')
+@bank.route('/admin')
 def admin_dash():
     check = login_required('admin')
     if check: return check
-    users = db.get_all_users()
-    appeals = db.get_open_appeals()
-    return render_template('admin.html', users=users, appeals=appeals)
+    snapshot = db.get_admin_dashboard()
+    return render_template('admin.html', users=snapshot['users'], appeals=snapshot['appeals'])
+
+@bank.route('/admin/pool_stats')
+def pool_stats():
+    check = login_required('admin')
+    if check: return check
+    # Метрики пула соединений: попадания, ожидания свободного слота, открытые соединения
+    return jsonify(db.pool_stats())
+
+@bank.route('/admin/cache_stats')
+def cache_stats():
+    check = login_required('admin')
+    if check: return check
+    # Попадания/промахи кэша снимков дашбордов
+    return jsonify(db.cache_stats())
+
+@bank.route('/admin/daily_totals')
+def daily_totals():
+    check = login_required('admin')
+    if check: return check
+    try:
+        day_from, day_to = _statement_period(request.args)
+    except ValueError:
+        return jsonify({'error': 'Некорректный период'}), 400
+    # Обороты банка по дням из daily_balances, без пересуммирования журнала
+    return jsonify(db.get_daily_totals(day_from, day_to))
+
+@bank.route('/metrics')
+def prometheus_metrics():
+    metrics = services().metrics
+    if metrics is None:
+        return 'Метрики выключены (BANK_METRICS=0)', 404
+    gauges = {f"bank_pool_{k}": v for k, v in db.pool_stats().items()}
+    gauges.update({f"bank_cache_{k}": v for k, v in db.cache_stats().items()})
+    if services().events:
+        gauges.update({f"bank_events_{k}": v for k, v in services().events.stats().items()})
+    return Response(metrics.render_prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+@bank.route('/admin/metrics')
+def admin_metrics():
+    check = login_required('admin')
+    if check: return check
+    metrics = services().metrics
+    if metrics is None:
+        return jsonify({'error': 'Метрики выключены (BANK_METRICS=0)'}), 404
+    # Гистограммы маршрутов, статистика методов Database и последние профили (?profile=1 у любого запроса)
+    return jsonify({**metrics.snapshot(), 'pool': db.pool_stats(), 'cache': db.cache_stats(),
+                    'events': services().events.stats() if services().events else None})
+
+@bank.route('/admin/export/<table>')
+def export_table(table):
+    check = login_required('admin')
+    if check: return check
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') == '1'
+    try:
+        watermark, chunks = stream_export(db, table, fmt, compress=compress, after=request.args.get('after') or None,
+                                          since=_parse_date(request.args.get('since')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Без Content-Length ответ уходит chunked-кусками по мере чтения пачек из базы
+    filename = f"{table}.{fmt}" + ('.gz' if compress else '')
+    return Response(stream_with_context(chunks), mimetype='application/gzip' if compress else FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Export-Watermark': '' if watermark is None else str(watermark)})
 
-@app.route('/toggle_block/<username>/<int:status>')
+@bank.route('/toggle_block/<username>/<int:status>')
 def toggle_block(username, status):
     user = db.get_user_by_name(username)
     if user['role'] == 'admin':
         flash('Нельзя блокировать админа', 'danger')
     else:
         db.set_block_status(username, status)
-    return redirect(url_for('admin_dash'))
+    return redirect(url_for('.admin_dash'))
 
-@app.route('/resolve_appeal/<int:appeal_id>/<username>')
+@bank.route('/resolve_appeal/<int:appeal_id>/<username>')
 def resolve_appeal(appeal_id, username):
     db.resolve_appeal(appeal_id, username)
     flash(f'Пользователь {username} разблокирован', 'success')
-    return redirect(url_for('admin_dash'))
+    return redirect(url_for('.admin_dash'))
+
+# --- CLI ---
+@bank.cli.command('init-db')
+def init_db_command():
+    """Создание и обновление схемы базы и начальные пользователи (при развертывании и после обновления кода)"""
+    version = services().init_db()
+    print(f"Схема базы: версия {version}")
+
+@bank.cli.command('accrue-interest')
+def accrue_interest_command():
+    """Ежедневное начисление процентов по всем активным кредитам (запускать по cron)"""
+    count = db.accrue_interest()
+    print(f"Начислены проценты по {count} кредитам")
+
+@bank.cli.command('reconcile')
+@click.option('--full', is_flag=True, help='Проверить все дни, а не только измененные после контрольной точки')
+def reconcile_command(full):
+    """Сверка дневных агрегатов с журналом операций и балансами счетов"""
+    report = db.reconcile(full=full)
+    print(f"Проверено дней: {report['checked_days']}, счетов: {report['checked_accounts']}")
+    for m in report['mismatches']:
+        shard = f"шард {m['shard']}: " if 'shard' in m else ''
+        print(f"  {shard}{m['account_number']} {m['day']}: {m['problem']} ожидалось {m['expected']}, в агрегатах {m['actual']}")
+    if report['mismatches']:
+        raise SystemExit(1)
+
+@bank.cli.command('ledger-snapshot')
+def ledger_snapshot_command():
+    """Снимок остатков по журналу проводок (запускать периодически, например по cron)"""
+    report = db.snapshot_ledger()
+    print(f"Проверено записей журнала: {report['events']}, снимок: {report['snapshot_id']}")
+    for p in report['problems']:
+        print(f"  запись {p['id']}: {p['problem']}")
+    if report['problems']:
+        raise SystemExit(1)
+
+@bank.cli.command('ledger-replay')
+@click.option('--full', is_flag=True, help='С начала журнала, а не от последнего снимка')
+@click.option('--no-verify', 'no_verify', is_flag=True, help='Без проверки цепочки хешей (быстрее)')
+@click.option('--rebuild', is_flag=True, help='Записать остатки журнала в accounts.balance')
+def ledger_replay_command(full, no_verify, rebuild):
+    """Воспроизведение журнала проводок и сверка с балансами счетов"""
+    started = time.perf_counter()
+    report = db.replay_ledger(full=full, verify=not no_verify, rebuild=rebuild)
+    elapsed = time.perf_counter() - started
+    print(f"Записей: {report['events']} за {elapsed:.1f} с ({report['events'] / max(elapsed, 1e-9):,.0f}/с), "
+          f"снимок: {report['snapshot']}")
+    for p in report['problems']:
+        print(f"  запись {p['id']}: {p['problem']}")
+    for m in report['mismatches']:
+        print(f"  {m['account_number']}: по журналу {m['expected']}, в accounts {m['actual']}")
+    if report['problems'] or (report['mismatches'] and not rebuild):
+        raise SystemExit(1)
+
+@bank.cli.command('recover-transfers')
+@click.option('--older-than', default=60, help='Пропускать переводы моложе стольких секунд')
+def recover_transfers_command(older_than):
+    """Завершение межшардовых переводов, прерванных сбоем (только при BANK_SHARDS > 1)"""
+    if current_app.config['BANK_SHARDS'] <= 1:
+        print("База не шардирована - незавершенных межшардовых переводов нет")
+        return
+    print(f"Завершено переводов: {db.recover_transfers(older_than=older_than)}")
+
+@bank.cli.command('resume-loan-jobs')
+@click.option('--older-than', default=600, help='Подхватывать задания без обновлений дольше стольких секунд')
+def resume_loan_jobs_command(older_than):
+    """Довыполнение заданий очереди решений по кредитам, брошенных упавшим воркером"""
+    resumed = loan_decisions.resume_stale(older_than)
+    loan_decisions.shutdown()
+    print(f"Довыполнено заданий: {len(resumed)}")
+
+@bank.cli.command('export')
+@click.argument('table')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Сжать выгрузку gzip')
+@click.option('--after', default=None, help='Выгрузить строки с ключом больше этого (watermark прошлой выгрузки)')
+@click.option('--since', default=None, help='Только операции начиная с даты YYYY-MM-DD')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='Файл (по умолчанию stdout)')
+def export_command(table, fmt, compress, after, since, output):
+    """Потоковая выгрузка transactions / accounts / users"""
+    try:
+        watermark, chunks = stream_export(db, table, fmt, compress=compress, after=after, since=_parse_date(since))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    out = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+    # В stderr, чтобы не смешивать с данными в stdout
+    click.echo(f"watermark: {watermark}", err=True)
+
+# Для gunicorn app:app и flask run: создание приложения базу не открывает
+app = create_app()
 
 if __name__ == '__main__':
+    # Локальный запуск: схема применяется сразу, без отдельного flask init-db
+    with app.app_context():
+        services().init_db()
     app.run(debug=True)
@@ -0,0 +1,79 @@
+"""Общие функции бенчмарков: перцентили, JSON-отчет и сравнение с сохраненным базовым замером.
+
+Используется bench_methods.py и load_test.py. Отчет - dict, который пишется в JSON как есть;
+сравнение проходит по парам (путь к числу, направление): для задержек хуже - больше,
+для пропускной способности - меньше.
+"""
+import json
+import math
+import platform
+import sys
+import time
+
+
+def percentile(sorted_samples, p):
+    # Ближайший ранг: значение, не меньше которого p% замеров
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[max(0, math.ceil(p / 100 * len(sorted_samples)) - 1)]
+
+
+def summarize(samples, scale=1000.0, unit='ms'):
+    """Секунды -> {count, mean, p50, p90, p95, p99, max} в unit (scale - множитель)"""
+    data = sorted(samples)
+    summary = {'count': len(data)}
+    if data:
+        summary[f'mean_{unit}'] = round(sum(data) / len(data) * scale, 3)
+        for p in (50, 90, 95, 99):
+            summary[f'p{p}_{unit}'] = round(percentile(data, p) * scale, 3)
+        summary[f'max_{unit}'] = round(data[-1] * scale, 3)
+    return summary
+
+
+def environment():
+    return {'python': sys.version.split()[0], 'platform': platform.platform(), 'machine': platform.machine(),
+            'at': time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def save(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _lookup(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def compare(current, baseline, checks, threshold):
+    """Регрессии относительно baseline: список {metric, baseline, current, change_pct}.
+
+    checks - [(путь ключей, 'lower'|'higher')]: какое направление лучше. threshold - допустимое
+    ухудшение в процентах; метрики, которых нет в одном из отчетов, пропускаются.
+    """
+    regressions = []
+    for path, better in checks:
+        old, new = _lookup(baseline, path), _lookup(current, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        if (change > threshold) if better == 'lower' else (-change > threshold):
+            regressions.append({'metric': '.'.join(path), 'baseline': old, 'current': new, 'change_pct': round(change, 1)})
+    return regressions
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"регрессий нет (порог {threshold}%)")
+        return
+    print(f"регрессии (порог {threshold}%):")
+    for r in regressions:
+        print(f"  {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']:+.1f}%)")
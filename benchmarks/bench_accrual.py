@@ -0,0 +1,47 @@
+"""Начисление процентов по всему кредитному портфелю одним пакетным проходом.
+
+    python benchmarks/bench_accrual.py --loans 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--loans', type=int, default=1_000_000)
+    parser.add_argument('--chunk', type=int, default=100_000)
+    args = parser.parse_args()
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'accrual.db'))
+    conn = db.get_connection()
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    rnd = random.Random(1)
+    started = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO loans (username, amount, term_months, status, created_at, remaining_amount, principal, product, annual_rate, last_accrual) "
+        "VALUES ('client', ?, 12, 'approved', ?, ?, ?, 'cash', 0.15, ?)",
+        ((a, yesterday, a, a, yesterday) for a in (rnd.randint(10_000, 5_000_000) for _ in range(args.loans))))
+    conn.commit()
+    print(f"загрузка {args.loans:,} кредитов: {time.perf_counter() - started:.1f} с")
+
+    before = conn.execute("SELECT SUM(remaining_amount) FROM loans").fetchone()[0]
+    started = time.perf_counter()
+    count = db.accrue_interest(chunk_size=args.chunk)
+    elapsed = time.perf_counter() - started
+    after = conn.execute("SELECT SUM(remaining_amount) FROM loans").fetchone()[0]
+
+    print(f"начисление: {count:,} кредитов за {elapsed:.2f} с ({count / elapsed:,.0f} кредитов/с)")
+    print(f"начислено процентов за день: {(after - before) / 100:,.2f} ₸")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Сравнение пакетных переводов (Database.bulk_transfer) с циклом по Database.transfer.
+
+    python benchmarks/bench_bulk_transfer.py --rows 20000 --accounts 1000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+
+
+def make_db(accounts):
+    db = Database(os.path.join(tempfile.mkdtemp(), 'bulk.db'))
+    numbers = [db.create_account('client', 'Текущий') for _ in range(accounts)]
+    for acc in numbers:
+        db.deposit(acc, 1_000_000)
+    return db, numbers
+
+
+def make_rows(numbers, count, seed=42):
+    rnd = random.Random(seed)
+    return [tuple(rnd.sample(numbers, 2)) + (rnd.randint(1, 1000),) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--loop-rows', type=int, default=2000, help='цикл transfer() медленный - меряем на меньшей выборке')
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--chunk', type=int, default=1000)
+    args = parser.parse_args()
+
+    db, numbers = make_db(args.accounts)
+    rows = make_rows(numbers, args.loop_rows)
+    started = time.perf_counter()
+    for from_acc, to_acc, amount in rows:
+        db.transfer(from_acc, to_acc, amount)
+    loop_rate = len(rows) / (time.perf_counter() - started)
+
+    db, numbers = make_db(args.accounts)
+    rows = make_rows(numbers, args.rows)
+    started = time.perf_counter()
+    report = db.bulk_transfer(rows, chunk_size=args.chunk)
+    bulk_rate = len(rows) / (time.perf_counter() - started)
+
+    print(f"transfer() в цикле: {loop_rate:,.0f} переводов/с")
+    print(f"bulk_transfer():    {bulk_rate:,.0f} переводов/с (успешно {sum(r.ok for r in report)} из {len(report)})")
+    print(f"ускорение: x{bulk_rate / loop_rate:.1f}")
+
+
+if __name__ == '__main__':
+    main()
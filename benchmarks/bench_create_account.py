@@ -0,0 +1,49 @@
+"""Время открытия счета в зависимости от числа уже существующих счетов.
+
+Таблица наполняется пачками через executemany, затем замеряется create_account().
+При выделении номеров через счетчик время не должно расти с размером таблицы.
+
+    python benchmarks/bench_create_account.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+
+
+def fill(db, count):
+    # Массовая вставка в обход create_account: номера берутся одним блоком из счетчика
+    conn = db.get_connection()
+    numbers = db.reserve_account_numbers(count, conn)
+    rows = ((acc, 'client', 'Текущий', 0, f"9{i:015d}", '000', '01/30') for i, acc in enumerate(numbers, start=random.randint(0, 10**9)))
+    conn.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'accounts.db'))
+    total = 0
+    for size in sorted(args.sizes):
+        fill(db, size - total)
+        total = size
+        started = time.perf_counter()
+        for _ in range(args.samples):
+            db.create_account('client', 'Текущий')
+        total += args.samples
+        per_call = (time.perf_counter() - started) / args.samples
+        print(f"счетов: {size:>10,}  create_account: {per_call * 1e6:8.1f} мкс")
+
+
+if __name__ == '__main__':
+    main()
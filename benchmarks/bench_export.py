@@ -0,0 +1,66 @@
+"""Скорость и память потоковой выгрузки transactions (export.stream_export).
+
+Пиковая память (tracemalloc) должна определяться размером пачки, а не числом строк:
+сравните --rows 100000 и --rows 5000000.
+
+    python benchmarks/bench_export.py --rows 5000000 --format jsonl --gzip
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database, TRANSACTION_INSERT
+from export import FORMATS, stream_export
+
+
+def run(db, args):
+    written = 0
+    with open(os.devnull, 'wb') as out:
+        _, chunks = stream_export(db, 'transactions', args.format, compress=args.gzip, batch_size=args.batch)
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'export.db'))
+    conn = db.get_connection()
+    rnd = random.Random(1)
+    started = time.perf_counter()
+    # Журнал заполняется напрямую: для выгрузки дневные агрегаты не нужны
+    conn.executemany(TRANSACTION_INSERT, (
+        (f"KZ{2000 + rnd.randint(1, 10_000)}", 'DEPOSIT', rnd.randint(100, 10_000_000), 'Пополнение',
+         '2026-01-01 12:00', 1767261600 + i) for i in range(args.rows)))
+    conn.commit()
+    print(f"загрузка {args.rows:,} операций: {time.perf_counter() - started:.1f} с")
+
+    started = time.perf_counter()
+    written = run(db, args)
+    elapsed = time.perf_counter() - started
+    print(f"выгрузка ({args.format}{', gzip' if args.gzip else ''}, пачка {args.batch}): {elapsed:.1f} с, "
+          f"{args.rows / elapsed:,.0f} строк/с, {written / 2 ** 20:,.1f} МБ")
+
+    # Отдельный прогон под tracemalloc (он замедляет выгрузку, поэтому скорость меряется без него)
+    tracemalloc.start()
+    run(db, args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"пиковая память выгрузки: {peak / 2 ** 20:.1f} МБ")
+
+
+if __name__ == '__main__':
+    main()
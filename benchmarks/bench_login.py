@@ -0,0 +1,74 @@
+"""Латентность входа (Database.get_user) при заданной стоимости хеша и конкурентности.
+
+    python benchmarks/bench_login.py --algorithm scrypt --n 16384 --concurrency 8 --logins 400
+    python benchmarks/bench_login.py --algorithm pbkdf2_sha256 --iterations 100000 --no-cache
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from passwords import PasswordHasher
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algorithm', default='scrypt')
+    parser.add_argument('--n', type=int, default=2 ** 14)
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--max-concurrent', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    hasher = PasswordHasher(algorithm=args.algorithm, n=args.n, iterations=args.iterations,
+                            max_concurrent=args.max_concurrent, cache_size=0 if args.no_cache else 1024)
+    db = Database(os.path.join(tempfile.mkdtemp(), 'login.db'), hasher=hasher)
+    for i in range(args.users):
+        db.create_user(f"user{i}", f"secret{i}", 'client', f"User {i}", f"user{i}@bank.kz")
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        for k in range(args.logins // args.concurrency):
+            i = (n * 7919 + k) % args.users
+            started = time.perf_counter()
+            assert db.get_user(f"user{i}", f"secret{i}") is not None
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'algorithm': args.algorithm,
+        'params': hasher._params(),
+        'concurrency': args.concurrency,
+        'cache': not args.no_cache,
+        'logins': len(latencies),
+        'logins_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
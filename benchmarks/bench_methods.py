@@ -0,0 +1,138 @@
+"""Микробенчмарки методов Database на синтетической базе (datagen.py): перцентили времени вызова.
+
+Каждый вызов замеряется отдельно; у пишущих методов каждый вызов - отдельная транзакция,
+как в приложении. Дашборды замеряются с холодным кэшем (снимок сбрасывается перед вызовом)
+и с теплым. Отчет - JSON (--output); с --baseline сравнивается p50 каждого метода, при
+ухудшении больше --threshold процентов код возврата 1.
+
+    python benchmarks/bench_methods.py --users 2000 --transactions 200000 --output methods.json
+    python benchmarks/bench_methods.py --baseline methods.json --threshold 25
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import baseline
+import datagen
+from db import Database
+from money import Money
+from passwords import PasswordHasher
+
+
+def cases(db, clients, rnd):
+    """(имя, функция от номера вызова, доля от --calls): тяжелые методы вызываются реже"""
+    names = list(clients)
+    accounts = [acc for c in clients.values() for acc in c['accounts']]
+    borrowers = [(acc, loan) for c in clients.values() if c['loans'] for acc in c['accounts'][:1] for loan in c['loans']]
+    today = date.today()
+    month = ((today - timedelta(days=30)).isoformat(), today.isoformat())
+    pending = []
+
+    def client(i):
+        return names[i % len(names)]
+
+    def cold_dashboard(i):
+        db.invalidate_clients(client(i))
+        return db.get_client_dashboard(client(i))
+
+    def cold_admin(i):
+        db.invalidate_admin()
+        return db.get_admin_dashboard()
+
+    def process_loan(i):
+        if not pending:
+            pending.extend(loan['id'] for loan in db.get_loans('pending', limit=1000))
+        return db.process_loans([pending.pop()], rnd.choice(('approved', 'rejected')))
+
+    return [
+        ('get_user', lambda i: db.get_user(client(i), datagen.PASSWORD), 0.5),
+        ('get_user_by_name', lambda i: db.get_user_by_name(client(i)), 1),
+        ('get_all_users', lambda i: db.get_all_users(), 0.05),
+        ('get_account', lambda i: db.get_account(accounts[i % len(accounts)]), 1),
+        ('get_client_accounts', lambda i: db.get_client_accounts(client(i)), 1),
+        ('get_client_dashboard (холодный)', cold_dashboard, 0.5),
+        ('get_client_dashboard (теплый)', lambda i: db.get_client_dashboard(names[0]), 1),
+        ('get_admin_dashboard (холодный)', cold_admin, 0.05),
+        ('get_history', lambda i: db.get_history(client(i)), 1),
+        ('get_history (TRANSFER_IN)', lambda i: db.get_history(client(i), types=['TRANSFER_IN']), 1),
+        ('get_statement (30 дней)', lambda i: db.get_statement(client(i), clients[client(i)]['accounts'][0], *month), 1),
+        ('get_daily_totals (30 дней)', lambda i: db.get_daily_totals(*month), 0.1),
+        ('get_loans (pending, 50)', lambda i: db.get_loans('pending', limit=50), 1),
+        ('count_loans', lambda i: db.count_loans('pending'), 1),
+        ('get_client_loans', lambda i: db.get_client_loans(client(i)), 1),
+        ('get_loan_schedule', lambda i: db.get_loan_schedule(borrowers[i % len(borrowers)][1]), 1),
+        ('get_open_appeals', lambda i: db.get_open_appeals(), 1),
+        ('deposit', lambda i: db.deposit(rnd.choice(accounts), Money(100)), 1),
+        ('transfer', lambda i: db.transfer(*rnd.sample(accounts, 2), Money(1)), 1),
+        ('bulk_transfer (100 строк)', lambda i: db.bulk_transfer([(*rnd.sample(accounts, 2), Money(1)) for _ in range(100)]), 0.2),
+        ('repay_loan', lambda i: db.repay_loan(*reversed(borrowers[i % len(borrowers)]), Money(1)), 1),
+        ('request_loan', lambda i: db.request_loan(client(i), Money(100_000_00), 12), 1),
+        ('process_loans (1 заявка)', process_loan, 0.5),
+        ('create_account', lambda i: db.create_account(client(i), 'Текущий'), 0.5),
+        ('create_user', lambda i: db.create_user(f"bench{time.perf_counter_ns()}", 'pw', 'client', 'Клиент', 'b@bank.kz'), 0.2),
+        ('create_appeal', lambda i: db.create_appeal(client(i), 'Прошу разблокировать'), 0.5),
+        ('reconcile (инкрементальная)', lambda i: db.reconcile(), 0.05),
+        ('replay_ledger (от снимка)', lambda i: db.replay_ledger(), 0.05),
+    ]
+
+
+def measure(func, calls, warmup):
+    for i in range(warmup):
+        func(i)
+    samples = []
+    for i in range(calls):
+        started = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=100_000)
+    parser.add_argument('--loans', type=int, default=2000)
+    parser.add_argument('--calls', type=int, default=300, help='вызовов на метод (тяжелым - доля от этого числа)')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help='подстроки имен методов')
+    parser.add_argument('--output', help='записать JSON-отчет в файл')
+    parser.add_argument('--baseline', help='JSON-отчет для сравнения')
+    parser.add_argument('--threshold', type=float, default=20.0, help='допустимое ухудшение p50, %%')
+    args = parser.parse_args()
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'methods.db'),
+                  hasher=PasswordHasher(algorithm='pbkdf2_sha256', iterations=1000))
+    started = time.perf_counter()
+    counts = datagen.generate(db, args.users, transactions=args.transactions, loans=args.loans)
+    db.snapshot_ledger()
+    print(f"данные: {counts}, {time.perf_counter() - started:.1f} с")
+
+    rnd = random.Random(2)
+    results = {}
+    for name, func, share in cases(db, datagen.workload(db), rnd):
+        if args.only and not any(part in name for part in args.only):
+            continue
+        results[name] = baseline.summarize(measure(func, max(3, int(args.calls * share)), args.warmup), 1e6, 'us')
+        s = results[name]
+        print(f"  {name:<34} p50 {s['p50_us']:>10,.1f} мкс  p95 {s['p95_us']:>10,.1f}  p99 {s['p99_us']:>10,.1f}  ({s['count']} вызовов)")
+
+    report = {'meta': {**baseline.environment(), 'data': counts}, 'methods': results}
+    if args.output:
+        baseline.save(report, args.output)
+    if args.baseline:
+        regressions = baseline.compare(report, baseline.load(args.baseline),
+                                       [(('methods', name, 'p50_us'), 'lower') for name in results], args.threshold)
+        baseline.print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Накладные расходы инструментирования (metrics.py).
+
+1. Запросы Flask: в одном процессе чередуются раунды одной и той же нагрузки на два приложения
+   из create_app() - с метриками и без, каждое со своей базой. Порядок режимов в раунде
+   случайный: иначе режим, идущий вторым, систематически проигрывает (GC, частота CPU).
+   Накладные расходы считаются попарно внутри раунда (процессорное время) и берется медиана:
+   так гасится дрейф скорости машины между раундами.
+2. Методы Database отдельно: минимум из повторов timeit - точнее, чем сквозной замер.
+
+    python benchmarks/bench_metrics.py --requests 600 --rounds 20
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def bench_requests(modes, requests, rounds):
+    clients = {}
+    for mode, (_, _, app) in modes.items():
+        clients[mode] = app.test_client()
+        clients[mode].post('/login', data={'username': 'client', 'password': 'client123'})
+    account = modes['off'][0].get_client_accounts('client')[0]['account_number']
+
+    def workload(client, n):
+        for i in range(n):
+            if i % 3 == 0:
+                client.post('/transaction', data={'action': 'deposit', 'account_number': account, 'amount': '1'})
+            elif i % 3 == 1:
+                client.get('/api/history?limit=20')
+            else:
+                client.get('/dashboard')
+
+    rnd = random.Random(1)
+    rates = {mode: [] for mode in modes}
+    for i in range(rounds + 1):
+        order = list(modes.items())
+        rnd.shuffle(order)
+        for mode, _ in order:
+            gc.collect()
+            started = time.process_time()
+            workload(clients[mode], requests)
+            if i:  # первый раунд - прогрев
+                rates[mode].append(requests / (time.process_time() - started))
+    overhead = statistics.median((off - on) / off * 100 for off, on in zip(rates['off'], rates['on']))
+    return {mode: statistics.median(values) for mode, values in rates.items()}, overhead
+
+
+def bench_calls(modes):
+    results = {}
+    for mode, (db, _, _) in modes.items():
+        calls = {
+            'get_client_accounts': lambda: db.get_client_accounts('client'),
+            'get_history': lambda: db.get_history('client', limit=20),
+            'get_client_dashboard': lambda: (db.invalidate_clients('client'), db.get_client_dashboard('client')),
+        }
+        results[mode] = {name: min(timeit.repeat(call, number=1000, repeat=15)) * 1000 for name, call in calls.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=600, help='запросов в раунде')
+    parser.add_argument('--rounds', type=int, default=20, help='раундов каждого режима')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update(BANK_METRICS='1', BANK_PASSWORD_ALGO='pbkdf2_sha256', BANK_PBKDF2_ITERATIONS='1000')
+    from app import create_app
+
+    modes = {}
+    for mode, enabled in (('off', False), ('on', True)):
+        app = create_app({'BANK_DATABASE': f'{mode}.db', 'BANK_METRICS': enabled})
+        services = app.extensions['bank']
+        services.init_db()
+        modes[mode] = (services.db, services.metrics, app)
+
+    rates, overhead = bench_requests(modes, args.requests, args.rounds)
+    print(f"запросы без метрик: {rates['off']:,.0f}/с, с метриками: {rates['on']:,.0f}/с, "
+          f"накладные расходы: {overhead:.2f}% (цель < 2%)")
+
+    calls = bench_calls(modes)
+    for name in calls['off']:
+        off, on = calls['off'][name], calls['on'][name]
+        print(f"  {name:<22} {off:7.1f} мкс -> {on:7.1f} мкс ({on - off:+.1f} мкс)")
+
+
+if __name__ == '__main__':
+    main()
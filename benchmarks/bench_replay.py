@@ -0,0 +1,82 @@
+"""Скорость воспроизведения журнала проводок (ledger.py), событий в секунду.
+
+Журнал заполняется синтетическими переводами между --accounts счетами, затем замеряются:
+полное воспроизведение с проверкой цепочки хешей, без проверки (суммирование в SQLite)
+и от снимка с хвостом --tail записей. По скорости оценивается время на 100 млн событий.
+
+    python benchmarks/bench_replay.py --events 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger
+from db import Database
+from passwords import PasswordHasher
+
+
+def fill(db, events, accounts, posting_size):
+    rnd = random.Random(1)
+    numbers = [f"KZ{n}" for n in range(1, accounts + 1)]
+    conn = db.get_connection()
+    ts = int(time.time())
+    written = 0
+    while written < events:
+        entries = []
+        for _ in range(min(posting_size, events - written) // 2):
+            src, dst = rnd.sample(numbers, 2)
+            amount = rnd.randint(1, 10_000)
+            entries += [(src, -amount, 'TRANSFER_OUT'), (dst, amount, 'TRANSFER_IN')]
+        with conn:
+            ledger.append(conn.cursor(), entries, ts)
+        written += len(entries)
+
+
+def timed(label, events, func):
+    started = time.perf_counter()
+    balances, report = func()
+    elapsed = time.perf_counter() - started
+    rate = report['events'] / elapsed
+    print(f"  {label:<34} {report['events']:>11,} событий за {elapsed:6.2f} с: {rate:>11,.0f}/с "
+          f"(100 млн - ~{1e8 / rate / 60:.0f} мин), проблем: {len(report['problems'])}")
+    return balances
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--posting-size', type=int, default=2000, help='записей в одной проводке при заполнении')
+    parser.add_argument('--tail', type=int, default=100_000, help='записей после снимка')
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'replay.db')
+    db = Database(path, hasher=PasswordHasher(algorithm='pbkdf2_sha256', iterations=1000))
+    started = time.perf_counter()
+    fill(db, args.events, args.accounts, args.posting_size)
+    print(f"заполнение {args.events:,} событий: {time.perf_counter() - started:.1f} с, "
+          f"файл {os.path.getsize(path) / 2 ** 20:.0f} МБ")
+
+    conn = db.get_connection()
+    full = timed('полное, с проверкой цепочки', args.events,
+                 lambda: ledger.replay(conn, full=True, batch_size=args.batch_size))
+    fast = timed('полное, без проверки', args.events,
+                 lambda: ledger.replay(conn, full=True, verify=False, batch_size=args.batch_size))
+    assert {k: v for k, v in full.items() if v} == {k: v for k, v in fast.items() if v}
+
+    db.snapshot_ledger(batch_size=args.batch_size)
+    fill(db, args.tail, args.accounts, args.posting_size)
+    tail = timed('от снимка + хвост, с проверкой', args.tail,
+                 lambda: ledger.replay(conn, batch_size=args.batch_size))
+    again = ledger.replay(conn, full=True, verify=False, batch_size=args.batch_size)[0]
+    assert {k: v for k, v in tail.items() if v} == {k: v for k, v in again.items() if v}
+
+
+if __name__ == '__main__':
+    main()
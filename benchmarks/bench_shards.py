@@ -0,0 +1,91 @@
+"""Пропускная способность записи в зависимости от числа шардов (sharding.py).
+
+Несколько процессов-воркеров (как воркеры gunicorn) одновременно проводят переводы между
+случайными счетами. Внутри одного файла SQLite записи идут строго по очереди, шарды пишутся
+параллельно - на многоядерной машине рост должен быть близок к линейному, пока шардов не
+больше, чем ядер. --cross - доля межшардовых (трехшаговых) переводов.
+
+    python benchmarks/bench_shards.py --shards 1 2 4 --workers 4 --transfers 2000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher
+from sharding import ShardedDatabase
+
+hasher = PasswordHasher(algorithm='pbkdf2_sha256', iterations=1000)
+
+
+def open_db(path, args, recover=False):
+    return ShardedDatabase(path, shards=args.count, recover=recover, hasher=hasher, synchronous=args.synchronous,
+                           pool_size=2)
+
+
+def worker(path, args, accounts, seed, start):
+    db = open_db(path, args)
+    rnd = random.Random(seed)
+    by_shard = {}
+    for acc in accounts:
+        by_shard.setdefault(db.shard_for_account(acc), []).append(acc)
+    groups = [group for group in by_shard.values() if len(group) > 1]
+    start.wait()
+    for _ in range(args.transfers):
+        if rnd.random() < args.cross:
+            src, dst = rnd.sample(accounts, 2)
+        else:
+            src, dst = rnd.sample(rnd.choice(groups), 2)
+        db.transfer(src, dst, rnd.randint(1, 100))
+
+
+def run(args, count):
+    args.count = count
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = open_db(path, args, recover=True)
+    accounts = []
+    for i in range(args.accounts):
+        db.create_user(f'user{i}', 'pw', 'client', f'Клиент {i}', f'user{i}@bank.kz')
+        accounts.append(db.get_client_accounts(f'user{i}')[0]['account_number'])
+        db.deposit(accounts[-1], 1_000_000)
+
+    def total():
+        return sum(db.get_account(acc)['balance'] for acc in accounts)
+
+    before = total()
+    start = multiprocessing.Barrier(args.workers + 1)
+    procs = [multiprocessing.Process(target=worker, args=(path, args, accounts, i, start)) for i in range(args.workers)]
+    for p in procs: p.start()
+    start.wait()
+    started = time.perf_counter()
+    for p in procs: p.join()
+    elapsed = time.perf_counter() - started
+    done = args.workers * args.transfers
+    return done / elapsed, total() - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=4, help='процессов-воркеров')
+    parser.add_argument('--transfers', type=int, default=2000, help='переводов на воркер')
+    parser.add_argument('--accounts', type=int, default=64)
+    parser.add_argument('--cross', type=float, default=0.0, help='доля межшардовых переводов')
+    parser.add_argument('--synchronous', default='NORMAL', help='PRAGMA synchronous шардов (FULL - fsync на каждый коммит)')
+    args = parser.parse_args()
+
+    print(f"ядер: {os.cpu_count()}, воркеров: {args.workers}, межшардовых: {args.cross:.0%}, synchronous={args.synchronous}")
+    base = None
+    for count in args.shards:
+        rate, drift = run(args, count)
+        base = base or rate
+        print(f"  шардов {count}: {rate:,.0f} переводов/с (x{rate / base:.2f}), расхождение суммы: {drift}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""Шина событий /events (events.py): тысячи простаивающих подписчиков на одном воркере.
+
+--subscribers подписчиков (каждый - свой клиент) ждут событий в одном потоке asyncio через
+Subscription.astream(), как под ASGI-сервером; с --mode threads каждый ждет в своем потоке,
+как под gunicorn -k gthread. Замеряются:
+- память на подписчика (tracemalloc: очередь, подписка и задача/поток ожидания);
+- задержка доставки: от publish_changes() до получения события подписчиком, для --events
+  проводок по случайным клиентам;
+- цена публикации на пути проводки: deposit() без шины и с шиной, на которую подписаны
+  все клиенты, кроме владельца счета (изменения собираются, но никому не отправляются);
+- медленный читатель: подписчик не читает, пока публикуется больше --overflows очередей по --buffer
+  байт; очередь не растет сверх --buffer, вместо пропущенных событий он получает resync.
+
+Проверяется (код 1, если что-то не так): доставлены все события без переполнений и подписки сняты;
+медленный читатель переполнился --overflows раз, очередь не превысила --buffer, а прочитал он
+resync и только события после последнего переполнения. Задержки и цена публикации только печатаются.
+
+    python benchmarks/bench_sse.py --subscribers 5000 --events 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from events import RESYNC, EventBus
+from money import Money
+from passwords import PasswordHasher
+
+
+def change(username, n):
+    acc = f"KZ{n}"
+    return {'owners': {acc: username}, 'balances': {acc: 1000 + n},
+            'history': [(acc, 'DEPOSIT', 100, 'Пополнение', '2025-01-01 00:00', 0)]}
+
+
+def publish_all(bus, names, count, seed, sent):
+    # Публикация из отдельного потока - как из обработчика запроса, проводящего операцию
+    rnd = random.Random(seed)
+    for n in range(count):
+        username = rnd.choice(names)
+        sent.setdefault(username, []).append(time.perf_counter())
+        bus.publish_changes(**change(username, n))
+        if n % 100 == 0:
+            time.sleep(0.001)
+
+
+async def run_asyncio(bus, names, args):
+    latencies, done = [], asyncio.Event()
+    expected = {'count': args.events}
+
+    async def reader(sub, sent):
+        async for chunk in sub.astream(heartbeat=args.heartbeat):
+            received = time.perf_counter()
+            for _ in range(chunk.count(b'event: balance')):
+                latencies.append(received - sent[sub.username].pop(0))
+                expected['count'] -= 1
+            if expected['count'] <= 0:
+                done.set()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sent = {}
+    subs = [bus.subscribe(name) for name in names]
+    tasks = [asyncio.create_task(reader(sub, sent)) for sub in subs]
+    await asyncio.sleep(0.1)  # все читатели дошли до ожидания
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    publisher = threading.Thread(target=publish_all, args=(bus, names, args.events, args.seed, sent))
+    publisher.start()
+    try:
+        await asyncio.wait_for(done.wait(), 60)
+    except asyncio.TimeoutError:
+        pass  # недоставленные события видны в проверке доставки
+    elapsed = time.perf_counter() - started
+    publisher.join()
+    for sub in subs:
+        sub.close()
+    await asyncio.gather(*tasks)
+    return memory, latencies, elapsed
+
+
+def run_threads(bus, names, args):
+    latencies, lock, sent = [], threading.Lock(), {}
+    remaining = threading.Semaphore(0)
+
+    def reader(sub):
+        for chunk in sub.stream(heartbeat=args.heartbeat):
+            received = time.perf_counter()
+            for _ in range(chunk.count(b'event: balance')):
+                with lock:
+                    latencies.append(received - sent[sub.username].pop(0))
+                remaining.release()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subs = [bus.subscribe(name) for name in names]
+    # Стек потока - вне кучи Python, tracemalloc его не видит (это виртуальная память, см. -k gthread)
+    threads = [threading.Thread(target=reader, args=(sub,), daemon=True) for sub in subs]
+    for t in threads: t.start()
+    time.sleep(0.2)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    publish_all(bus, names, args.events, args.seed, sent)
+    for _ in range(args.events):
+        remaining.acquire()
+    elapsed = time.perf_counter() - started
+    for sub in subs:
+        sub.close()
+    for t in threads: t.join()
+    return memory, latencies, elapsed
+
+
+def posting_cost(args):
+    """p50 deposit() в мкс: без шины и с шиной, где подписаны другие клиенты"""
+    results = {}
+    for label, bus in (('без шины', None), ('шина, владелец не подписан', EventBus())):
+        db = Database(os.path.join(tempfile.mkdtemp(), 'sse.db'), events=bus,
+                      hasher=PasswordHasher(algorithm='pbkdf2_sha256', iterations=1000))
+        acc = db.get_client_accounts('client')[0]['account_number']
+        subs = [bus.subscribe(f"user{i}") for i in range(args.subscribers)] if bus else []
+        samples = []
+        for _ in range(args.deposits):
+            started = time.perf_counter()
+            db.deposit(acc, Money(100))
+            samples.append(time.perf_counter() - started)
+        results[label] = statistics.median(samples) * 1e6
+        for sub in subs:
+            sub.close()
+        db.close()
+    return results
+
+
+def slow_reader(args):
+    """Подписчик не читает, пока очередь не переполнится args.overflows раз, затем читает все разом.
+
+    Число событий подбирается по --buffer, а не по --events: иначе при малом --events переполнения
+    не было бы вовсе. tail - события, опубликованные после последнего переполнения: только они
+    (после resync) и должны дойти до читателя.
+    """
+    bus = EventBus(max_bytes=args.buffer)
+    sub = bus.subscribe('slow')
+    published = tail = peak = 0
+    # Любое событие длиннее resync, так что за limit публикаций очередь переполнилась бы с запасом;
+    # предел нужен, чтобы сломанное переполнение давало FAIL, а не бесконечный цикл
+    limit = (args.overflows + 1) * (args.buffer // len(RESYNC) + 1)
+    while (bus.stats()['overflows'] < args.overflows or tail < 3) and published < limit:
+        overflows = bus.stats()['overflows']
+        bus.publish_changes(**change('slow', published))
+        published += 1
+        tail = 0 if bus.stats()['overflows'] > overflows else tail + 1
+        peak = max(peak, bus.stats()['queued_bytes'])
+    stats = bus.stats()
+    chunk = sub.get(0)
+    sub.close()
+    return {'published': published, 'tail': tail, 'peak': peak, 'overflows': stats['overflows'],
+            'starts_with_resync': chunk.startswith(RESYNC), 'resyncs': chunk.count(b'event: resync'),
+            'balances': chunk.count(b'event: balance')}
+
+
+def expect(failures, ok, message):
+    print(f"  [{'ok' if ok else 'FAIL':>4}] {message}")
+    if not ok:
+        failures.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=2000, help='проводок (событий balance) для замера доставки')
+    parser.add_argument('--mode', choices=('asyncio', 'threads'), default='asyncio')
+    parser.add_argument('--heartbeat', type=float, default=15.0)
+    parser.add_argument('--buffer', type=int, default=64 * 1024, help='байт в очереди подписчика')
+    parser.add_argument('--overflows', type=int, default=3, help='переполнений очереди медленного читателя')
+    parser.add_argument('--deposits', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    failures = []
+    names = [f"user{i}" for i in range(args.subscribers)]
+    bus = EventBus(max_subscribers=args.subscribers, max_bytes=args.buffer)
+    if args.mode == 'asyncio':
+        memory, latencies, elapsed = asyncio.run(run_asyncio(bus, names, args))
+    else:
+        memory, latencies, elapsed = run_threads(bus, names, args)
+    latencies.sort()
+    stats = bus.stats()
+    print(f"{args.mode}: подписчиков {args.subscribers:,}, память {memory / args.subscribers:,.0f} байт на подписчика "
+          f"({memory / 2 ** 20:.1f} МБ)")
+    if latencies:
+        print(f"  доставлено {len(latencies):,} из {args.events:,} за {elapsed:.2f} с: задержка p50 "
+              f"{latencies[len(latencies) // 2] * 1000:.2f} мс, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} мс, "
+              f"макс {latencies[-1] * 1000:.2f} мс")
+    expect(failures, len(latencies) == args.events, f"доставлено событий: {len(latencies):,} из {args.events:,}")
+    expect(failures, stats['overflows'] == 0, f"переполнений у читающих подписчиков: {stats['overflows']}")
+    expect(failures, stats['subscribers'] == 0, f"подписчиков после закрытия: {stats['subscribers']}")
+
+    for label, p50 in posting_cost(args).items():
+        print(f"  deposit, {label:<28} p50 {p50:8.1f} мкс")
+
+    slow = slow_reader(args)
+    print(f"  медленный читатель: опубликовано {slow['published']:,} событий, пик очереди {slow['peak']:,} байт "
+          f"(лимит {args.buffer:,}), переполнений {slow['overflows']}, после последнего - {slow['tail']}")
+    expect(failures, slow['overflows'] >= args.overflows, f"переполнений очереди: {slow['overflows']}")
+    expect(failures, slow['peak'] <= args.buffer, f"пик очереди {slow['peak']:,} байт в пределах лимита {args.buffer:,}")
+    expect(failures, slow['starts_with_resync'] and slow['resyncs'] == 1,
+           f"прочитано resync: {slow['resyncs']}, первым событием: {slow['starts_with_resync']}")
+    expect(failures, slow['balances'] == slow['tail'], f"событий balance после resync: {slow['balances']} из {slow['tail']}")
+
+    if failures:
+        print(f"проверок не пройдено: {len(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Холодный старт воркеров: время до готовности и до первого ответа при одновременном старте.
+
+--workers процессов стартуют одновременно, как воркеры gunicorn, на общей базе.
+eager - прежнее поведение: каждый воркер при старте применяет миграции и создает начальных
+пользователей (init_db), на шардированной базе еще и берет блокировку записи каждого шарда.
+lazy - create_app() не трогает базу, первый запрос открывает ее одной проверкой версии схемы.
+Схему заранее создает flask init-db (его время печатается отдельно). С --fresh eager стартует
+на пустой базе - как первое развертывание без init-db: воркеры выстраиваются в очередь за
+блокировкой записи на миграциях, а проверка и вставка начальных пользователей в разных
+воркерах гонятся друг с другом (проигравший падает на UNIQUE).
+
+    python benchmarks/bench_startup.py --workers 8 --shards 1 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+
+
+def worker(mode, config, start, results):
+    start.wait()
+    started, cpu = time.perf_counter(), time.process_time()
+    try:
+        app = create_app(config)
+        if mode == 'eager':
+            app.extensions['bank'].init_db()
+        booted, boot_cpu = time.perf_counter(), time.process_time()
+        response = app.test_client().post('/login', data={'username': 'client', 'password': 'client123'})
+        results.put((booted - started, boot_cpu - cpu, time.perf_counter() - booted, response.status_code == 302))
+    except Exception as e:
+        # eager на пустой базе: соседний воркер успел создать тех же начальных пользователей
+        print(f"  воркер {os.getpid()}: {type(e).__name__}: {e}")
+        results.put(None)
+
+
+def run(mode, args, shards):
+    config = {'BANK_DATABASE': os.path.join(tempfile.mkdtemp(), 'bank_system.db'), 'BANK_SHARDS': shards,
+              'BANK_METRICS': False, 'BANK_PASSWORD_ALGO': 'pbkdf2_sha256', 'BANK_PBKDF2_ITERATIONS': 1000}
+    init = None
+    if mode == 'lazy' or not args.fresh:
+        started = time.perf_counter()
+        create_app(config).extensions['bank'].init_db()
+        init = time.perf_counter() - started
+
+    # fork: модуль app уже импортирован, время импорта Flask в замер не входит
+    ctx = multiprocessing.get_context('fork')
+    start, results = ctx.Barrier(args.workers + 1), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(mode, config, start, results)) for _ in range(args.workers)]
+    for p in procs: p.start()
+    start.wait()
+    rows = [results.get() for _ in procs]
+    for p in procs: p.join()
+    done = [row for row in rows if row and row[3]]
+    return init, [row[:3] for row in done], len(rows) - len(done)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--fresh', action='store_true', help='eager - на пустой базе, без init-db')
+    args = parser.parse_args()
+
+    # На машине с меньшим числом ядер, чем воркеров, время старта растет и от очереди за CPU -
+    # поэтому рядом печатается процессорное время старта
+    print(f"воркеров: {args.workers}, ядер: {os.cpu_count()}")
+    for shards in args.shards:
+        for mode in ('eager', 'lazy'):
+            init, rows, failed = run(mode, args, shards)
+            line = f"  шардов {shards}, {mode:<5}:"
+            if rows:
+                boot, cpu, first = (sorted(values) for values in zip(*rows))
+                line += (f" старт медиана {statistics.median(boot) * 1000:7.2f} мс, макс {boot[-1] * 1000:7.2f} "
+                         f"(CPU {statistics.median(cpu) * 1000:6.2f} мс); первый запрос медиана {statistics.median(first) * 1000:7.2f} мс, "
+                         f"макс {first[-1] * 1000:7.2f}")
+            if failed:
+                line += f" упало воркеров: {failed}"
+            if init is not None and mode == 'lazy':
+                line += f" (init-db {init * 1000:.0f} мс)"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Проверка разбора файлов массового перевода (bulk_upload.py) на испорченных файлах.
+
+1. iter_json_array на корректных и испорченных массивах (оборванный массив, мусор после ']',
+   пропущенная или лишняя запятая, слишком длинный элемент) - при каждом размере куска из
+   --chunk-sizes, чтобы граница буфера попадала в любое место элемента;
+2. iter_transfer_rows: элементы-не объекты (числа, строки, null, массивы) в .json и .jsonl -
+   некорректные строки, заголовок CSV пропускается, файл не того формата - ValueError.
+
+Каждая проверка печатает ok/FAIL, при любой FAIL скрипт завершается с кодом 1.
+
+    python benchmarks/check_bulk_upload.py
+"""
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.datastructures import FileStorage
+
+from bulk_upload import iter_json_array, iter_transfer_rows
+from money import Money
+
+ROW = '{"from": "KZ2001", "to": "KZ2002", "amount": "10.50"}'
+ITEM = {'from': 'KZ2001', 'to': 'KZ2002', 'amount': '10.50'}
+VALID = ('KZ2001', 'KZ2002', Money(1050))
+INVALID = (None, None, None)
+
+# (название, текст, ожидаемые элементы; None - некорректный элемент, на котором разбор закончился)
+ARRAYS = [
+    ('пустой массив', ' [ ] \n', []),
+    ('два элемента', f'[{ROW},\n {ROW}]', [ITEM, ITEM]),
+    ('число на границе куска', '[1234567890, 0.5, -3, 1e5, 2E-3]', [1234567890, 0.5, -3, 1e5, 2E-3]),
+    ('оборван внутри элемента', f'[{ROW}, {ROW[:20]}', [ITEM, None]),
+    ('оборван после запятой', f'[{ROW},', [ITEM, None]),
+    ('нет закрывающей скобки', f'[{ROW}', [ITEM, None]),
+    ('оборван после числа', '[1, 2', [1, 2, None]),
+    ('лишняя запятая', f'[{ROW},]', [ITEM, None]),
+    ('пропущена запятая', f'[{ROW} {ROW}]', [ITEM, None]),
+    ('мусор после массива', f'[{ROW}] xyz', [ITEM, None]),
+    ('вторая закрывающая скобка', f'[{ROW}]]', [ITEM, None]),
+    ('второй массив после первого', f'[{ROW}][{ROW}]', [ITEM, None]),
+    ('мусор после пустого массива', '[] 1', [None]),
+    ('пробелы после массива', f'[{ROW}]\n\n  ', [ITEM]),
+    ('слишком длинный элемент', '[{"from": "' + 'x' * 300 + '"}]', [None]),
+]
+
+# (название, имя файла, содержимое, ожидаемые строки)
+FILES = [
+    ('json: элементы-не объекты', 't.json', f'[1, "KZ2001", null, ["KZ2001", "KZ2002", "10.50"], {ROW}]',
+     [INVALID] * 4 + [VALID]),
+    ('json: объект без полей и с плохой суммой', 't.json', '[{}, {"from": "KZ2001", "to": "KZ2002", "amount": "abc"}]',
+     [INVALID, ('KZ2001', 'KZ2002', None)]),
+    ('json: оборванный массив', 't.json', f'[{ROW}, {{"from": "KZ', [VALID, INVALID]),
+    ('json: мусор после массива', 't.json', f'[{ROW}]garbage', [VALID, INVALID]),
+    ('jsonl: не объекты и испорченная строка', 't.jsonl', f'{ROW}\n[1, 2, 3]\n42\n{{"from":\n\n{ROW}\n',
+     [VALID, INVALID, INVALID, INVALID, VALID]),
+    ('csv: заголовок и короткая строка', 't.csv', 'from,to,amount\nKZ2001,KZ2002,10.50\nKZ2001\n', [VALID, INVALID]),
+]
+
+NOT_ARRAYS = [('пустой файл', ''), ('объект вместо массива', ROW), ('текст', 'from,to,amount')]
+
+
+def expect(failures, ok, message):
+    print(f"[{'ok' if ok else 'FAIL':>4}] {message}")
+    if not ok:
+        failures.append(message)
+
+
+def upload(name, content):
+    return FileStorage(stream=io.BytesIO(content.encode()), filename=name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[1, 2, 3, 7, 64, 64 * 1024])
+    args = parser.parse_args()
+    failures = []
+
+    for title, text, expected in ARRAYS:
+        wrong = {}
+        for size in args.chunk_sizes:
+            got = list(iter_json_array(io.StringIO(text), chunk_size=size, max_item=256))
+            if got != expected:
+                wrong[size] = got
+        expect(failures, not wrong, f"массив, {title}" + (f": {wrong}" if wrong else ''))
+
+    for title, text in NOT_ARRAYS:
+        try:
+            list(iter_json_array(io.StringIO(text)))
+            raised = False
+        except ValueError:
+            raised = True
+        expect(failures, raised, f"не массив, {title}: ValueError")
+
+    for title, name, content, expected in FILES:
+        got = list(iter_transfer_rows(upload(name, content)))
+        expect(failures, got == expected, title + ('' if got == expected else f": {got}"))
+
+    if failures:
+        print(f"проверок не пройдено: {len(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
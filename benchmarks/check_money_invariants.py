@@ -0,0 +1,114 @@
+"""Проверка точности денежной арифметики на случайных проводках (property-based, без внешних библиотек).
+
+1. Миллионы случайных сумм: Money (целые тиыны) против Decimal - расхождение должно быть нулевым,
+   parse(format(x)) должен возвращать x (и для отрицательных сумм), а сложение и вычитание с float -
+   бросать TypeError.
+2. Случайные переводы через Database.bulk_transfer: часть переводов проходит, сумма балансов
+   не меняется, отрицательных балансов нет, баланс каждого счета в точности равен сумме его операций
+   из transactions, а Database.reconcile() не находит расхождений в дневных агрегатах.
+
+Выполняются все проверки; каждая печатает ok/FAIL, при любой FAIL скрипт завершается с кодом 1.
+
+    python benchmarks/check_money_invariants.py --postings 2000000 --transfers 200000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from money import Money
+
+CREDIT_TYPES = ('DEPOSIT', 'TRANSFER_IN', 'LOAN_APPROVED')
+
+
+def expect(failures, ok, message):
+    print(f"[{'ok' if ok else 'FAIL':>4}] {message}")
+    if not ok:
+        failures.append(message)
+
+
+def check_arithmetic(count, rnd, failures):
+    total, reference = Money(0), Decimal(0)
+    roundtrip = []
+    for _ in range(count):
+        text = f"{rnd.choice(('', '-'))}{rnd.randint(0, 10_000_000)}.{rnd.randint(0, 99):02d}"
+        amount = Money.parse(text)
+        if rnd.random() < 0.5:
+            total, reference = total + amount, reference + Decimal(text)
+        else:
+            total, reference = total - amount, reference - Decimal(text)
+        if Money.parse(amount.format(2).replace(',', '')) != amount and len(roundtrip) < 5:
+            roundtrip.append(text)
+    drift = total.to_decimal() - reference
+    expect(failures, drift == 0 and type(total) is Money,
+           f"арифметика: {count:,} проводок, расхождение с Decimal: {drift}, тип суммы: {type(total).__name__}")
+    expect(failures, not roundtrip, f"format/parse: не сходятся {roundtrip or 'нет'}")
+
+    leaked = []
+    for name, op in (('Money + float', lambda m: m + 0.5), ('float + Money через __radd__', lambda m: m.__radd__(0.5)),
+                     ('Money - float', lambda m: m - 0.5), ('float - Money через __rsub__', lambda m: m.__rsub__(0.5))):
+        try:
+            op(Money(100))
+            leaked.append(name)
+        except TypeError:
+            pass
+    expect(failures, not leaked, f"float в арифметике Money: без TypeError {leaked or 'нет'}")
+
+
+def check_ledger(count, accounts, rnd, failures):
+    db = Database(os.path.join(tempfile.mkdtemp(), 'money.db'))
+    numbers = [db.create_account('client', 'Текущий') for _ in range(accounts)]
+    for acc in numbers:
+        db.deposit(acc, Money.tenge(rnd.randint(1_000, 100_000)))
+
+    conn = db.get_connection()
+    before = conn.execute("SELECT SUM(balance) FROM accounts").fetchone()[0]
+    rows = [(*rnd.sample(numbers, 2), Money(rnd.randint(1, 5_000_00))) for _ in range(count)]
+    started = time.perf_counter()
+    report = db.bulk_transfer(rows)
+    elapsed = time.perf_counter() - started
+    succeeded = sum(r.ok for r in report)
+    print(f"журнал: {count:,} переводов за {elapsed:.1f} с, успешно {succeeded:,}")
+
+    after = conn.execute("SELECT SUM(balance) FROM accounts").fetchone()[0]
+    negative = conn.execute("SELECT COUNT(*) FROM accounts WHERE balance < 0").fetchone()[0]
+    mismatched = conn.execute(f'''
+        SELECT COUNT(*) FROM accounts a
+        WHERE a.balance != (SELECT COALESCE(SUM(CASE WHEN t.type IN ({','.join('?' * len(CREDIT_TYPES))}) THEN t.amount ELSE -t.amount END), 0)
+                            FROM transactions t WHERE t.account_number = a.account_number)''', CREDIT_TYPES).fetchone()[0]
+    reconciled = db.reconcile(full=True)
+    # Без успешных переводов остальные инварианты выполнялись бы тривиально
+    expect(failures, len(report) == count and succeeded > 0, f"отчет: {len(report):,} строк, успешных переводов {succeeded:,}")
+    expect(failures, before == after, f"сумма балансов: до {before}, после {after}")
+    expect(failures, negative == 0, f"счетов с отрицательным балансом: {negative}")
+    expect(failures, mismatched == 0, f"счетов, чей баланс не равен сумме операций: {mismatched}")
+    expect(failures, not reconciled['mismatches'], f"расхождений в дневных агрегатах: {len(reconciled['mismatches'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--postings', type=int, default=2_000_000)
+    parser.add_argument('--transfers', type=int, default=200_000)
+    parser.add_argument('--accounts', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print(f"seed: {seed}")
+    rnd = random.Random(seed)
+    failures = []
+    check_arithmetic(args.postings, rnd, failures)
+    check_ledger(args.transfers, args.accounts, rnd, failures)
+    if failures:
+        print(f"проверок не пройдено: {len(failures)} (повтор: --seed {seed})")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Проверка планов горячих запросов: падает (код 1), если какой-то запрос делает SCAN таблицы
+или сортирует во временном B-дереве.
+
+Проверяются два списка:
+1. migrations.HOT_QUERIES - тексты горячих запросов;
+2. запросы, которые действительно выполняют методы Database (перехват через set_trace_callback).
+   Так изменение SQL в db.py не пройдет мимо проверки, даже если HOT_QUERIES забыли обновить.
+   Метод, у которого не перехвачено ни одного SELECT, - тоже ошибка: иначе проверка прошла бы впустую.
+
+    python benchmarks/check_query_plans.py [путь к базе]
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from migrations import HOT_QUERIES, bad_plan, check_query_plans, explain
+
+# Методы Database за дашбордами и выписками; аргументы - из начальных данных (SEED_USERS)
+HOT_CALLS = {
+    'get_history': lambda db: db.get_history('client'),
+    'get_client_accounts': lambda db: db.get_client_accounts('client'),
+    'get_loans': lambda db: db.get_loans('pending', limit=50, after_id=0),
+    'count_loans': lambda db: db.count_loans('pending'),
+    'get_client_loans': lambda db: db.get_client_loans('client'),
+    'get_open_appeals': lambda db: db.get_open_appeals(),
+    'get_statement': lambda db: db.get_statement('client', 'KZ2001', '2026-01-01', '2026-01-31'),
+    'get_daily_totals': lambda db: db.get_daily_totals('2026-01-01', '2026-01-31'),
+}
+
+
+def traced_queries(db, conn, call):
+    # SELECT, выполненные вызовом call(db), без повторов; параметры SQLite подставляет в текст сам
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in dict.fromkeys(statements) if sql.lstrip().upper().startswith('SELECT')]
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tempfile.mkdtemp(), 'plans.db')
+    db = Database(path)
+    conn = db.get_connection()
+    failures = 0
+
+    offenders = check_query_plans(conn)
+    for name, (sql, params) in HOT_QUERIES.items():
+        status = 'SCAN' if name in offenders else 'ok'
+        print(f"[{status:>4}] {name}: {' | '.join(explain(conn, sql, params))}")
+    failures += len(offenders)
+
+    for name, call in HOT_CALLS.items():
+        queries = traced_queries(db, conn, call)
+        if not queries:
+            print(f"[FAIL] Database.{name}: не перехвачено ни одного SELECT")
+            failures += 1
+        for sql in queries:
+            plan = explain(conn, sql)
+            status = 'SCAN' if bad_plan(plan) else 'ok'
+            failures += status != 'ok'
+            print(f"[{status:>4}] Database.{name}: {' '.join(sql.split())[:80]}\n         {' | '.join(plan)}")
+
+    print(f"проблемных запросов: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Синтетические данные для бенчмарков и нагрузочного теста: клиенты, счета, операции и кредиты.
+
+В отличие от seed_data/create_user (INSERT и коммит на каждую строку) все пишется пачками
+через executemany, номера счетов берутся одним блоком из счетчика. Хеш пароля у каждого клиента
+свой (общий хеш попадал бы в кэш проверок PasswordHasher и делал вход нереалистично дешевым),
+поэтому время заполнения зависит от стоимости хеша: CLI по умолчанию - дешевый PBKDF2.
+Операции идут через db.post_transactions, поэтому daily_balances и журнал проводок согласованы
+с балансами (reconcile и ledger-replay на сгенерированной базе проходят без расхождений).
+Время операций растягивается на последние --days дней.
+
+    python benchmarks/datagen.py --db /tmp/load/bank_system.db --users 10000 --transactions 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database, post_transactions
+from loans import annuity_payment
+from passwords import PasswordHasher
+from postings import run_immediate, success
+
+PASSWORD = 'password'
+LOAN_TERMS = (6, 12, 24, 36)
+
+
+def _stamp(moment):
+    return moment.strftime("%Y-%m-%d %H:%M"), int(moment.timestamp())
+
+
+def _post(db, history, deltas):
+    def post(cursor):
+        cursor.executemany("UPDATE accounts SET balance = balance + ? WHERE account_number=?",
+                           [(delta, acc) for acc, delta in deltas.items() if delta])
+        post_transactions(cursor, history)
+        return success()
+
+    run_immediate(db.get_connection(), post)
+
+
+def generate(db, users=1000, accounts_per_user=2, transactions=100_000, loans=1000, approved=0.5,
+             days=90, opening=1_000_000, prefix='user', password=PASSWORD, chunk_size=20_000, seed=1):
+    """Наполняет базу; суммы в тиынах (opening - начальный взнос на каждый счет). Возвращает счетчики."""
+    rnd = random.Random(seed)
+    conn = db.get_connection()
+    names = [f"{prefix}{i}" for i in range(users)]
+    created = datetime.now() - timedelta(days=days)
+    with conn:
+        conn.executemany("INSERT INTO users VALUES (?, ?, 'client', ?, ?, ?, 0)",
+                         ((name, db.hash_password(password), f"Клиент {i}", f"{name}@bank.kz", created) for i, name in enumerate(names)))
+        numbers = db.reserve_account_numbers(users * accounts_per_user, conn)
+        expiry = (datetime.now() + timedelta(days=365 * 3)).strftime("%m/%y")
+        # Номер карты из номера счета: уникален без проверок (сгенерированные карты начинаются с 4 или 5)
+        conn.executemany("INSERT INTO accounts VALUES (?, ?, 'Текущий', 0, ?, ?, ?)",
+                         ((acc, names[i // accounts_per_user], f"9{int(acc[2:]):015d}", f"{rnd.randint(100, 999)}", expiry)
+                          for i, acc in enumerate(numbers)))
+
+    # Начальные взносы - в первый день периода, затем переводы равномерно по времени
+    balances = dict.fromkeys(numbers, opening)
+    ts = _stamp(created)
+    for i in range(0, len(numbers), chunk_size):
+        part = numbers[i:i + chunk_size]
+        _post(db, [(acc, 'DEPOSIT', opening, 'Пополнение', *ts) for acc in part], dict.fromkeys(part, opening))
+
+    step = timedelta(days=days) / max(transactions, 1)
+    history, deltas = [], {}
+    for n in range(transactions):
+        src, dst = rnd.sample(numbers, 2)
+        amount = rnd.randint(1, max(1, min(balances[src], opening // 10)))
+        if balances[src] < amount:
+            continue
+        balances[src] -= amount
+        balances[dst] += amount
+        deltas[src] = deltas.get(src, 0) - amount
+        deltas[dst] = deltas.get(dst, 0) + amount
+        ts = _stamp(created + step * n)
+        history += [(src, 'TRANSFER_OUT', amount, f"Перевод на {dst}", *ts), (dst, 'TRANSFER_IN', amount, f"Перевод от {src}", *ts)]
+        if len(history) >= chunk_size:
+            _post(db, history, deltas)
+            history, deltas = [], {}
+    _post(db, history, deltas)
+
+    # Заявки - одной транзакцией, одобрение - штатным process_loans (график, зачисление, журнал)
+    product = db.get_loan_product('cash')
+    rows = []
+    for _ in range(loans):
+        amount = rnd.randint(100, 5000) * 100_000
+        term = rnd.choice(LOAN_TERMS)
+        rows.append((rnd.choice(names), amount, term, created.strftime("%Y-%m-%d"), amount, amount, 'cash',
+                     product['annual_rate'], annuity_payment(amount, product['annual_rate'], term)))
+    with conn:
+        ids = [conn.execute("INSERT INTO loans (username, amount, term_months, created_at, remaining_amount, principal, product, annual_rate, monthly_payment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                            row).fetchone()[0] for row in rows]
+    ids = rnd.sample(ids, int(len(ids) * approved))
+    for i in range(0, len(ids), 1000):
+        db.process_loans(ids[i:i + 1000], 'approved')
+    db.cache.clear()
+    return {'users': users, 'accounts': len(numbers), 'transactions': transactions, 'loans': loans, 'approved': len(ids)}
+
+
+def workload(db, prefix='user', limit=None):
+    """Данные для нагрузочного теста из базы: {логин: {'accounts': [...], 'loans': [одобренные id]}}"""
+    conn = db.get_connection()
+    pattern = prefix.replace('_', r'\_') + '%'
+    clients = {}
+    for row in conn.execute(r"SELECT username, account_number FROM accounts WHERE username LIKE ? ESCAPE '\' ORDER BY rowid", (pattern,)):
+        clients.setdefault(row['username'], {'accounts': [], 'loans': []})['accounts'].append(row['account_number'])
+    for row in conn.execute(r"SELECT id, username FROM loans WHERE status='approved' AND username LIKE ? ESCAPE '\'", (pattern,)):
+        if row['username'] in clients:
+            clients[row['username']]['loans'].append(row['id'])
+    if limit:
+        clients = dict(list(clients.items())[:limit])
+    return clients
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', required=True, help='файл базы (создается, если его нет)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--accounts-per-user', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=100_000, help='переводов (по две строки истории)')
+    parser.add_argument('--loans', type=int, default=1000)
+    parser.add_argument('--approved', type=float, default=0.5, help='доля одобренных заявок')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--prefix', default='user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password-algo', default='pbkdf2_sha256',
+                        help='алгоритм хеша паролей (сервер с другими параметрами перехеширует пароль при первом входе)')
+    args = parser.parse_args()
+
+    db = Database(args.db, hasher=PasswordHasher(algorithm=args.password_algo, iterations=1000))
+    started = time.perf_counter()
+    counts = generate(db, args.users, args.accounts_per_user, args.transactions, args.loans, args.approved,
+                      args.days, prefix=args.prefix, seed=args.seed)
+    print(f"{counts} за {time.perf_counter() - started:.1f} с, пароль клиентов: {PASSWORD!r}")
+
+
+if __name__ == '__main__':
+    main()
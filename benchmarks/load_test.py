@@ -0,0 +1,229 @@
+"""Нагрузочный тест приложения: смесь действий клиентов, пропускная способность и перцентили задержек.
+
+Виртуальные клиенты (у каждого своя сессия) выполняют вход, открытие дашборда, перевод, заявку
+на кредит и погашение кредита в пропорциях --mix. По умолчанию приложение работает в этом же
+процессе через Flask test client на временной базе, заполненной datagen.py. С --url запросы идут
+по HTTP в запущенный сервер, а логины, счета и кредиты клиентов читаются из его базы (--db):
+
+    python benchmarks/datagen.py --db /srv/bank/bank_system.db --users 5000
+    cd /srv/bank && BANK_PASSWORD_ALGO=pbkdf2_sha256 gunicorn -w 4 -b 127.0.0.1:8000 app:app
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --db /srv/bank/bank_system.db --concurrency 16
+
+Отчет - JSON (--output). С --baseline сравниваются пропускная способность и p95 задержек,
+при ухудшении больше --threshold процентов код возврата 1. Ошибкой считается ответ с кодом
+>= 400 и перенаправление на страницу входа (потерянная сессия).
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import baseline
+import datagen
+
+# Доли действий по умолчанию: большую часть времени клиент смотрит дашборд
+DEFAULT_MIX = 'dashboard=45,transfer=25,repay_loan=10,login=10,loan_request=10'
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()  # тело читается целиком, как его прочитал бы браузер
+        return response.status_code, response.headers.get('Location', '')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def send(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status, ''
+        except urllib.error.HTTPError as e:
+            # Перенаправление без перехода тоже приходит сюда
+            e.read()
+            return e.code, e.headers.get('Location', '')
+
+
+class VirtualClient:
+    def __init__(self, username, data, transport, accounts, rnd):
+        self.username, self.data, self.transport = username, data, transport
+        self.accounts, self.rnd = accounts, rnd
+
+    def run(self, action):
+        """Выполняет действие; True, если ответ не ошибка"""
+        rnd, own = self.rnd, self.data['accounts']
+        if action == 'login':
+            return self._ok(action, 'POST', '/login', {'username': self.username, 'password': datagen.PASSWORD})
+        if action == 'dashboard':
+            return self._ok(action, 'GET', '/dashboard')
+        if action == 'transfer':
+            to_acc = rnd.choice(self.accounts)
+            while to_acc == own[0]:
+                to_acc = rnd.choice(self.accounts)
+            return self._ok(action, 'POST', '/transaction', {'action': 'transfer', 'account_number': own[0],
+                                                             'to_account': to_acc, 'amount': str(rnd.randint(1, 100))})
+        if action == 'loan_request':
+            return self._ok(action, 'POST', '/loan_request', {'amount': str(rnd.randint(10, 5000) * 1000),
+                                                              'term': str(rnd.choice(datagen.LOAN_TERMS))})
+        if action == 'repay_loan':
+            return self._ok(action, 'POST', '/repay_loan', {'loan_id': str(rnd.choice(self.data['loans'])),
+                                                            'account_number': own[0], 'amount': '1'})
+        raise ValueError(f"Неизвестное действие: {action}")
+
+    def _ok(self, action, method, path, data=None):
+        status, location = self.transport.send(method, path, data)
+        return status < 400 and (action == 'login' or '/login' not in location)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {'login', 'dashboard', 'transfer', 'loan_request', 'repay_loan'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"неизвестные действия: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def drive(clients, mix, requests, warmup, seed, samples, errors, lock):
+    # Поток гоняет своих клиентов по кругу; первые warmup запросов в статистику не входят
+    rnd = random.Random(seed)
+    actions, weights = list(mix), list(mix.values())
+    local, failed = {}, {}
+    for client in clients:
+        client.run('login')
+    for n in range(warmup + requests):
+        client = clients[n % len(clients)]
+        action = rnd.choices(actions, weights)[0]
+        started = time.perf_counter()
+        ok = client.run(action)
+        elapsed = time.perf_counter() - started
+        if n >= warmup:
+            local.setdefault(action, []).append(elapsed)
+            if not ok:
+                failed[action] = failed.get(action, 0) + 1
+    with lock:
+        for action, values in local.items():
+            samples.setdefault(action, []).extend(values)
+        for action, count in failed.items():
+            errors[action] = errors.get(action, 0) + count
+
+
+def run(make_transport, workload, args):
+    names = [name for name, data in workload.items() if data['loans']]
+    if len(names) < args.concurrency:
+        sys.exit(f"клиентов с одобренными кредитами: {len(names)}, нужно не меньше --concurrency")
+    accounts = [acc for data in workload.values() for acc in data['accounts']]
+    rnd = random.Random(args.seed)
+    rnd.shuffle(names)
+    names = names[:args.clients]
+    groups = [[VirtualClient(name, workload[name], make_transport(), accounts, random.Random(rnd.random()))
+               for name in names[i::args.concurrency]] for i in range(args.concurrency)]
+
+    samples, errors, lock = {}, {}, threading.Lock()
+    share, extra = divmod(args.requests, args.concurrency)
+    threads = [threading.Thread(target=drive, args=(group, args.mix, share + (i < extra), args.warmup // args.concurrency,
+                                                   args.seed + i, samples, errors, lock))
+               for i, group in enumerate(groups)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in samples.values())
+    return {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'duration_s': round(elapsed, 3),
+        # Время включает вход виртуальных клиентов и прогрев - это не больше нескольких процентов запросов
+        'throughput_rps': round(total / elapsed, 1),
+        'overall': baseline.summarize([s for values in samples.values() for s in values]),
+        'actions': {action: {**baseline.summarize(samples[action]), 'errors': errors.get(action, 0)} for action in sorted(samples)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='адрес запущенного сервера; без него - Flask test client в этом процессе')
+    parser.add_argument('--db', help='база сервера (с --url) - из нее берутся клиенты, счета и кредиты')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4, help='потоков')
+    parser.add_argument('--clients', type=int, default=200, help='виртуальных клиентов')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--users', type=int, default=1000, help='клиентов во временной базе (без --url)')
+    parser.add_argument('--transactions', type=int, default=100_000)
+    parser.add_argument('--loans', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='записать JSON-отчет в файл')
+    parser.add_argument('--baseline', help='JSON-отчет для сравнения')
+    parser.add_argument('--threshold', type=float, default=20.0, help='допустимое ухудшение, %%')
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.db:
+            parser.error('с --url нужен --db')
+        from db import Database
+        workload = datagen.workload(Database(args.db, seed=False))
+        data = {'users': len(workload)}
+        make_transport = lambda: HttpTransport(args.url)
+    else:
+        # Стоимость хеша паролей - как в datagen.py, если не задана явно; база - во временном каталоге
+        os.environ.setdefault('BANK_PASSWORD_ALGO', 'pbkdf2_sha256')
+        os.environ.setdefault('BANK_PBKDF2_ITERATIONS', '1000')
+        from app import create_app
+        app = create_app({'BANK_DATABASE': os.path.join(tempfile.mkdtemp(), 'bank_system.db')})
+        services = app.extensions['bank']
+        services.init_db()
+        started = time.perf_counter()
+        data = datagen.generate(services.db, args.users, transactions=args.transactions, loans=args.loans, seed=args.seed)
+        print(f"данные: {data}, {time.perf_counter() - started:.1f} с")
+        workload = datagen.workload(services.db)
+        make_transport = lambda: TestClientTransport(app)
+
+    result = run(make_transport, workload, args)
+    report = {'meta': {**baseline.environment(), 'mode': args.url or 'test_client', 'concurrency': args.concurrency,
+                       'clients': args.clients, 'mix': args.mix, 'data': data}, **result}
+
+    print(f"{result['requests']:,} запросов за {result['duration_s']:.1f} с: {result['throughput_rps']:,.1f} запр/с, "
+          f"ошибок {result['errors']}")
+    for action, s in [('всего', result['overall']), *result['actions'].items()]:
+        print(f"  {action:<13} {s['count']:>7,}  p50 {s['p50_ms']:8.2f} мс  p95 {s['p95_ms']:8.2f}  p99 {s['p99_ms']:8.2f}"
+              + (f"  ошибок {s['errors']}" if s.get('errors') else ''))
+    if args.output:
+        baseline.save(report, args.output)
+    if args.baseline:
+        checks = [(('throughput_rps',), 'higher'), (('overall', 'p95_ms'), 'lower'),
+                  *((('actions', action, 'p95_ms'), 'lower') for action in result['actions'])]
+        regressions = baseline.compare(report, baseline.load(args.baseline), checks, args.threshold)
+        baseline.print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
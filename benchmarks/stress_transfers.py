@@ -0,0 +1,64 @@
+"""Стресс-тест движка проводок: тысячи параллельных переводов без расхождения суммы по счетам.
+
+    python benchmarks/stress_transfers.py --threads 16 --transfers 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--transfers', type=int, default=5000)
+    parser.add_argument('--accounts', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    db = Database(path, pool_size=args.threads)
+    accounts = [db.create_account('client', 'Текущий') for _ in range(args.accounts)]
+    for acc in accounts:
+        db.deposit(acc, 1000)
+
+    def total():
+        with db.get_connection() as conn:
+            return conn.execute("SELECT SUM(balance) FROM accounts").fetchone()[0]
+
+    before = total()
+    counts = {}
+    lock = threading.Lock()
+
+    def worker(n):
+        rnd = random.Random(n)
+        for _ in range(args.transfers // args.threads):
+            src, dst = rnd.sample(accounts, 2)
+            res = db.transfer(src, dst, rnd.randint(1, 300))
+            with lock:
+                counts[res.status.value] = counts.get(res.status.value, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    after = total()
+    done = sum(counts.values())
+    print(f"переводов: {done} за {elapsed:.2f} с ({done / elapsed:.0f}/с)")
+    print(f"результаты: {counts}")
+    print(f"сумма до: {before}, после: {after}, расхождение: {after - before}")
+    negative = db.get_connection().execute("SELECT COUNT(*) FROM accounts WHERE balance < 0").fetchone()[0]
+    print(f"счетов с отрицательным балансом: {negative}")
+    sys.exit(0 if after == before and negative == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
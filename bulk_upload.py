@@ -0,0 +1,126 @@
+"""Разбор файла массового перевода (/bulk_transfer) в строки (from, to, amount).
+
+Форматы по расширению: .json - массив объектов, .jsonl - объект на строку, иначе CSV
+(первая строка может быть заголовком from,to,amount). Файл читается потоком: строки уходят
+в Database.bulk_transfer по мере разбора, и пачки коммитятся до конца файла. Поэтому
+испорченный файл не отклоняется целиком: некорректная запись становится строкой
+(None, None, None), которую bulk_transfer отклоняет, и отчет показывает, где она.
+ValueError - только если файл вообще не тот формат (например, .json не начинается с '[').
+"""
+import csv
+import io
+import json
+
+from money import Money
+
+NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+def _parse_amount(value):
+    try:
+        return Money.parse(value)
+    except ValueError:
+        return None
+
+
+def _parse_json_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def iter_json_array(text, chunk_size=64 * 1024, max_item=1024 * 1024):
+    """Элементы JSON-массива по одному из текстового потока text.
+
+    Файл читается кусками по chunk_size, в памяти только хвост буфера с текущим элементом.
+    Если поток не массив - ValueError до первого элемента. Если массив оборван, испорчен
+    посередине, элемент длиннее max_item или после ']' идет что-то кроме пробелов - последним
+    выдается None и разбор заканчивается.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = text.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            fill()
+
+    if skip_ws() != '[':
+        raise ValueError('ожидался JSON-массив')
+    pos += 1
+    if skip_ws() != ']':
+        while True:
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    item, end = None, None
+                # Число, за которым до конца буфера идут только символы числа ('0.' из '0.5'),
+                # может продолжаться в следующем куске
+                tail = end
+                while tail is not None and tail < len(buf) and buf[tail] in NUMBER_CHARS:
+                    tail += 1
+                if end is not None and (tail < len(buf) or eof):
+                    break
+                if eof or len(buf) - pos > max_item:
+                    yield None
+                    return
+                fill()
+            if end - pos > max_item:
+                yield None
+                return
+            yield item
+            pos = end
+            sep = skip_ws()
+            pos += 1
+            if sep == ']':
+                break
+            if sep != ',':
+                yield None
+                return
+            skip_ws()
+    else:
+        pos += 1
+    # Мусор после массива - файл испорчен, хотя все его элементы уже разобраны
+    if skip_ws():
+        yield None
+
+
+def iter_transfer_rows(file):
+    """Строки (from, to, amount) загруженного файла (werkzeug FileStorage), без чтения целиком"""
+    name = (file.filename or '').lower()
+    text = io.TextIOWrapper(file.stream, encoding='utf-8-sig')
+    is_csv = False
+    if name.endswith('.jsonl'):
+        records = (_parse_json_line(line) for line in text if line.strip())
+    elif name.endswith('.json'):
+        records = iter_json_array(text)
+    else:
+        records = csv.reader(text)
+        is_csv = True
+
+    for i, rec in enumerate(records):
+        # В JSON запись - только объект; массивы, числа и null - некорректные строки
+        if isinstance(rec, dict):
+            rec = (rec.get('from'), rec.get('to'), rec.get('amount'))
+        elif not is_csv:
+            rec = None
+        if not isinstance(rec, (list, tuple)) or len(rec) < 3:
+            yield (None, None, None)
+            continue
+        from_acc, to_acc, amount = (str(v).strip() if v is not None else None for v in rec[:3])
+        # Первая строка CSV может быть заголовком (from,to,amount)
+        if is_csv and i == 0 and _parse_amount(amount) is None:
+            continue
+        yield (from_acc, to_acc, _parse_amount(amount))
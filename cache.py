@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SnapshotCache:
+    """LRU-кэш снимков дашбордов с TTL.
+
+    Ключ - (role, username). Кэш живет внутри процесса. Если задан version(key) - версия ключа
+    в базе (None - ключ без версии), записи других воркеров gunicorn видны сразу: версия читается
+    перед каждым попаданием и перед загрузкой, снимок с другой версией не отдается. Без него
+    попадание не делает SQL, а чужие записи видны через ttl.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0, version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Растет при каждой инвалидации: снимок, прочитанный до нее, в кэш не кладется
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, loader):
+        """Значение из кэша или loader() (результат кладется в кэш)"""
+        # Версия читается до загрузки: запись, пришедшая во время loader(), увеличит ее еще раз
+        version = self.version(key) if self.version else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, stored, value = entry
+                if expires > now and stored == version:
+                    self._data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                del self._data[key]
+                # stale - снимок изменен записью другого процесса
+                self._stats['expired' if expires <= now else 'stale'] += 1
+            self._stats['misses'] += 1
+            generation = self._generation
+
+        value = loader()
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._data[key] = (now + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['size'] = len(self._data)
+        data['maxsize'] = self.maxsize
+        data['ttl'] = self.ttl
+        lookups = data['hits'] + data['misses']
+        data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
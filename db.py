@@ -1,28 +1,257 @@
 import sqlite3
-import hashlib
+import heapq
+import json
 import random
+import time
 from datetime import datetime, timedelta
+from itertools import islice
+
+import ledger
+from cache import SnapshotCache
+from passwords import PasswordHasher
+from pool import ConnectionPool
+from loans import annuity_payment, build_schedule
+from metrics import InstrumentedConnection
+from migrations import CREDIT_TYPES, TYPE_COLUMNS, check_version, migrate
+from money import Money, to_money
+from postings import PostingStatus, fail, success, run_immediate
+
+TRANSACTION_INSERT = "INSERT INTO transactions (account_number, type, amount, description, timestamp, ts) VALUES (?, ?, ?, ?, ?, ?)"
+
+# Дневные агрегаты: новый день открывается остатком на конец предыдущего дня счета.
+# Суммы по типам операций лежат в столбцах той же строки (migrations.TYPE_COLUMNS).
+DAILY_UPSERT = '''
+    INSERT INTO daily_balances (account_number, day, opening, credits, debits, closing, txn_count, {columns})
+    SELECT :acc, :day, prev, :credits, :debits, prev + :credits - :debits, :count, {values}
+    FROM (SELECT COALESCE((SELECT closing FROM daily_balances WHERE account_number = :acc AND day < :day
+                           ORDER BY day DESC LIMIT 1), 0) AS prev)
+    WHERE true
+    ON CONFLICT (account_number, day) DO UPDATE SET
+        credits = credits + excluded.credits, debits = debits + excluded.debits,
+        closing = closing + excluded.credits - excluded.debits, txn_count = txn_count + excluded.txn_count, {updates}'''.format(
+    columns=', '.join(TYPE_COLUMNS.values()),
+    values=', '.join(f":{column}" for column in TYPE_COLUMNS.values()),
+    updates=', '.join(f"{column} = {column} + excluded.{column}" for column in TYPE_COLUMNS.values()))
+# Операция задним числом сдвигает остатки всех последующих дней (обычно таких строк нет)
+DAILY_SHIFT = "UPDATE daily_balances SET opening = opening + ?, closing = closing + ? WHERE account_number = ? AND day > ?"
+
+# Сколько раз пробовать сгенерировать номер карты при совпадении с существующим
+CARD_ATTEMPTS = 5
+
+# Допустимые решения по кредитной заявке
+LOAN_DECISIONS = ('approved', 'rejected')
+
+# Ограничение на число параметров в одном IN (...)
+IN_CHUNK = 500
+
+
+def chunks(items, size=IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def post_transactions(cursor, history):
+    """Запись строк истории (кортежи для TRANSACTION_INSERT) вместе с дневными агрегатами
+    и проводкой в неизменяемом журнале (ledger.py).
+
+    Строки сначала сворачиваются по (счет, день), поэтому пачка из тысяч переводов
+    обновляет daily_balances одним UPSERT на счет, а не на каждую операцию.
+    """
+    if not history:
+        return
+    cursor.executemany(TRANSACTION_INSERT, history)
+    ledger.append(cursor, [(acc, amount if kind in CREDIT_TYPES else -amount, kind) for acc, kind, amount, *_ in history],
+                  history[-1][5])
+    days = {}
+    for acc, kind, amount, _, timestamp, _ in history:
+        day = timestamp[:10]
+        totals = days.get((acc, day))
+        if totals is None:
+            totals = days[acc, day] = dict.fromkeys(('credits', 'debits', 'count', *TYPE_COLUMNS.values()), 0)
+        totals['credits' if kind in CREDIT_TYPES else 'debits'] += amount
+        totals['count'] += 1
+        if kind in TYPE_COLUMNS:
+            totals[TYPE_COLUMNS[kind]] += amount
+    for (acc, day), totals in sorted(days.items(), key=lambda item: item[0][1]):
+        cursor.execute(DAILY_UPSERT, {'acc': acc, 'day': day, **totals})
+        net = totals['credits'] - totals['debits']
+        cursor.execute(DAILY_SHIFT, (net, net, acc, day))
+
+# Пользователи, создаваемые в пустой базе: (логин, пароль, роль, имя, email)
+SEED_USERS = [
+    ('admin1', 'admin123', 'admin', 'Мукашев Асет', 'admin1@bank.kz'),
+    ('manager', 'manager123', 'manager', 'Менеджер Иван', 'manager@bank.kz'),
+    ('client', 'client123', 'client', 'Тестовый Клиент', 'client@bank.kz')
+]
+
+# Размер диапазона AUTOINCREMENT одного шарда: id операций, кредитов и обращений шарда i
+# лежат в [i * SHARD_ID_SPAN, (i + 1) * SHARD_ID_SPAN) - см. sharding.py
+SHARD_ID_SPAN = 10 ** 12
+
+# Ключ кэша для дашборда администратора
+ADMIN_SNAPSHOT = ('admin', '*')
+
+# Ключ snapshot_versions, увеличение которого сбрасывает все снимки (начисление процентов и т.п.)
+ALL_SNAPSHOTS = '*'
+
+# Выгрузка таблиц: ключ для keyset-пагинации, столбцы и столбец unix-времени для фильтра since.
+# Хеши паролей и CVV не выгружаются, номер карты маскируется.
+EXPORT_TABLES = {
+    'transactions': {'key': 'id', 'since': 'ts',
+                     'columns': ('id', 'account_number', 'type', 'amount', 'description', 'timestamp', 'ts')},
+    'accounts': {'key': 'account_number', 'since': None,
+                 'columns': ('account_number', 'username', 'type', 'balance',
+                             "'************' || substr(card_number, -4) AS card_number", 'expiry_date')},
+    'users': {'key': 'username', 'since': None,
+              'columns': ('username', 'role', 'name', 'email', 'created_at', 'is_blocked')},
+}
+
+
+def luhn_check_digit(digits):
+    total = 0
+    # Справа налево: удваивается каждая вторая цифра, начиная с последней (контрольная цифра встанет правее)
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9: d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def now_stamp():
+    # Строка для отображения (до минуты) и unix-время для сортировки и пагинации
+    now = datetime.now()
+    return now.strftime("%Y-%m-%d %H:%M"), int(now.timestamp())
+
+
+def _snapshot_name(key):
+    # Ключ кэша ('client', 'alice') -> строка snapshot_versions 'client:alice'
+    return ':'.join(key)
+
+
+def _touch_snapshots(cursor, keys):
+    # Версии ключей кэша ('client', 'alice') или строк ('*') +1; строка создается при первой записи
+    cursor.executemany("INSERT INTO snapshot_versions VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET version = version + 1",
+                       [(key if isinstance(key, str) else _snapshot_name(key),) for key in keys])
+
+
+def _changes(history, accounts, loans=()):
+    # data['changes'] проводки для EventBus.publish_changes; accounts - {счет: строка RETURNING username, balance}
+    return {'owners': {acc: row['username'] for acc, row in accounts.items()}, 'history': history,
+            'balances': {acc: row['balance'] for acc, row in accounts.items()}, 'loans': loans}
+
 
 class Database:
-    def __init__(self, db_name="bank_system.db"):
+    def __init__(self, db_name="bank_system.db", pool_size=8, journal_mode="WAL", synchronous="NORMAL",
+                 busy_timeout=5000, mmap_size=0, cache_size=1024, cache_ttl=30.0, history_page_size=20,
+                 hasher=None, metrics=None, events=None, shared_cache=False, shard_index=0, shard_count=1, seed=True,
+                 migrate=True):
         self.db_name = db_name
-        self.create_tables()
-        self.seed_data()
+        # Номер шарда и число шардов (ShardedDatabase); одиночная база - шард 0 из 1
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        # С metrics соединения считают запросы и время SQL, а публичные методы замеряются (metrics.py)
+        self.metrics = metrics
+        # С events (events.EventBus) после коммита проводки клиенты с открытым потоком /events получают изменения
+        self.events = events
+        # shared_cache=True - несколько процессов (воркеры gunicorn) на одной базе: записи увеличивают
+        # версии снимков в snapshot_versions, и каждое попадание в кэш сверяет версию одним запросом.
+        # По умолчанию выключено - снимок из кэша отдается без SQL, чужие записи видны через cache_ttl
+        self.shared_cache = shared_cache
+        self.pool = ConnectionPool(db_name, size=pool_size, journal_mode=journal_mode, synchronous=synchronous,
+                                   busy_timeout=busy_timeout, mmap_size=mmap_size,
+                                   factory=InstrumentedConnection if metrics else sqlite3.Connection)
+        self.cache = SnapshotCache(maxsize=cache_size, ttl=cache_ttl, version=self._snapshot_version if shared_cache else None)
+        self.history_page_size = history_page_size
+        self.hasher = hasher or PasswordHasher()
+        # migrate=False - только проверка версии схемы (воркеры приложения; схему создает flask init-db)
+        if migrate:
+            self.init_db(seed)
+        else:
+            self.check_schema()
+        if metrics:
+            metrics.instrument(self)
 
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row  # Позволяет обращаться к полям по имени (row['field'])
-        return conn
+        # Соединение не закрывается после запроса: поток переиспользует его через пул.
+        # `with conn:` по-прежнему только фиксирует (или откатывает) транзакцию.
+        return self.pool.acquire()
+
+    def release_connection(self):
+        # Вернуть соединение потока в пул: конец запроса или фонового задания. Потоки
+        # долгоживущих пулов (gthread, очередь решений) иначе держат слот до своего завершения
+        self.pool.release()
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+    # --- Кэш снимков дашбордов ---
+    def get_client_dashboard(self, username):
+        def load():
+            history, history_cursor = self.get_history(username, limit=self.history_page_size)
+            return {
+                'accounts': self.get_client_accounts(username),
+                'history': history,
+                'history_cursor': history_cursor,
+                'loans': self.get_client_loans(username),
+            }
+        return self.cache.get(('client', username), load)
+
+    def get_admin_dashboard(self):
+        # Содержимое одинаково для всех администраторов - один общий ключ
+        return self.cache.get(ADMIN_SNAPSHOT, lambda: {'users': self.get_all_users(), 'appeals': self.get_open_appeals()})
+
+    def _snapshot_version(self, key):
+        # Дашборды сверяются с snapshot_versions (версия своего ключа плюс общего '*'), справочники - нет
+        if key[0] not in ('client', 'admin'):
+            return None
+        return self.get_connection().execute("SELECT COALESCE(SUM(version), 0) FROM snapshot_versions WHERE key IN (?, ?)",
+                                             (_snapshot_name(key), ALL_SNAPSHOTS)).fetchone()[0]
+
+    def _touch_snapshots(self, cursor, *keys):
+        # Вызывается в транзакции записи: снимки этих ключей устаревают во всех процессах
+        if self.shared_cache:
+            _touch_snapshots(cursor, keys)
+
+    def invalidate_clients(self, *usernames):
+        self.cache.invalidate(*(('client', u) for u in usernames))
+
+    def invalidate_admin(self):
+        self.cache.invalidate(ADMIN_SNAPSHOT)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def _post(self, post):
+        # Проводка и, после коммита, сброс снимков затронутых клиентов (их перечисляет data['users'])
+        # и публикация изменений (data['changes'] - аргументы EventBus.publish_changes).
+        # С shared_cache версии снимков клиентов увеличиваются в той же транзакции - для кэшей других воркеров
+        def posting(cursor):
+            res = post(cursor)
+            if res.ok: self._touch_snapshots(cursor, *(('client', u) for u in res.data.get('users', ())))
+            return res
+
+        res = run_immediate(self.get_connection(), posting)
+        changes = res.data.pop('changes', None)
+        if res.ok:
+            self.invalidate_clients(*res.data.get('users', ()))
+            if self.events and changes: self.events.publish_changes(**changes)
+        return res
 
     def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        # Соленый scrypt/PBKDF2, параметры записываются вместе с хешем (см. passwords.py)
+        return self.hasher.hash(password)
 
     # --- Генерация данных карты ---
     def generate_card_details(self):
-        # 1. Генерация номера (начинается с 4 или 5)
+        # 1. Генерация номера (начинается с 4 или 5), последняя цифра - контрольная по Луну
         prefix = random.choice(['4', '5'])
-        remaining = ''.join([str(random.randint(0, 9)) for _ in range(15)])
-        card_number = prefix + remaining
+        remaining = ''.join([str(random.randint(0, 9)) for _ in range(14)])
+        card_number = prefix + remaining + luhn_check_digit(prefix + remaining)
         
         # 2. CVV (3 цифры)
         cvv = str(random.randint(100, 999))
@@ -34,57 +263,39 @@ class Database:
         return card_number, cvv, expiry_date
 
     def create_tables(self):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY, password TEXT NOT NULL, role TEXT NOT NULL,
-                name TEXT, email TEXT, created_at TEXT, is_blocked INTEGER DEFAULT 0)''')
-            
-            # Таблица счетов (с данными карты)
-            cursor.execute('''CREATE TABLE IF NOT EXISTS accounts (
-                account_number TEXT PRIMARY KEY, 
-                username TEXT, 
-                type TEXT,
-                balance REAL DEFAULT 0.0, 
-                card_number TEXT,
-                cvv TEXT,
-                expiry_date TEXT,
-                FOREIGN KEY(username) REFERENCES users(username))''')
-            
-            # Таблица транзакций
-            cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, account_number TEXT, type TEXT,
-                amount REAL, description TEXT, timestamp TEXT,
-                FOREIGN KEY(account_number) REFERENCES accounts(account_number))''')
-            
-            # Таблица кредитов
-            cursor.execute('''CREATE TABLE IF NOT EXISTS loans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, amount REAL,
-                term_months INTEGER, status TEXT DEFAULT 'pending', created_at TEXT,
-                remaining_amount REAL,
-                FOREIGN KEY(username) REFERENCES users(username))''')
-            
-            # МИГРАЦИЯ: Проверяем, есть ли поле remaining_amount
-            cursor.execute("PRAGMA table_info(loans)")
-            columns = [info[1] for info in cursor.fetchall()]
-            if 'remaining_amount' not in columns:
-                cursor.execute("ALTER TABLE loans ADD COLUMN remaining_amount REAL")
-            
-            # Таблица обращений
-            cursor.execute('''CREATE TABLE IF NOT EXISTS appeals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, message TEXT,
-                status TEXT DEFAULT 'open', created_at TEXT,
-                FOREIGN KEY(username) REFERENCES users(username))''')
-            conn.commit()
+        # Схема создается и обновляется версионированными миграциями (см. migrations.py)
+        return migrate(self.get_connection())
+
+    def init_db(self, seed=True):
+        """Миграции, диапазон id шарда и начальные пользователи - все записи, нужные до первого запроса.
+
+        Выполняется один раз при развертывании (flask init-db), а не при старте каждого воркера.
+        Возвращает список примененных миграций.
+        """
+        applied = self.create_tables()
+        if self.shard_count > 1:
+            self._reserve_id_range()
+        if seed:
+            self.seed_data()
+        return applied
+
+    def check_schema(self):
+        # Одно чтение PRAGMA user_version вместо прогона миграций
+        return check_version(self.get_connection())
 
-    def seed_data(self):
-        users = [
-            ('admin1', 'admin123', 'admin', 'Мукашев Асет', 'admin1@bank.kz'),
-            ('manager', 'manager123', 'manager', 'Менеджер Иван', 'manager@bank.kz'),
-            ('client', 'client123', 'client', 'Тестовый Клиент', 'client@bank.kz')
-        ]
+    def _reserve_id_range(self):
+        # Счетчики AUTOINCREMENT шарда сдвигаются в его диапазон (только вверх: повторный старт ничего не меняет)
+        base = self.shard_index * SHARD_ID_SPAN
+
+        def post(cursor):
+            for table in ('transactions', 'loans', 'appeals'):
+                if not cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (base, table)).rowcount:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, base))
+            return success()
+
+        run_immediate(self.get_connection(), post)
+
+    def seed_data(self, users=SEED_USERS):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             for u in users:
@@ -97,9 +308,18 @@ class Database:
 
     # --- Пользователи (Users) ---
     def get_user(self, username, password):
-        hashed_pw = self.hash_password(password)
         with self.get_connection() as conn:
-            return conn.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed_pw)).fetchone()
+            user = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+        if not user or not self.hasher.verify(username, password, user['password']):
+            return None
+
+        if self.hasher.needs_rehash(user['password']):
+            # Старый SHA-256 (или устаревшие параметры) перехешируется при успешном входе
+            with self.get_connection() as conn:
+                conn.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                             (self.hash_password(password), username, user['password']))
+                conn.commit()
+        return user
 
     def get_user_by_name(self, username):
         with self.get_connection() as conn:
@@ -113,7 +333,9 @@ class Database:
                              (username, hashed_pw, role, name, email, datetime.now()))
                 if role == 'client':
                     self.create_account(username, 'Текущий', conn)
+                self._touch_snapshots(conn, ADMIN_SNAPSHOT)
                 conn.commit()
+            self.invalidate_admin()
             return True
         except sqlite3.IntegrityError:
             return False
@@ -125,24 +347,64 @@ class Database:
     def set_block_status(self, username, status):
         with self.get_connection() as conn:
             conn.execute("UPDATE users SET is_blocked=? WHERE username=?", (status, username))
+            self._touch_snapshots(conn, ADMIN_SNAPSHOT)
             conn.commit()
+        self.invalidate_admin()
 
     # --- Счета (Accounts) ---
-    def create_account(self, username, acc_type, existing_conn=None):
+    def next_sequence(self, name, count=1, existing_conn=None):
+        """Резервирует count значений счетчика, возвращает последнее из них.
+
+        UPDATE ... RETURNING берет блокировку записи, поэтому два параллельных
+        вызова никогда не получат одинаковые значения.
+        """
+        conn = existing_conn if existing_conn else self.get_connection()
+        row = conn.execute("UPDATE sequences SET value = value + ? WHERE name=? RETURNING value", (count, name)).fetchone()
+        if not existing_conn: conn.commit()
+        return row[0]
+
+    def account_number(self, n):
+        # Номер счета по значению счетчика шарда: остаток от деления на число шардов - номер шарда
+        return f"KZ{n * self.shard_count + self.shard_index}"
+
+    def reserve_account_numbers(self, count, existing_conn=None):
+        # Блок номеров для массового открытия счетов (одно обращение к счетчику на весь блок)
+        last = self.next_sequence('account_number', count, existing_conn)
+        return [self.account_number(n) for n in range(last - count + 1, last + 1)]
+
+    def create_account(self, username, acc_type, existing_conn=None, acc_num=None):
         conn = existing_conn if existing_conn else self.get_connection()
         try:
             cursor = conn.cursor()
-            res = cursor.execute("SELECT COUNT(*) FROM accounts").fetchone()
-            acc_num = f"KZ{2000 + res[0] + 1}"
-            card_num, cvv, exp_date = self.generate_card_details()
+            if acc_num is None:
+                acc_num = self.account_number(self.next_sequence('account_number', existing_conn=conn))
 
-            cursor.execute("INSERT INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?)", 
-                           (acc_num, username, acc_type, 0.0, card_num, cvv, exp_date))
+            for attempt in range(CARD_ATTEMPTS):
+                card_num, cvv, exp_date = self.generate_card_details()
+                try:
+                    cursor.execute("INSERT INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                                   (acc_num, username, acc_type, 0, card_num, cvv, exp_date))
+                    break
+                except sqlite3.IntegrityError:
+                    # Совпал номер карты (уникальный индекс) - генерируем новый
+                    if attempt == CARD_ATTEMPTS - 1 or not self._card_exists(cursor, card_num): raise
             
-            if not existing_conn: conn.commit()
+            if not existing_conn:
+                self._touch_snapshots(conn, ('client', username))
+                conn.commit()
+                self.invalidate_clients(username)
             return acc_num
-        finally:
-            if not existing_conn: conn.close()
+        except Exception:
+            # Соединение из пула не закрываем, но и незавершенную транзакцию в нем не оставляем
+            if not existing_conn: conn.rollback()
+            raise
+
+    def _card_exists(self, cursor, card_num):
+        return cursor.execute("SELECT 1 FROM accounts WHERE card_number=?", (card_num,)).fetchone() is not None
+
+    def get_account(self, account_number):
+        with self.get_connection() as conn:
+            return conn.execute("SELECT * FROM accounts WHERE account_number=?", (account_number,)).fetchone()
 
     def get_client_accounts(self, username):
         with self.get_connection() as conn:
@@ -154,118 +416,437 @@ class Database:
             ''', (username,)).fetchall()
 
     def transfer(self, from_acc, to_acc, amount):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            sender = cursor.execute("SELECT balance FROM accounts WHERE account_number=?", (from_acc,)).fetchone()
-            target = cursor.execute("SELECT * FROM accounts WHERE account_number=?", (to_acc,)).fetchone()
-            
-            if not sender: return "Счет отправителя не найден"
-            if not target: return "Счет получателя не найден"
-            if sender['balance'] < amount: return "Недостаточно средств"
+        amount = to_money(amount)
+        if amount <= 0: return fail(PostingStatus.INVALID_AMOUNT)
+        if from_acc == to_acc: return fail(PostingStatus.SAME_ACCOUNT)
 
-            cursor.execute("UPDATE accounts SET balance = balance - ? WHERE account_number=?", (amount, from_acc))
-            cursor.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=?", (amount, to_acc))
-            
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-            cursor.execute("INSERT INTO transactions (account_number, type, amount, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                           (from_acc, "TRANSFER_OUT", amount, f"Перевод на {to_acc}", ts))
-            cursor.execute("INSERT INTO transactions (account_number, type, amount, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                           (to_acc, "TRANSFER_IN", amount, f"Перевод от {from_acc}", ts))
-            conn.commit()
-            return "Успешно"
+        def post(cursor):
+            # Списание только если хватает средств - проверка и UPDATE атомарны
+            sender = cursor.execute("UPDATE accounts SET balance = balance - ? WHERE account_number=? AND balance >= ? RETURNING username, balance",
+                                    (amount, from_acc, amount)).fetchone()
+            if not sender:
+                exists = cursor.execute("SELECT 1 FROM accounts WHERE account_number=?", (from_acc,)).fetchone()
+                return fail(PostingStatus.INSUFFICIENT_FUNDS if exists else PostingStatus.SENDER_NOT_FOUND)
+
+            target = cursor.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=? RETURNING username, balance",
+                                    (amount, to_acc)).fetchone()
+            if not target: return fail(PostingStatus.RECEIVER_NOT_FOUND)
+
+            ts, epoch = now_stamp()
+            history = [(from_acc, "TRANSFER_OUT", amount, f"Перевод на {to_acc}", ts, epoch),
+                       (to_acc, "TRANSFER_IN", amount, f"Перевод от {from_acc}", ts, epoch)]
+            post_transactions(cursor, history)
+            return success(users=[sender['username'], target['username']],
+                           changes=_changes(history, {from_acc: sender, to_acc: target}))
+
+        return self._post(post)
+
+    def bulk_transfer(self, rows, owner=None, chunk_size=1000):
+        """Пакетные переводы (зарплатные ведомости, расчеты с мерчантами).
+
+        rows - итерируемое (from_acc, to_acc, amount), amount - Money (или None, если сумма не распозналась);
+        читается лениво, по chunk_size строк.
+        owner - если задан, списывать можно только со счетов этого пользователя.
+        Каждая пачка - одна транзакция: один SELECT балансов по всем счетам пачки,
+        проверка строк в памяти и запись через executemany.
+        Возвращает список PostingResult по строкам в исходном порядке.
+        """
+        report = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                report.extend(self._post_transfer_chunk(chunk, owner))
+                chunk = []
+        if chunk:
+            report.extend(self._post_transfer_chunk(chunk, owner))
+        return report
+
+    def _post_transfer_chunk(self, chunk, owner):
+        def post(cursor):
+            numbers = list({acc for row in chunk for acc in row[:2] if acc})
+            balances, owners = {}, {}
+            for i in range(0, len(numbers), 500):
+                part = numbers[i:i + 500]
+                marks = ','.join('?' * len(part))
+                for acc in cursor.execute(f"SELECT account_number, username, balance FROM accounts WHERE account_number IN ({marks})", part):
+                    balances[acc['account_number']] = acc['balance']
+                    owners[acc['account_number']] = acc['username']
+
+            results, deltas, history = [], {}, []
+            ts, epoch = now_stamp()
+            for from_acc, to_acc, amount in chunk:
+                if not isinstance(amount, int) or amount <= 0: results.append(fail(PostingStatus.INVALID_AMOUNT)); continue
+                if from_acc == to_acc: results.append(fail(PostingStatus.SAME_ACCOUNT)); continue
+                if from_acc not in balances: results.append(fail(PostingStatus.SENDER_NOT_FOUND)); continue
+                if owner is not None and owners[from_acc] != owner: results.append(fail(PostingStatus.FOREIGN_ACCOUNT)); continue
+                if to_acc not in balances: results.append(fail(PostingStatus.RECEIVER_NOT_FOUND)); continue
+                if balances[from_acc] < amount: results.append(fail(PostingStatus.INSUFFICIENT_FUNDS)); continue
+
+                balances[from_acc] -= amount
+                balances[to_acc] += amount
+                deltas[from_acc] = deltas.get(from_acc, 0) - amount
+                deltas[to_acc] = deltas.get(to_acc, 0) + amount
+                history.append((from_acc, "TRANSFER_OUT", amount, f"Перевод на {to_acc}", ts, epoch))
+                history.append((to_acc, "TRANSFER_IN", amount, f"Перевод от {from_acc}", ts, epoch))
+                results.append(success())
+
+            # Блокировка записи удерживается с начала транзакции, поэтому балансы из SELECT актуальны
+            cursor.executemany("UPDATE accounts SET balance = balance + ? WHERE account_number=?",
+                               [(delta, acc) for acc, delta in deltas.items() if delta])
+            post_transactions(cursor, history)
+            return success(results=results, users={owners[acc] for acc in deltas},
+                           changes={'owners': owners, 'history': history, 'balances': {acc: balances[acc] for acc in deltas}})
+
+        res = self._post(post)
+        return res.data['results'] if res.ok else [res] * len(chunk)
 
     def deposit(self, acc_num, amount):
-        with self.get_connection() as conn:
-            conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=?", (amount, acc_num))
-            conn.execute("INSERT INTO transactions (account_number, type, amount, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                           (acc_num, "DEPOSIT", amount, "Пополнение", datetime.now().strftime("%Y-%m-%d %H:%M")))
-            conn.commit()
+        amount = to_money(amount)
+        if amount <= 0: return fail(PostingStatus.INVALID_AMOUNT)
+
+        def post(cursor):
+            acc = cursor.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=? RETURNING username, balance",
+                                 (amount, acc_num)).fetchone()
+            if not acc: return fail(PostingStatus.ACCOUNT_NOT_FOUND)
+            history = [(acc_num, "DEPOSIT", amount, "Пополнение", *now_stamp())]
+            post_transactions(cursor, history)
+            return success(users=[acc['username']], changes=_changes(history, {acc_num: acc}))
+
+        return self._post(post)
+
+    def get_history(self, username, limit=20, cursor=None, types=None, since=None, until=None):
+        """Страница истории операций пользователя (keyset-пагинация по (ts, id)).
+
+        cursor - значение next_cursor с предыдущей страницы ("ts:id"), None - первая страница.
+        types - список типов операций, since/until - границы по unix-времени [since, until).
+        Возвращает (строки, next_cursor); next_cursor = None, если дальше пусто.
+        Каждый счет читается по индексу (account_number, ts, id) не дальше limit + 1 строк,
+        поэтому стоимость страницы не зависит от длины истории.
+        """
+        where, params = ["account_number = ?"], []
+        if cursor:
+            ts, row_id = (int(v) for v in cursor.split(':'))
+            where.append("(ts, id) < (?, ?)")
+            params += [ts, row_id]
+        if types:
+            where.append(f"type IN ({','.join('?' * len(types))})")
+            params += list(types)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        query = f"SELECT * FROM transactions WHERE {' AND '.join(where)} ORDER BY ts DESC, id DESC LIMIT ?"
 
-    def get_history(self, username):
         with self.get_connection() as conn:
-            query = '''SELECT t.* FROM transactions t JOIN accounts a ON t.account_number = a.account_number 
-                       WHERE a.username = ? ORDER BY t.timestamp DESC'''
-            return conn.execute(query, (username,)).fetchall()
+            accounts = conn.execute("SELECT account_number FROM accounts WHERE username=?", (username,)).fetchall()
+            pages = [conn.execute(query, (acc['account_number'], *params, limit + 1)).fetchall() for acc in accounts]
+
+        # Слияние уже отсортированных страниц по счетам
+        rows = list(islice(heapq.merge(*pages, key=lambda r: (r['ts'], r['id']), reverse=True), limit + 1))
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, f"{rows[-1]['ts']}:{rows[-1]['id']}"
 
     # --- Кредиты (Loans) ---
-    def request_loan(self, username, amount, months):
-        """Создание заявки на кредит с начислением процентов (15%)"""
+    def get_loan_product(self, code='cash'):
+        # Справочник продуктов почти не меняется - держим его в том же кэше, что и дашборды
+        def load():
+            with self.get_connection() as conn:
+                return conn.execute("SELECT * FROM loan_products WHERE code=?", (code,)).fetchone()
+        return self.cache.get(('product', code), load)
+
+    def request_loan(self, username, amount, months, product='cash'):
+        """Заявка на кредит по продукту со своей годовой ставкой.
+
+        remaining_amount - вся задолженность, principal - ее часть без процентов: accrue_interest()
+        начисляет проценты только на principal, как в графике платежей (build_schedule).
+        Возвращает ежемесячный аннуитетный платеж (Money).
+        """
+        amount = to_money(amount)
+        rate = self.get_loan_product(product)['annual_rate']
+        payment = annuity_payment(amount, rate, months)
         with self.get_connection() as conn:
-            # ИЗМЕНЕНИЕ ЗДЕСЬ:
-            # amount - сумма, которую клиент хочет получить (и получит при одобрении).
-            # total_debt - сумма, которую он должен банку (amount + 15%).
-            interest_rate = 0.15
-            total_debt = amount * (1 + interest_rate)
-            
-            conn.execute("INSERT INTO loans (username, amount, term_months, created_at, remaining_amount) VALUES (?, ?, ?, ?, ?)",
-                         (username, amount, months, datetime.now().strftime("%Y-%m-%d"), total_debt))
+            conn.execute("INSERT INTO loans (username, amount, term_months, created_at, remaining_amount, principal, product, annual_rate, monthly_payment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (username, amount, months, datetime.now().strftime("%Y-%m-%d"), amount, amount, product, rate, payment))
+            self._touch_snapshots(conn, ('client', username))
             conn.commit()
+        self.invalidate_clients(username)
+        return payment
+
+    def get_loan_schedule(self, loan_id):
+        with self.get_connection() as conn:
+            return conn.execute("SELECT * FROM loan_schedule WHERE loan_id=? ORDER BY installment", (loan_id,)).fetchall()
+
+    def accrue_interest(self, as_of=None, chunk_size=100_000):
+        """Начисление процентов по всем активным кредитам за дни с прошлого начисления.
 
-    def get_loans(self, status):
+        Один UPDATE на пачку id (без цикла по кредитам в Python): проценты =
+        основной долг * годовая ставка / 365 * число дней. Начисленные проценты увеличивают
+        задолженность (remaining_amount), но не базу следующих начислений - без капитализации.
+        Возвращает число обновленных кредитов.
+        """
+        as_of = (as_of or datetime.now().date()).isoformat()
+        updated = 0
+        conn = self.get_connection()
+        bounds = conn.execute("SELECT MIN(id), MAX(id) FROM loans WHERE status='approved'").fetchone()
+        if bounds[0] is None:
+            return 0
+        for low in range(bounds[0], bounds[1] + 1, chunk_size):
+            def post(cursor):
+                cursor.execute('''
+                    UPDATE loans SET
+                        accrued_interest = accrued_interest + accrual.interest,
+                        remaining_amount = remaining_amount + accrual.interest,
+                        last_accrual = :as_of
+                    FROM (SELECT id, CAST(ROUND(principal * annual_rate / 365 * (julianday(:as_of) - julianday(last_accrual))) AS INTEGER) AS interest
+                          FROM loans
+                          WHERE status = 'approved' AND id BETWEEN :low AND :high
+                            AND annual_rate > 0 AND principal > 0 AND last_accrual < :as_of) AS accrual
+                    WHERE loans.id = accrual.id''',
+                    {'as_of': as_of, 'low': low, 'high': low + chunk_size - 1})
+                return success(count=cursor.rowcount)
+            res = run_immediate(conn, post)
+            if not res.ok: break
+            updated += res.data['count']
+        # Остатки меняются у всех заемщиков сразу - проще сбросить кэш целиком
+        if self.shared_cache:
+            with conn:
+                self._touch_snapshots(conn, ALL_SNAPSHOTS)
+        self.cache.clear()
+        return updated
+
+    def get_loans(self, status, limit=None, after_id=None, username=None, min_amount=None, max_amount=None):
+        """Кредиты в статусе status по возрастанию id; limit/after_id - keyset-пагинация, суммы - Money"""
+        where, params = ["status=?"], [status]
+        if after_id is not None:
+            where.append("id > ?")
+            params.append(after_id)
+        if username:
+            where.append("username = ?")
+            params.append(username)
+        if min_amount is not None:
+            where.append("amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            where.append("amount <= ?")
+            params.append(max_amount)
+        query = f"SELECT * FROM loans WHERE {' AND '.join(where)} ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.get_connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def count_loans(self, status):
         with self.get_connection() as conn:
-            return conn.execute("SELECT * FROM loans WHERE status=?", (status,)).fetchall()
+            return conn.execute("SELECT COUNT(*) FROM loans WHERE status=?", (status,)).fetchone()[0]
 
     def get_client_loans(self, username):
         with self.get_connection() as conn:
             return conn.execute("SELECT * FROM loans WHERE username=?", (username,)).fetchall()
 
     def process_loan(self, loan_id, decision):
+        res = self.process_loans([loan_id], decision)
+        if res.ok and not res.data['decided']:
+            with self.get_connection() as conn:
+                exists = conn.execute("SELECT 1 FROM loans WHERE id=?", (loan_id,)).fetchone()
+            return fail(PostingStatus.LOAN_NOT_ACTIVE if exists else PostingStatus.LOAN_NOT_FOUND)
+        return res
+
+    def process_loans(self, loan_ids, decision):
+        """Решение по пачке заявок одной транзакцией.
+
+        Решаются только заявки в статусе 'pending' (повторное одобрение не зачислит деньги дважды).
+        При одобрении: график платежей, зачисление суммы на первый счет клиента и запись в историю -
+        все через executemany. data['decided'] - id заявок, по которым решение применено.
+        """
+        if decision not in LOAN_DECISIONS: return fail(PostingStatus.INVALID_DECISION)
+        ids = list(dict.fromkeys(int(i) for i in loan_ids))
+
+        def post(cursor):
+            # График считается от даты одобрения; с нее же начинается начисление процентов
+            today = datetime.now().date()
+            decided = []
+            for part in chunks(ids):
+                decided += cursor.execute(
+                    f"UPDATE loans SET status=?, last_accrual=? WHERE status='pending' AND id IN ({','.join('?' * len(part))}) RETURNING *",
+                    (decision, today.isoformat() if decision == 'approved' else None, *part)).fetchall()
+            users = {loan['username'] for loan in decided}
+
+            # Строки истории зачислений; при отказе и пустом решении их нет
+            history = []
+            if decision == 'approved' and decided:
+                accounts = {}
+                for part in chunks(list(users)):
+                    # Первый открытый счет клиента (минимальный rowid)
+                    for acc in cursor.execute(f"SELECT username, account_number, MIN(rowid) FROM accounts WHERE username IN ({','.join('?' * len(part))}) GROUP BY username", part):
+                        accounts[acc['username']] = acc['account_number']
+
+                schedule, credits = [], {}
+                ts, epoch = now_stamp()
+                for loan in decided:
+                    if (loan['term_months'] or 0) > 0:
+                        schedule += [(loan['id'], *row) for row in build_schedule(loan['amount'], loan['annual_rate'] or 0, loan['term_months'], today)]
+                    acc = accounts.get(loan['username'])
+                    if acc:
+                        # Клиент получает сумму кредита, проценты на остаток начисляются отдельно (accrue_interest)
+                        credits[acc] = credits.get(acc, 0) + loan['amount']
+                        history.append((acc, "LOAN_APPROVED", loan['amount'], "Кредитные средства", ts, epoch))
+
+                cursor.executemany("INSERT INTO loan_schedule VALUES (?, ?, ?, ?, ?, ?, ?)", schedule)
+                cursor.executemany("UPDATE accounts SET balance = balance + ? WHERE account_number=?",
+                                   [(amount, acc) for acc, amount in credits.items()])
+                post_transactions(cursor, history)
+            return success(decided=[loan['id'] for loan in decided], users=users, changes=self._loan_changes(cursor, decided, history))
+
+        return self._post(post)
+
+    def _loan_changes(self, cursor, decided, history):
+        # Статусы решенных заявок и балансы зачисленных счетов - только если кто-то подписан на события
+        if not decided or not self.events or not self.events.watching({loan['username'] for loan in decided}):
+            return None
+        credited = list({row[0] for row in history})
+        accounts = {}
+        for part in chunks(credited):
+            accounts.update((row['account_number'], row) for row in cursor.execute(
+                f"SELECT account_number, username, balance FROM accounts WHERE account_number IN ({','.join('?' * len(part))})", part))
+        loans = [(loan['username'], {'id': loan['id'], 'status': loan['status'], 'remaining_amount': int(loan['remaining_amount'] or 0)})
+                 for loan in decided]
+        return _changes(history, accounts, loans)
+
+    # --- Задания очереди решений по кредитам (loan_queue.py) ---
+    def create_loan_job(self, kind, params, requested=None, keep=100):
+        """Новое задание в статусе 'queued'; хранятся только последние keep завершенных"""
+        now = int(time.time())
         with self.get_connection() as conn:
-            loan = conn.execute("SELECT * FROM loans WHERE id=?", (loan_id,)).fetchone()
-            if not loan: return False
-            
-            conn.execute("UPDATE loans SET status=? WHERE id=?", (decision, loan_id))
-
-            if decision == 'approved':
-                acc = conn.execute("SELECT account_number FROM accounts WHERE username=? LIMIT 1", (loan['username'],)).fetchone()
-                if acc:
-                    # Клиент получает "чистую" сумму (amount), но долг (remaining_amount) уже записан с процентами
-                    conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=?", (loan['amount'], acc['account_number']))
-                    ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-                    conn.execute("INSERT INTO transactions (account_number, type, amount, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                                   (acc['account_number'], "LOAN_APPROVED", loan['amount'], "Кредитные средства", ts))
-            
-            conn.commit()
-            return True
+            job_id = conn.execute("INSERT INTO loan_jobs (kind, params, state, requested, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?) RETURNING id",
+                                  (kind, json.dumps(params), requested, now, now)).fetchone()[0]
+            conn.execute("DELETE FROM loan_jobs WHERE state IN ('done', 'failed') AND id <= ?", (job_id - keep,))
+        return job_id
 
-    def repay_loan(self, loan_id, account_number, amount):
+    def update_loan_job(self, job_id, state=None, error=None, approved=0, rejected=0, skipped=0):
+        # Счетчики прибавляются; каждое обновление продлевает updated_at (признак живого задания)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
+            conn.execute('''UPDATE loan_jobs SET state = COALESCE(?, state), error = COALESCE(?, error),
+                            approved = approved + ?, rejected = rejected + ?, skipped = skipped + ?, updated_at = ?
+                            WHERE id = ?''', (state, error, approved, rejected, skipped, int(time.time()), job_id))
+
+    def get_loan_job(self, job_id):
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT * FROM loan_jobs WHERE id=?", (job_id,)).fetchone()
+        return dict(row) if row else None
 
-            acc = cursor.execute("SELECT balance FROM accounts WHERE account_number=?", (account_number,)).fetchone()
-            if not acc: return {'success': False, 'message': 'Счет не найден'}
-            if acc['balance'] < amount: return {'success': False, 'message': 'Недостаточно средств на счете'}
+    def claim_stale_loan_jobs(self, older_than):
+        """Незавершенные задания, не обновлявшиеся older_than секунд и дольше; UPDATE забирает каждое одному воркеру"""
+        now = int(time.time())
+        with self.get_connection() as conn:
+            return conn.execute("UPDATE loan_jobs SET updated_at = ? WHERE state IN ('queued', 'running') AND updated_at <= ? RETURNING *",
+                                (now, now - older_than)).fetchall()
 
+    def repay_loan(self, loan_id, account_number, amount):
+        amount = to_money(amount)
+        if amount <= 0: return fail(PostingStatus.INVALID_AMOUNT)
+
+        def post(cursor):
             loan = cursor.execute("SELECT * FROM loans WHERE id=?", (loan_id,)).fetchone()
-            if not loan or loan['status'] != 'approved': return {'success': False, 'message': 'Кредит не активен'}
+            if not loan or loan['status'] != 'approved': return fail(PostingStatus.LOAN_NOT_ACTIVE)
 
-            current_debt = loan['remaining_amount'] if loan['remaining_amount'] is not None else loan['amount']
-            
-            if amount > current_debt + 1:
-                return {'success': False, 'message': 'Сумма превышает остаток долга'}
+            current_debt = Money(loan['remaining_amount'] if loan['remaining_amount'] is not None else loan['amount'])
+            # Суммы целые (тиыны) - сравнение точное, без допуска на погрешность float
+            if amount > current_debt: return fail(PostingStatus.EXCEEDS_DEBT)
 
-            new_balance = acc['balance'] - amount
-            new_debt = current_debt - amount
-            if new_debt < 0: new_debt = 0
+            # Относительное списание с условием вместо записи вычисленного в Python баланса
+            acc = cursor.execute("UPDATE accounts SET balance = balance - ? WHERE account_number=? AND balance >= ? RETURNING username, balance",
+                                 (amount, account_number, amount)).fetchone()
+            if not acc:
+                exists = cursor.execute("SELECT 1 FROM accounts WHERE account_number=?", (account_number,)).fetchone()
+                return fail(PostingStatus.INSUFFICIENT_FUNDS if exists else PostingStatus.ACCOUNT_NOT_FOUND)
 
+            new_debt = current_debt - amount
             new_status = 'paid' if new_debt <= 0 else 'approved'
+            # Погашение идет сначала в начисленные проценты, затем в основной долг
+            cursor.execute("UPDATE loans SET remaining_amount = ?, principal = MIN(principal, ?), status = ? WHERE id = ? AND status = 'approved'",
+                           (new_debt, new_debt, new_status, loan_id))
 
-            cursor.execute("UPDATE accounts SET balance = ? WHERE account_number = ?", (new_balance, account_number))
-            cursor.execute("UPDATE loans SET remaining_amount = ?, status = ? WHERE id = ?", (new_debt, new_status, loan_id))
+            history = [(account_number, "LOAN_REPAYMENT", amount, f"Погашение кредита #{loan_id}", *now_stamp())]
+            post_transactions(cursor, history)
+            changes = _changes(history, {account_number: acc},
+                               [(loan['username'], {'id': loan_id, 'status': new_status, 'remaining_amount': int(new_debt)})])
+            return success(remaining=new_debt, status=new_status, users={acc['username'], loan['username']}, changes=changes)
 
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-            cursor.execute("INSERT INTO transactions (account_number, type, amount, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                           (account_number, "LOAN_REPAYMENT", amount, f"Погашение кредита #{loan_id}", ts))
-            
-            conn.commit()
-            return {'success': True}
+        return self._post(post)
+
+    # --- Межшардовые переводы (sharding.py) ---
+    def prepare_transfer(self, intent_id, from_acc, to_acc, amount):
+        """Фаза 1, шард отправителя: списание, TRANSFER_OUT и намерение 'prepared' одной транзакцией"""
+        def post(cursor):
+            sender = cursor.execute("UPDATE accounts SET balance = balance - ? WHERE account_number=? AND balance >= ? RETURNING username, balance",
+                                    (amount, from_acc, amount)).fetchone()
+            if not sender:
+                exists = cursor.execute("SELECT 1 FROM accounts WHERE account_number=?", (from_acc,)).fetchone()
+                return fail(PostingStatus.INSUFFICIENT_FUNDS if exists else PostingStatus.SENDER_NOT_FOUND)
+            ts, epoch = now_stamp()
+            history = [(from_acc, "TRANSFER_OUT", amount, f"Перевод на {to_acc}", ts, epoch)]
+            post_transactions(cursor, history)
+            cursor.execute("INSERT INTO transfer_intents VALUES (?, ?, ?, ?, 'prepared', ?)",
+                           (intent_id, from_acc, to_acc, amount, epoch))
+            return success(users=[sender['username']], changes=_changes(history, {from_acc: sender}))
+
+        return self._post(post)
+
+    def apply_transfer(self, intent_id, from_acc, to_acc, amount):
+        """Фаза 2, шард получателя: зачисление ровно один раз - повтор с тем же intent_id ничего не меняет"""
+        def post(cursor):
+            if cursor.execute("SELECT 1 FROM transfer_intents WHERE id=?", (intent_id,)).fetchone():
+                return success(duplicate=True)
+            target = cursor.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=? RETURNING username, balance",
+                                    (amount, to_acc)).fetchone()
+            if not target: return fail(PostingStatus.RECEIVER_NOT_FOUND)
+            ts, epoch = now_stamp()
+            history = [(to_acc, "TRANSFER_IN", amount, f"Перевод от {from_acc}", ts, epoch)]
+            post_transactions(cursor, history)
+            cursor.execute("INSERT INTO transfer_intents VALUES (?, ?, ?, ?, 'applied', ?)",
+                           (intent_id, from_acc, to_acc, amount, epoch))
+            return success(users=[target['username']], changes=_changes(history, {to_acc: target}))
+
+        return self._post(post)
+
+    def finish_transfer(self, intent_id, committed):
+        """Фаза 3, шард отправителя: 'committed' или возврат списанного и 'aborted'.
+
+        Завершает только намерение в статусе 'prepared', поэтому безопасна при повторе.
+        """
+        def post(cursor):
+            intent = cursor.execute("UPDATE transfer_intents SET state=? WHERE id=? AND state='prepared' RETURNING *",
+                                    ('committed' if committed else 'aborted', intent_id)).fetchone()
+            if not intent or committed: return success(done=bool(intent))
+            sender = cursor.execute("UPDATE accounts SET balance = balance + ? WHERE account_number=? RETURNING username, balance",
+                                    (intent['amount'], intent['from_account'])).fetchone()
+            history = [(intent['from_account'], "TRANSFER_IN", intent['amount'], f"Возврат перевода на {intent['to_account']}", *now_stamp())]
+            post_transactions(cursor, history)
+            return success(done=True, users=[sender['username']] if sender else [],
+                           changes=_changes(history, {intent['from_account']: sender} if sender else {}))
+
+        return self._post(post)
+
+    def pending_transfers(self, before=None):
+        """Намерения в статусе 'prepared', созданные раньше before (unix-время); None - все"""
+        with self.get_connection() as conn:
+            return conn.execute("SELECT * FROM transfer_intents WHERE state='prepared' AND created_at <= ? ORDER BY created_at",
+                                (before if before is not None else 2 ** 62,)).fetchall()
 
     # --- Обращения (Appeals) ---
     def create_appeal(self, username, message):
         with self.get_connection() as conn:
             conn.execute("INSERT INTO appeals (username, message, created_at) VALUES (?, ?, ?)",
                          (username, message, datetime.now().strftime("%Y-%m-%d %H:%M")))
+            self._touch_snapshots(conn, ADMIN_SNAPSHOT)
             conn.commit()
+        self.invalidate_admin()
 
     def get_open_appeals(self):
         with self.get_connection() as conn:
@@ -275,4 +856,243 @@ class Database:
         with self.get_connection() as conn:
             conn.execute("UPDATE appeals SET status='resolved' WHERE id=?", (appeal_id,))
             conn.execute("UPDATE users SET is_blocked=0 WHERE username=?", (username,))
+            self._touch_snapshots(conn, ADMIN_SNAPSHOT)
             conn.commit()
+        self.invalidate_admin()
+
+    # --- Выписки и сверка (daily_balances) ---
+    def get_statement(self, username, account_number, day_from, day_to):
+        """Выписка по счету за период [day_from, day_to] ('YYYY-MM-DD') из дневных агрегатов.
+
+        Стоимость - O(дней в периоде), а не O(операций). None, если счет не принадлежит username.
+        """
+        conn = self.get_connection()
+        if not conn.execute("SELECT 1 FROM accounts WHERE account_number=? AND username=?",
+                            (account_number, username)).fetchone():
+            return None
+        days = conn.execute("SELECT * FROM daily_balances WHERE account_number=? AND day BETWEEN ? AND ? ORDER BY day",
+                            (account_number, day_from, day_to)).fetchall()
+        if days:
+            opening = days[0]['opening']
+        else:
+            prev = conn.execute("SELECT closing FROM daily_balances WHERE account_number=? AND day < ? ORDER BY day DESC LIMIT 1",
+                                (account_number, day_from)).fetchone()
+            opening = prev['closing'] if prev else 0
+        return {
+            'account_number': account_number, 'from': day_from, 'to': day_to,
+            'opening': Money(opening),
+            'closing': Money(days[-1]['closing'] if days else opening),
+            'credits': Money(sum(d['credits'] for d in days)),
+            'debits': Money(sum(d['debits'] for d in days)),
+            'by_type': {t: Money(sum(d[column] for d in days)) for t, column in TYPE_COLUMNS.items()},
+            'days': days,
+        }
+
+    def get_daily_totals(self, day_from, day_to):
+        """Обороты банка по дням: приход, расход, число операций и суммы по типам"""
+        sums = ', '.join(f"SUM({column}) AS {column}" for column in TYPE_COLUMNS.values())
+        with self.get_connection() as conn:
+            rows = conn.execute(f'''SELECT day, SUM(credits) AS credits, SUM(debits) AS debits, SUM(txn_count) AS count, {sums}
+                                    FROM daily_balances WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day''',
+                                (day_from, day_to)).fetchall()
+        return [{'day': row['day'], 'credits': Money(row['credits']), 'debits': Money(row['debits']), 'count': row['count'],
+                 'by_type': {t: Money(row[column]) for t, column in TYPE_COLUMNS.items()}} for row in rows]
+
+    def reconcile(self, full=False):
+        """Сверка daily_balances с журналом transactions и балансами счетов.
+
+        Проверяются только дни, в которые появились операции после прошлой контрольной точки
+        (full=True - все дни всех счетов): суммы за день, цепочка остатков opening = closing
+        предыдущего дня и итоговый остаток = accounts.balance. Контрольная точка сдвигается,
+        только если расхождений нет. Возвращает отчет со списком расхождений.
+        """
+        conn = self.get_connection()
+        mismatches = []
+        conn.execute("BEGIN")  # все чтения - из одного снимка базы
+        try:
+            checkpoint = conn.execute("SELECT last_transaction_id FROM reconcile_checkpoints WHERE name='daily_balances'").fetchone()
+            last_id = 0 if full or not checkpoint else checkpoint[0]
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+
+            if full:
+                touched = conn.execute("SELECT account_number, day FROM daily_balances").fetchall()
+            else:
+                touched = conn.execute('''SELECT DISTINCT account_number, substr(timestamp, 1, 10) FROM transactions
+                                          WHERE id > ? AND id <= ?''', (last_id, max_id)).fetchall()
+            first_day = {}
+            for acc, day in touched:
+                first_day[acc] = min(day, first_day.get(acc, day))
+                mismatches.extend(self._check_day(conn, acc, day))
+            for acc, day in first_day.items():
+                mismatches.extend(self._check_chain(conn, acc, day))
+            if full:
+                # Счета без единой строки агрегатов должны иметь нулевой баланс
+                for row in conn.execute('''SELECT account_number, balance FROM accounts a WHERE balance != 0
+                                           AND NOT EXISTS (SELECT 1 FROM daily_balances d WHERE d.account_number = a.account_number)'''):
+                    mismatches.append({'account_number': row[0], 'day': None, 'problem': 'balance',
+                                       'expected': row[1], 'actual': 0})
+        finally:
+            conn.rollback()
+
+        if not mismatches:
+            with conn:
+                conn.execute('''INSERT INTO reconcile_checkpoints VALUES ('daily_balances', ?, ?)
+                                ON CONFLICT (name) DO UPDATE SET last_transaction_id = MAX(last_transaction_id, excluded.last_transaction_id),
+                                                               checked_at = excluded.checked_at''',
+                             (max_id, datetime.now().strftime("%Y-%m-%d %H:%M")))
+        return {'checked_days': len(touched), 'checked_accounts': len(first_day),
+                'last_transaction_id': max_id, 'mismatches': mismatches}
+
+    def _check_day(self, conn, acc, day):
+        # Пересчет одного дня счета по журналу (индекс account_number, ts - только операции этого дня)
+        start = datetime.strptime(day, "%Y-%m-%d")
+        low, high = int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+        journal = {row[0]: (row[1], row[2]) for row in conn.execute(
+            "SELECT type, SUM(amount), COUNT(*) FROM transactions WHERE account_number=? AND ts >= ? AND ts < ? GROUP BY type",
+            (acc, low, high))}
+        expected = {
+            'credits': sum(amount for t, (amount, _) in journal.items() if t in CREDIT_TYPES),
+            'debits': sum(amount for t, (amount, _) in journal.items() if t not in CREDIT_TYPES),
+            'txn_count': sum(count for _, count in journal.values()),
+            **{column: journal.get(t, (0, 0))[0] for t, column in TYPE_COLUMNS.items()},
+        }
+        stored = conn.execute("SELECT * FROM daily_balances WHERE account_number=? AND day=?", (acc, day)).fetchone()
+        problems = []
+        for key, value in expected.items():
+            actual = stored[key] if stored else 0
+            if actual != value:
+                problems.append({'account_number': acc, 'day': day, 'problem': key, 'expected': value, 'actual': actual})
+        if stored and stored['closing'] - stored['opening'] != stored['credits'] - stored['debits']:
+            problems.append({'account_number': acc, 'day': day, 'problem': 'closing',
+                             'expected': stored['opening'] + stored['credits'] - stored['debits'], 'actual': stored['closing']})
+        return problems
+
+    def _check_chain(self, conn, acc, day):
+        # Остатки от дня перед первым измененным до последнего дня и сравнение с балансом счета
+        rows = conn.execute('''SELECT day, opening, closing FROM daily_balances WHERE account_number=? AND day >=
+                                   COALESCE((SELECT MAX(day) FROM daily_balances WHERE account_number=? AND day < ?), ?)
+                               ORDER BY day''', (acc, acc, day, day)).fetchall()
+        problems = []
+        for prev, cur in zip(rows, rows[1:]):
+            if cur['opening'] != prev['closing']:
+                problems.append({'account_number': acc, 'day': cur['day'], 'problem': 'opening',
+                                 'expected': prev['closing'], 'actual': cur['opening']})
+        balance = conn.execute("SELECT balance FROM accounts WHERE account_number=?", (acc,)).fetchone()
+        if rows and (balance is None or balance[0] != rows[-1]['closing']):
+            problems.append({'account_number': acc, 'day': rows[-1]['day'], 'problem': 'balance',
+                             'expected': balance[0] if balance else None, 'actual': rows[-1]['closing']})
+        return problems
+
+    # --- Журнал проводок (ledger.py) ---
+    def replay_ledger(self, full=False, verify=True, rebuild=False, batch_size=50_000):
+        """Остатки по журналу (от последнего снимка или с начала) против accounts.balance.
+
+        Голова журнала и балансы читаются из одного снимка базы, а записи до головы уже не
+        меняются, поэтому само воспроизведение идет вне транзакции и не мешает проводкам.
+        rebuild=True записывает остатки журнала в accounts.balance; тогда все выполняется
+        под блокировкой записи (проводки ждут). В mismatches expected - остаток по журналу,
+        actual - accounts.balance.
+        """
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE" if rebuild else "BEGIN")
+        try:
+            upto = ledger.head(conn)[0]
+            accounts = conn.execute("SELECT account_number, balance FROM accounts").fetchall()
+            if not rebuild:
+                conn.rollback()
+            balances, report = ledger.replay(conn, upto=upto, full=full, verify=verify, batch_size=batch_size)
+            mismatches = []
+            for acc, balance in accounts:
+                expected = balances.pop(acc, 0)
+                if expected != balance:
+                    mismatches.append({'account_number': acc, 'expected': expected, 'actual': balance})
+            # Остались системные счета SYS:* и счета, которых нет в accounts
+            for acc, expected in balances.items():
+                if not acc.startswith('SYS:') and expected:
+                    mismatches.append({'account_number': acc, 'expected': expected, 'actual': None})
+            report['system'] = {acc: Money(v) for acc, v in sorted(balances.items()) if acc.startswith('SYS:')}
+            report['mismatches'] = mismatches
+            if rebuild and not report['problems']:
+                conn.executemany("UPDATE accounts SET balance=? WHERE account_number=?",
+                                 [(m['expected'], m['account_number']) for m in mismatches if m['actual'] is not None])
+                self._touch_snapshots(conn, ALL_SNAPSHOTS)
+                conn.commit()
+                self.cache.clear()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+        return report
+
+    def snapshot_ledger(self, keep=3, batch_size=50_000):
+        """Снимок остатков на голову журнала, посчитанный воспроизведением с проверкой цепочки.
+
+        Снимок не пишется, если журнал поврежден. Хранятся последние keep снимков.
+        Возвращает отчет replay_ledger с id снимка (None - снимок не записан).
+        """
+        conn = self.get_connection()
+        with conn:
+            upto, digest = ledger.head(conn)
+        balances, report = ledger.replay(conn, upto=upto, batch_size=batch_size)
+        report['snapshot_id'] = None
+        if report['problems'] or upto == report['from_id']:
+            return report  # поврежден или новых записей нет
+
+        def post(cursor):
+            snapshot_id = cursor.execute("INSERT INTO ledger_snapshots (journal_id, hash, created_at) VALUES (?, ?, ?) RETURNING id",
+                                         (upto, digest, datetime.now().strftime("%Y-%m-%d %H:%M"))).fetchone()[0]
+            cursor.executemany("INSERT INTO ledger_snapshot_balances VALUES (?, ?, ?)",
+                               [(snapshot_id, acc, balance) for acc, balance in balances.items() if balance])
+            old = cursor.execute("SELECT id FROM ledger_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (keep,)).fetchall()
+            for (old_id,) in old:
+                cursor.execute("DELETE FROM ledger_snapshot_balances WHERE snapshot_id=?", (old_id,))
+                cursor.execute("DELETE FROM ledger_snapshots WHERE id=?", (old_id,))
+            return success(snapshot_id=snapshot_id)
+
+        res = run_immediate(conn, post)
+        report['snapshot_id'] = res.data.get('snapshot_id')
+        return report
+
+    # --- Выгрузка (export.py) ---
+    def export_columns(self, table):
+        return [column.rsplit(' AS ', 1)[-1] for column in EXPORT_TABLES[table]['columns']]
+
+    def parse_export_key(self, table, value):
+        # Значение after из строки запроса: id сравнивается как число, а не как текст
+        return int(value) if EXPORT_TABLES[table]['key'] == 'id' else value
+
+    def export_watermark(self, table):
+        """Последний ключ таблицы: верхняя граница выгрузки и after для следующей инкрементальной"""
+        key = EXPORT_TABLES[table]['key']
+        with self.get_connection() as conn:
+            return conn.execute(f"SELECT MAX({key}) FROM {table}").fetchone()[0]
+
+    def iter_export(self, table, after=None, upto=None, since=None, batch_size=5000):
+        """Строки таблицы пачками (списки кортежей) по возрастанию ключа: after < ключ <= upto.
+
+        Каждая пачка - отдельный keyset-запрос LIMIT batch_size, поэтому память ограничена
+        размером пачки, а длинная выгрузка не держит открытой читающую транзакцию
+        (иначе WAL не может сделать checkpoint до ее конца).
+        since - unix-время, только для таблиц со столбцом времени.
+        """
+        spec = EXPORT_TABLES[table]
+        if since is not None and not spec['since']:
+            raise ValueError(f"Таблица {table} не поддерживает фильтр по времени")
+        if upto is None:
+            upto = self.export_watermark(table)
+            if upto is None:
+                return
+        where, params = [f"{spec['key']} <= ?"], [upto]
+        if since is not None:
+            where.append(f"{spec['since']} >= ?")
+            params.append(since)
+        key_index = self.export_columns(table).index(spec['key'])
+        conn = self.get_connection()
+        while True:
+            conditions = where if after is None else [f"{spec['key']} > ?", *where]
+            batch = [tuple(row) for row in conn.execute(
+                f"SELECT {', '.join(spec['columns'])} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY {spec['key']} LIMIT ?",
+                (*([] if after is None else [after]), *params, batch_size)).fetchall()]
+            if not batch:
+                return
+            yield batch
+            after = batch[-1][key_index]
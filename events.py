@@ -0,0 +1,226 @@
+"""Уведомления клиентов в реальном времени: pub/sub внутри процесса для потока /events (SSE).
+
+Database после коммита проводки (тем же путем, что сбрасывает снимки дашбордов) передает
+сюда изменения: новые строки истории, балансы счетов и кредиты. События собираются только
+для клиентов, у которых открыт поток, и кодируются в текст SSE один раз на клиента.
+
+Публикация никогда не ждет читателя. У каждого подключения своя очередь, ограниченная
+max_bytes: если клиент не успевает читать, очередь очищается и в нее кладется одно событие
+resync - клиент перечитывает дашборд целиком. Так память на подключение ограничена при
+любом темпе операций.
+
+Выключено по умолчанию, включается BANK_EVENTS=1 (app.py). Шина живет внутри процесса:
+клиент видит операции, проведенные его воркером. Подписка занимает поток только на время
+ожидания в Subscription.get(); для тысяч открытых потоков на воркер - gunicorn -k
+gthread/gevent или ASGI-сервер с Subscription.astream().
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import deque
+
+# Интервал комментария-пинга в простаивающем потоке: прокси не закрывают соединение,
+# а закрытое клиентом обнаруживается на следующей записи
+HEARTBEAT = 15.0
+PING = b': ping\n\n'
+
+
+def frame(event, data, event_id=None):
+    """Событие в формате text/event-stream"""
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n".encode()
+
+
+RESYNC = frame('resync', {})
+
+
+class Subscription:
+    """Очередь событий одного подключения (вкладки клиента)"""
+
+    def __init__(self, bus, username, max_bytes):
+        self.bus = bus
+        self.username = username
+        self.max_bytes = max_bytes
+        self.closed = False
+        self._chunks = deque()
+        self._size = 0
+        # Условие на общем замке шины: публикация и ожидание не берут отдельных блокировок
+        self._ready = threading.Condition(bus._lock)
+        self._waiter = None  # (loop, future) ожидающего astream()
+
+    def _put(self, chunk):
+        # Вызывается под замком шины
+        if self._size + len(chunk) > self.max_bytes:
+            # Клиент отстал: вместо накопления - одно событие "перечитать все"
+            self.bus._stats['overflows'] += 1
+            self._chunks.clear()
+            self._size = 0
+            chunk = RESYNC
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._ready.notify()
+        if self._waiter:
+            loop, future = self._waiter
+            self._waiter = None
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _drain(self):
+        chunk = b''.join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return chunk
+
+    def get(self, timeout=HEARTBEAT):
+        """Накопленные события одним куском; b'' по таймауту, None после close()"""
+        with self._ready:
+            if not self._chunks and not self.closed:
+                self._ready.wait(timeout)
+            return None if self.closed else self._drain()
+
+    async def aget(self, timeout=HEARTBEAT):
+        """То же для asyncio: ожидание не занимает поток"""
+        with self.bus._lock:
+            if self._chunks or self.closed:
+                return None if self.closed else self._drain()
+            future = asyncio.get_running_loop().create_future()
+            self._waiter = (asyncio.get_running_loop(), future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self.bus._lock:
+            self._waiter = None
+            return None if self.closed else self._drain()
+
+    def stream(self, heartbeat=HEARTBEAT):
+        """Тело ответа text/event-stream; подписка снимается, когда клиент отключился"""
+        try:
+            yield b'retry: 5000\n\n'
+            while True:
+                chunk = self.get(heartbeat)
+                if chunk is None:
+                    return
+                yield chunk or PING
+        finally:
+            self.close()
+
+    async def astream(self, heartbeat=HEARTBEAT):
+        try:
+            yield b'retry: 5000\n\n'
+            while True:
+                chunk = await self.aget(heartbeat)
+                if chunk is None:
+                    return
+                yield chunk or PING
+        finally:
+            self.close()
+
+    def resync(self):
+        # Переподключение (Last-Event-ID): пропущенные события не хранятся - клиент перечитывает все
+        with self.bus._lock:
+            self._put(RESYNC)
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class EventBus:
+    """Подписки по логину клиента.
+
+    max_subscribers - подключений на процесс, max_per_user - на одного клиента (вкладки),
+    max_bytes - очередь одного подключения. Сверх лимита подключений subscribe() возвращает None.
+    """
+
+    def __init__(self, max_subscribers=10_000, max_per_user=5, max_bytes=64 * 1024):
+        self.max_subscribers = max_subscribers
+        self.max_per_user = max_per_user
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._subscribers = {}  # логин -> [Subscription]
+        self._count = 0
+        self._ids = itertools.count(1)
+        self._stats = {'published': 0, 'delivered': 0, 'overflows': 0, 'rejected': 0}
+
+    def subscribe(self, username):
+        with self._lock:
+            subs = self._subscribers.get(username, [])
+            if self._count >= self.max_subscribers or len(subs) >= self.max_per_user:
+                self._stats['rejected'] += 1
+                return None
+            sub = Subscription(self, username, self.max_bytes)
+            self._subscribers[username] = [*subs, sub]
+            self._count += 1
+            return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            if sub.closed:
+                return
+            sub.closed = True
+            sub._ready.notify()
+            if sub._waiter:
+                loop, future = sub._waiter
+                sub._waiter = None
+                loop.call_soon_threadsafe(_wake, future)
+            subs = [s for s in self._subscribers.get(sub.username, ()) if s is not sub]
+            if subs:
+                self._subscribers[sub.username] = subs
+            else:
+                self._subscribers.pop(sub.username, None)
+            self._count -= 1
+
+    def watching(self, usernames):
+        """Есть ли открытый поток хотя бы у одного из клиентов (без блокировки - для быстрого отказа)"""
+        return any(username in self._subscribers for username in usernames)
+
+    def publish(self, username, events):
+        """events - [(тип, данные)]; доставляются всем подключениям клиента одним куском"""
+        if username not in self._subscribers:
+            return
+        with self._lock:
+            subs = self._subscribers.get(username)
+            if not subs:
+                return
+            event_id = next(self._ids)
+            chunk = b''.join(frame(event, data, event_id if i == len(events) - 1 else None)
+                             for i, (event, data) in enumerate(events))
+            self._stats['published'] += 1
+            for sub in subs:
+                sub._put(chunk)
+                self._stats['delivered'] += 1
+
+    def publish_changes(self, owners, history=(), balances=None, loans=()):
+        """Изменения одной проводки, разложенные по клиентам.
+
+        owners - {счет: логин владельца}; history - строки истории (кортежи TRANSACTION_INSERT);
+        balances - {счет: новый баланс}; loans - [(логин, {id, status, remaining_amount})].
+        """
+        if not self._subscribers:
+            return
+        per_user = {}
+        for acc, balance in (balances or {}).items():
+            username = owners.get(acc)
+            if username in self._subscribers:
+                per_user.setdefault(username, []).append(('balance', {'account_number': acc, 'balance': int(balance)}))
+        for acc, kind, amount, description, timestamp, _ in history:
+            username = owners.get(acc)
+            if username in self._subscribers:
+                per_user.setdefault(username, []).append(('transaction', {
+                    'account_number': acc, 'type': kind, 'amount': int(amount),
+                    'description': description, 'timestamp': timestamp}))
+        for username, loan in loans:
+            if username in self._subscribers:
+                per_user.setdefault(username, []).append(('loan', loan))
+        for username, events in per_user.items():
+            self.publish(username, events)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'subscribers': self._count, 'users': len(self._subscribers),
+                    'queued_bytes': sum(s._size for subs in self._subscribers.values() for s in subs)}
@@ -0,0 +1,72 @@
+"""Потоковая выгрузка таблиц в CSV / JSON Lines (опционально gzip).
+
+Строки читаются пачками через Database.iter_export и сразу кодируются в текст,
+поэтому потребление памяти не зависит от размера таблицы: в ответ HTTP или в файл
+уходит по одному куску на пачку.
+"""
+import csv
+import io
+import json
+import zlib
+
+from db import EXPORT_TABLES
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок пустой выгрузки
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_jsonl(columns, batches):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+def encode(fmt, columns, batches):
+    if fmt == 'csv':
+        return encode_csv(columns, batches)
+    if fmt == 'jsonl':
+        return encode_jsonl(columns, batches)
+    raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def gzip_chunks(chunks, level=6):
+    """Текстовые куски -> поток gzip (wbits=31 - формат gzip, читается gunzip/zcat)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(db, table, fmt='csv', compress=False, after=None, since=None, batch_size=5000):
+    """(watermark, генератор кусков bytes) для таблицы table.
+
+    watermark - последний ключ на момент начала выгрузки: строки, добавленные позже, в нее
+    не попадут, а следующая инкрементальная выгрузка передает его как after.
+    """
+    # Параметры проверяются сразу: внутри потока ошибку уже не вернуть кодом ответа
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    if since is not None and not EXPORT_TABLES[table]['since']:
+        raise ValueError(f"Таблица {table} не поддерживает фильтр по времени")
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    if after is not None:
+        after = db.parse_export_key(table, after)
+    watermark = db.export_watermark(table)
+    batches = db.iter_export(table, after=after, upto=watermark, since=since, batch_size=batch_size) if watermark is not None else iter(())
+    chunks = encode(fmt, db.export_columns(table), batches)
+    return watermark, gzip_chunks(chunks) if compress else (chunk.encode() for chunk in chunks)
@@ -0,0 +1,148 @@
+"""Неизменяемый журнал проводок (двойная запись) с цепочкой хешей, снимки остатков и воспроизведение.
+
+Каждая проводка (db.post_transactions) дописывает в journal изменение баланса каждого
+затронутого счета и встречные записи системных счетов SYS:*, так что сумма записей проводки
+равна нулю. Запись хранит sha256(хеш предыдущей записи + свои поля): правка или удаление
+записи в середине ломает цепочку, а UPDATE и DELETE запрещены триггерами (миграция 9).
+
+accounts.balance - проекция журнала, обновляемая в той же транзакции. Снимок фиксирует
+остатки всех счетов на записи N. replay() начинает с последнего снимка и дочитывает хвост
+пачками по id, поэтому память не зависит от длины журнала.
+"""
+import hashlib
+
+# Хеш "предыдущей записи" для первой записи журнала
+GENESIS = bytes(32)
+
+# Встречный системный счет по типу операции. Встречные записи одной проводки сворачиваются
+# по счету: у перевода внутри базы SYS:TRANSIT дает ноль и не пишется.
+COUNTER_ACCOUNTS = {
+    'DEPOSIT': 'SYS:CASH',
+    'TRANSFER_IN': 'SYS:TRANSIT',
+    'TRANSFER_OUT': 'SYS:TRANSIT',
+    'LOAN_APPROVED': 'SYS:LOANS',
+    'LOAN_REPAYMENT': 'SYS:LOANS',
+    'OPENING': 'SYS:EQUITY',
+}
+
+JOURNAL_INSERT = "INSERT INTO journal (id, posting, account_number, amount, type, ts, hash) VALUES (?, ?, ?, ?, ?, ?, ?)"
+JOURNAL_COLUMNS = "id, posting, account_number, amount, type, ts, hash"
+
+
+def entry_hash(prev, row_id, posting, account, amount, kind, ts):
+    return hashlib.sha256(prev + f"{row_id}|{posting}|{account}|{amount}|{kind}|{ts}".encode()).digest()
+
+
+def head(conn):
+    """(id, hash) последней записи журнала; (0, GENESIS) для пустого"""
+    row = conn.execute("SELECT id, hash FROM journal ORDER BY id DESC LIMIT 1").fetchone()
+    return (row[0], row[1]) if row else (0, GENESIS)
+
+
+def append(cursor, entries, ts):
+    """Дописывает проводку: entries - (счет, изменение баланса, тип операции).
+
+    Вызывается внутри транзакции записи: голова журнала читается и продлевается под одной
+    блокировкой, поэтому id идут подряд, без пропусков. Номер проводки - id ее первой записи.
+    """
+    # Money -> int: хеш считается от тех же значений, что потом прочитает replay()
+    entries = [(account, int(amount), kind) for account, amount, kind in entries]
+    offsets = {}
+    for account, amount, kind in entries:
+        counter = COUNTER_ACCOUNTS[kind]
+        offsets[counter] = offsets.get(counter, 0) - amount
+    last_id, prev = head(cursor)
+    posting = last_id + 1
+    rows = []
+    for account, amount, kind in [*entries, *((acc, amount, 'OFFSET') for acc, amount in offsets.items() if amount)]:
+        last_id += 1
+        prev = entry_hash(prev, last_id, posting, account, amount, kind, ts)
+        rows.append((last_id, posting, account, amount, kind, ts, prev))
+    cursor.executemany(JOURNAL_INSERT, rows)
+    return posting
+
+
+def iter_journal(conn, after, upto, batch_size):
+    # Keyset-пачки по id: длинное воспроизведение не держит открытой читающую транзакцию
+    cursor = conn.cursor()
+    cursor.row_factory = None  # кортежи: sqlite3.Row на каждую запись заметно медленнее
+    while after < upto:
+        batch = cursor.execute(f"SELECT {JOURNAL_COLUMNS} FROM journal WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                               (after, upto, batch_size)).fetchall()
+        if not batch:
+            return
+        yield batch
+        after = batch[-1][0]
+
+
+def verify_chain(batches, after, prev, problems, limit=100):
+    """Пропускает пачки дальше, проверяя по пути цепочку хешей, непрерывность id и нулевую сумму проводок.
+
+    Найденное добавляется в problems (не больше limit); после разрыва проверка продолжается
+    от хеша, записанного в журнале.
+    """
+    posting, total = None, 0
+
+    def problem(row_id, kind, **details):
+        if len(problems) < limit:
+            problems.append({'id': row_id, 'problem': kind, **details})
+
+    sha256 = hashlib.sha256
+    for batch in batches:
+        for row_id, row_posting, account, amount, kind, ts, digest in batch:
+            if row_id != after + 1:
+                problem(row_id, 'gap', expected=after + 1)
+            after = row_id
+            # entry_hash() развернут: вызов функции на каждую запись - заметная доля времени
+            if sha256(prev + f"{row_id}|{row_posting}|{account}|{amount}|{kind}|{ts}".encode()).digest() != digest:
+                problem(row_id, 'hash')
+            prev = digest
+            if row_posting != posting:
+                if total:
+                    problem(posting, 'unbalanced', total=total)
+                posting, total = row_posting, 0
+            total += amount
+        yield batch
+    if total:
+        problem(posting, 'unbalanced', total=total)
+
+
+def fold(batches, balances):
+    for batch in batches:
+        for row in batch:
+            balances[row[2]] = balances.get(row[2], 0) + row[3]
+    return balances
+
+
+def latest_snapshot(conn):
+    return conn.execute("SELECT id, journal_id, hash FROM ledger_snapshots ORDER BY id DESC LIMIT 1").fetchone()
+
+
+def replay(conn, upto=None, full=False, verify=True, batch_size=50_000):
+    """Остатки всех счетов по журналу: последний снимок + записи после него (full - с начала).
+
+    upto - последний id (по умолчанию голова журнала). verify=False пропускает проверку цепочки
+    и суммирует окна по batch_size записей в SQLite (GROUP BY), без цикла Python по записям.
+    Возвращает (остатки {счет: сумма}, отчет).
+    """
+    if upto is None:
+        upto = head(conn)[0]
+    snapshot = None if full else latest_snapshot(conn)
+    if snapshot and snapshot[1] > upto:
+        snapshot = None  # снимок новее запрошенной точки
+    balances = {}
+    after, prev = 0, GENESIS
+    if snapshot:
+        after, prev = snapshot[1], snapshot[2]
+        balances = dict(conn.execute("SELECT account_number, balance FROM ledger_snapshot_balances WHERE snapshot_id=?",
+                                     (snapshot[0],)).fetchall())
+    problems = []
+    if verify:
+        fold(verify_chain(iter_journal(conn, after, upto, batch_size), after, prev, problems), balances)
+    else:
+        for low in range(after, upto, batch_size):
+            for account, amount in conn.execute("SELECT account_number, SUM(amount) FROM journal WHERE id > ? AND id <= ? GROUP BY account_number",
+                                                (low, min(low + batch_size, upto))):
+                balances[account] = balances.get(account, 0) + amount
+    return balances, {'snapshot': snapshot[0] if snapshot else None, 'from_id': after, 'to_id': upto,
+                      'events': upto - after, 'verified': verify, 'problems': problems}
@@ -0,0 +1,142 @@
+"""Фоновая очередь решений по кредитным заявкам.
+
+Веб-запрос менеджера только ставит задание в очередь и сразу получает его id;
+пул потоков применяет решения пачками через Database.process_loans.
+
+Задания хранятся в таблице loan_jobs: статус по status_url отвечает любой воркер, id
+уникальны между воркерами. Выполняет задание воркер, который его принял. Если он упал,
+задание остается 'queued'/'running' без обновлений; через STALE_AFTER секунд его подхватывает
+очередь другого воркера при создании или flask resume-loan-jobs. Повтор безопасен - решаются
+только заявки в статусе 'pending', но счетчики задания учитывают и пачки до сбоя.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from money import Money
+
+
+# Правила автоскоринга: функция(loan) -> 'approved' / 'rejected' / None (оставить менеджеру).
+# Применяется первое правило, вернувшее решение.
+AUTO_APPROVE_LIMIT = Money.tenge(500_000)
+AUTO_APPROVE_MAX_TERM = 36
+MAX_TERM = 120
+
+
+def reject_long_terms(loan):
+    return 'rejected' if loan['term_months'] > MAX_TERM else None
+
+
+def approve_small_loans(loan):
+    if loan['amount'] <= AUTO_APPROVE_LIMIT and loan['term_months'] <= AUTO_APPROVE_MAX_TERM:
+        return 'approved'
+    return None
+
+
+DEFAULT_RULES = [reject_long_terms, approve_small_loans]
+
+# Задание без обновлений дольше стольких секунд считается брошенным упавшим воркером
+STALE_AFTER = 600
+
+
+class LoanDecisionQueue:
+    def __init__(self, db, workers=2, batch_size=1000, rules=None, history=100):
+        self.db = db
+        self.batch_size = batch_size
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='loan-decisions')
+        self._kinds = {'decide': self._decide_ids, 'decide_matching': self._decide_matching, 'auto_score': self._auto_score}
+        self.resume_stale()
+
+    # --- Постановка заданий ---
+    def submit(self, loan_ids, decision):
+        """Решение по конкретным заявкам"""
+        ids = list(loan_ids)
+        return self._start('decide', {'ids': ids, 'decision': decision}, requested=len(ids))
+
+    def submit_matching(self, decision, **filters):
+        """Решение по всем заявкам на проверке, подходящим под фильтры get_loans"""
+        return self._start('decide_matching', {'decision': decision, 'filters': filters})
+
+    def submit_auto_score(self):
+        """Прогон правил автоскоринга по всем заявкам на проверке"""
+        return self._start('auto_score', {})
+
+    def job(self, job_id):
+        job = self.db.get_loan_job(job_id)
+        if job:
+            del job['params']
+        return job
+
+    def resume_stale(self, older_than=STALE_AFTER):
+        """Ставит в очередь этого процесса брошенные задания; возвращает их id"""
+        jobs = self.db.claim_stale_loan_jobs(older_than)
+        for job in jobs:
+            self._executor.submit(self._run, job['id'], job['kind'], json.loads(job['params']))
+        return [job['id'] for job in jobs]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    # --- Выполнение ---
+    def _start(self, kind, params, requested=None):
+        # Храним только последние history завершенных заданий
+        job_id = self.db.create_loan_job(kind, params, requested, keep=self.history)
+        self._executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def _update(self, job_id, **changes):
+        self.db.update_loan_job(job_id, **changes)
+
+    def _run(self, job_id, kind, params):
+        try:
+            self._update(job_id, state='running')
+            self._kinds[kind](job_id, **params)
+        except Exception as e:
+            self._update(job_id, state='failed', error=str(e))
+        else:
+            self._update(job_id, state='done')
+        finally:
+            # Поток пула переживает задание - соединение отдается другим потокам
+            self.db.release_connection()
+
+    def _apply(self, job_id, ids, decision):
+        res = self.db.process_loans(ids, decision)
+        if not res.ok:
+            raise RuntimeError(res.message)
+        decided = len(res.data['decided'])
+        self._update(job_id, **{decision: decided, 'skipped': len(ids) - decided})
+
+    def _decide_ids(self, job_id, ids, decision):
+        for i in range(0, len(ids), self.batch_size):
+            self._apply(job_id, ids[i:i + self.batch_size], decision)
+
+    def _decide_matching(self, job_id, decision, filters):
+        # Решенные заявки уходят из 'pending', поэтому курсор after_id нужен только для пропущенных
+        after_id = None
+        while True:
+            page = self.db.get_loans('pending', limit=self.batch_size, after_id=after_id, **filters)
+            if not page:
+                return
+            self._apply(job_id, [loan['id'] for loan in page], decision)
+            after_id = page[-1]['id']
+
+    def _auto_score(self, job_id):
+        after_id = None
+        while True:
+            page = self.db.get_loans('pending', limit=self.batch_size, after_id=after_id)
+            if not page:
+                return
+            decisions = {'approved': [], 'rejected': []}
+            undecided = 0
+            for loan in page:
+                decision = next((d for d in (rule(loan) for rule in self.rules) if d), None)
+                if decision:
+                    decisions[decision].append(loan['id'])
+                else:
+                    undecided += 1
+            for decision, ids in decisions.items():
+                if ids:
+                    self._apply(job_id, ids, decision)
+            self._update(job_id, skipped=undecided)
+            after_id = page[-1]['id']
@@ -0,0 +1,43 @@
+"""Расчеты по кредитам: аннуитетный платеж и график погашения (суммы в тиынах)."""
+import calendar
+from datetime import date
+
+from money import Money
+
+
+def annuity_payment(principal, annual_rate, months):
+    """Ежемесячный аннуитетный платеж: P * r / (1 - (1 + r) ** -n), r - месячная ставка"""
+    if months <= 0:
+        raise ValueError("Срок кредита должен быть положительным")
+    r = annual_rate / 12
+    if r == 0:
+        return Money(round(principal / months))
+    return Money(round(principal * r / (1 - (1 + r) ** -months)))
+
+
+def add_months(start, months):
+    month = start.month - 1 + months
+    year = start.year + month // 12
+    month = month % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+
+def build_schedule(principal, annual_rate, months, start=None):
+    """График погашения: список (номер, дата платежа, платеж, основной долг, проценты, остаток).
+
+    Последний платеж корректируется так, чтобы остаток стал ровно нулевым.
+    """
+    start = start or date.today()
+    r = annual_rate / 12
+    payment = annuity_payment(principal, annual_rate, months)
+    balance = principal
+    rows = []
+    for n in range(1, months + 1):
+        interest = Money(round(balance * r))
+        body = payment - interest
+        if n == months:
+            body = Money(balance)
+        balance = Money(balance - body)
+        rows.append((n, add_months(start, n).isoformat(), body + interest, body, interest, balance))
+    return rows
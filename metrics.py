@@ -0,0 +1,314 @@
+"""Метрики приложения: задержки маршрутов, статистика методов Database и выборочный профилировщик.
+
+Database(metrics=Metrics()) открывает соединения пула как InstrumentedConnection и оборачивает
+свои публичные методы: на каждый вызов записываются время, число SQL-запросов, число строк,
+полученных fetchone/fetchall/fetchmany, и время внутри SQLite. Вложенные вызовы
+(process_loan -> process_loans) учитываются в обоих методах.
+
+Запросы считает сам курсор, а не sqlite3 trace callback: в Python 3.11 callback получает
+SQL с подставленными параметрами (sqlite3_expanded_sql), и это несколько микросекунд на
+каждый запрос. executemany считается одним запросом.
+Маршруты Flask замеряются хуками в app.py. Выгрузка - render_prometheus() и snapshot().
+"""
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import pstats
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Границы корзин гистограмм задержек (секунды), как у клиентов Prometheus по умолчанию
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+
+class _Local(threading.local):
+    # Атрибут задан в каждом потоке: getattr(local, имя, None) по отсутствующему имени
+    # ловит AttributeError и стоит около микросекунды - это был основной расход на вызов
+    def __init__(self):
+        self.scope = None
+
+
+_local = _Local()
+_bisect = bisect.bisect_left
+
+# Служебные методы Database, вызываемые из каждого другого - их замер только добавил бы шум
+NOT_INSTRUMENTED = {'get_connection', 'release_connection', 'close'}
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя корзина - больше всех границ (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[_bisect(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, n in zip(BUCKETS, self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+# Счетчики текущего вызова метода Database (_local.scope) - список, а не объект: он создается
+# на каждый вызов. Внешний вызов хранится в PARENT.
+QUERIES, ROWS, SQL_TIME, PARENT = range(4)
+
+
+# Методы базовых классов - прямые ссылки вместо super() на горячем пути
+_perf = time.perf_counter
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_fetchone = sqlite3.Cursor.fetchone
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
+_cursor = sqlite3.Connection.cursor
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, который засчитывает время выполнения и выбранные строки текущему вызову Database.
+
+    Строки, полученные итерацией по курсору, не считаются: переопределение __next__
+    стоило бы лишнего вызова Python на каждую строку.
+    """
+
+    def execute(self, *args):
+        started = _perf()
+        try:
+            return _execute(self, *args)
+        finally:
+            scope = _local.scope
+            if scope is not None:
+                scope[SQL_TIME] += _perf() - started
+                scope[QUERIES] += 1
+
+    def executemany(self, *args):
+        started = _perf()
+        try:
+            return _executemany(self, *args)
+        finally:
+            scope = _local.scope
+            if scope is not None:
+                scope[SQL_TIME] += _perf() - started
+                scope[QUERIES] += 1
+
+    def fetchone(self):
+        started = _perf()
+        row = _fetchone(self)
+        scope = _local.scope
+        if scope is not None:
+            scope[SQL_TIME] += _perf() - started
+            scope[ROWS] += row is not None
+        return row
+
+    def fetchmany(self, *args):
+        started = _perf()
+        rows = _fetchmany(self, *args)
+        scope = _local.scope
+        if scope is not None:
+            scope[SQL_TIME] += _perf() - started
+            scope[ROWS] += len(rows)
+        return rows
+
+    def fetchall(self):
+        started = _perf()
+        rows = _fetchall(self)
+        scope = _local.scope
+        if scope is not None:
+            scope[SQL_TIME] += _perf() - started
+            scope[ROWS] += len(rows)
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Фабрика соединений для ConnectionPool: все запросы идут через InstrumentedCursor"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return _cursor(self, factory)
+
+    # Connection.execute в C создает обычный курсор, минуя cursor(); учет - как в
+    # InstrumentedCursor.execute, но без лишнего вызова Python
+    def execute(self, *args):
+        cursor = _cursor(self, InstrumentedCursor)
+        started = _perf()
+        try:
+            return _execute(cursor, *args)
+        finally:
+            scope = _local.scope
+            if scope is not None:
+                scope[SQL_TIME] += _perf() - started
+                scope[QUERIES] += 1
+
+    def executemany(self, *args):
+        return _cursor(self, InstrumentedCursor).executemany(*args)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    """Реестр метрик процесса.
+
+    profile_rate - доля запросов, которые выполняются под cProfile (0 - только по ?profile=1 у админа)
+    profile_keep - сколько последних профилей хранить
+    """
+
+    def __init__(self, profile_rate=0.0, profile_keep=20):
+        self.profile_rate = profile_rate
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._requests = {}   # (route, method) -> Histogram
+        self._statuses = {}   # (route, method, status) -> count
+        self._calls = {}      # метод Database -> [Histogram, queries, rows, sql_time]
+        self._profiles = deque(maxlen=profile_keep)
+
+    # --- Запись ---
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            histogram = self._requests.get((route, method))
+            if histogram is None:
+                histogram = self._requests[route, method] = Histogram()
+            histogram.observe(seconds)
+            key = (route, method, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def observe_call(self, name, seconds, queries=0, rows=0, sql_time=0.0):
+        with self._lock:
+            stats = self._calls.get(name)
+            if stats is None:
+                stats = self._calls[name] = [Histogram(), 0, 0, 0.0]
+            stats[0].observe(seconds)
+            stats[1] += queries
+            stats[2] += rows
+            stats[3] += sql_time
+
+    # --- Инструментирование Database ---
+    def instrument(self, db):
+        """Оборачивает публичные методы db (генераторы - нет: их работа идет после возврата).
+
+        Обертки кладутся в подкласс, а не в атрибуты экземпляра: десятки атрибутов в __dict__
+        лишают экземпляр компактного словаря, и замедляется каждое обращение self.pool, self.cache...
+        """
+        cls = type(db)
+        wrapped = {name: self._timed(name, func)
+                   for name, func in inspect.getmembers(cls, inspect.isfunction)
+                   if not name.startswith('_') and name not in NOT_INSTRUMENTED
+                   and not inspect.isgeneratorfunction(func)}
+        db.__class__ = type(cls.__name__, (cls,), {'__module__': cls.__module__, **wrapped})
+
+    def _timed(self, name, method):
+        # Горячий путь: observe_call развернут здесь, статистика метода создается заранее
+        stats = self._calls.setdefault(name, [Histogram(), 0, 0, 0.0])
+        histogram = stats[0]
+        acquire, release = self._lock.acquire, self._lock.release
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            parent = _local.scope
+            scope = _local.scope = [0, 0, 0.0, parent]
+            started = _perf()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = _perf() - started
+                _local.scope = parent
+                queries, rows, sql_time = scope[QUERIES], scope[ROWS], scope[SQL_TIME]
+                if parent is not None:
+                    parent[QUERIES] += queries
+                    parent[ROWS] += rows
+                    parent[SQL_TIME] += sql_time
+                bucket = _bisect(BUCKETS, elapsed)
+                acquire()
+                histogram.counts[bucket] += 1
+                histogram.sum += elapsed
+                histogram.count += 1
+                stats[1] += queries
+                stats[2] += rows
+                stats[3] += sql_time
+                release()
+        return timed
+
+    # --- Профилировщик ---
+    def start_profile(self):
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish_profile(self, profile, route, method, seconds, limit=30):
+        profile.disable()
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        with self._lock:
+            self._profiles.append({'route': route, 'method': method, 'seconds': round(seconds, 6),
+                                   'at': time.strftime("%Y-%m-%d %H:%M:%S"), 'stats': out.getvalue()})
+
+    # --- Выгрузка ---
+    def snapshot(self):
+        with self._lock:
+            requests = [{'route': route, 'method': method, 'count': h.count, 'sum': round(h.sum, 6),
+                         'avg': round(h.sum / h.count, 6) if h.count else 0.0,
+                         'buckets': {str(bound): n for bound, n in h.cumulative()}}
+                        for (route, method), h in sorted(self._requests.items())]
+            statuses = [{'route': route, 'method': method, 'status': status, 'count': n}
+                        for (route, method, status), n in sorted(self._statuses.items())]
+            calls = [{'name': name, 'count': h.count, 'seconds': round(h.sum, 6), 'queries': queries,
+                      'rows': rows, 'sql_seconds': round(sql_time, 6)}
+                     for name, (h, queries, rows, sql_time) in sorted(self._calls.items()) if h.count]
+            profiles = list(self._profiles)
+        return {'uptime': round(time.time() - self.started, 1), 'requests': requests, 'statuses': statuses,
+                'db_calls': calls, 'profiles': profiles}
+
+    def render_prometheus(self, gauges=None):
+        """Текстовый формат Prometheus; gauges - {имя: значение} (пул соединений, кэш и т.п.)"""
+        lines = []
+
+        def histogram(name, help_text, items):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in items:
+                for bound, n in h.cumulative():
+                    lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {n}")
+                lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {h.count}")
+                lines.append(f"{name}_sum{_labels(**labels)} {h.sum}")
+                lines.append(f"{name}_count{_labels(**labels)} {h.count}")
+
+        def counter(name, help_text, items):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in items:
+                lines.append(f"{name}{_labels(**labels)} {value}")
+
+        with self._lock:
+            histogram('bank_request_duration_seconds', 'Время обработки HTTP-запроса',
+                      [({'route': r, 'method': m}, h) for (r, m), h in sorted(self._requests.items())])
+            counter('bank_requests_total', 'HTTP-запросы по кодам ответа',
+                    [({'route': r, 'method': m, 'status': s}, n) for (r, m, s), n in sorted(self._statuses.items())])
+            calls = sorted(self._calls.items())
+            histogram('bank_db_call_duration_seconds', 'Время вызова метода Database',
+                      [({'method': name}, stats[0]) for name, stats in calls])
+            counter('bank_db_queries_total', 'SQL-запросы, выполненные методом Database',
+                    [({'method': name}, stats[1]) for name, stats in calls])
+            counter('bank_db_rows_total', 'Строки, полученные методом Database',
+                    [({'method': name}, stats[2]) for name, stats in calls])
+            counter('bank_db_sql_seconds_total', 'Время внутри SQLite по методам Database',
+                    [({'method': name}, stats[3]) for name, stats in calls])
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,341 @@
+"""Версионированные миграции схемы.
+
+Текущая версия хранится в PRAGMA user_version. Каждая миграция выполняется в своей
+транзакции BEGIN IMMEDIATE вместе с обновлением версии, поэтому несколько воркеров,
+стартующих одновременно, не применят одну миграцию дважды.
+"""
+import time
+
+import ledger
+
+
+def _initial_schema(cursor):
+    # Таблица пользователей
+    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY, password TEXT NOT NULL, role TEXT NOT NULL,
+        name TEXT, email TEXT, created_at TEXT, is_blocked INTEGER DEFAULT 0)''')
+
+    # Таблица счетов (с данными карты)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS accounts (
+        account_number TEXT PRIMARY KEY,
+        username TEXT,
+        type TEXT,
+        balance REAL DEFAULT 0.0,
+        card_number TEXT,
+        cvv TEXT,
+        expiry_date TEXT,
+        FOREIGN KEY(username) REFERENCES users(username))''')
+
+    # Таблица транзакций
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, account_number TEXT, type TEXT,
+        amount REAL, description TEXT, timestamp TEXT,
+        FOREIGN KEY(account_number) REFERENCES accounts(account_number))''')
+
+    # Таблица кредитов
+    cursor.execute('''CREATE TABLE IF NOT EXISTS loans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, amount REAL,
+        term_months INTEGER, status TEXT DEFAULT 'pending', created_at TEXT,
+        remaining_amount REAL,
+        FOREIGN KEY(username) REFERENCES users(username))''')
+
+    # Старые базы были созданы без remaining_amount
+    if 'remaining_amount' not in _columns(cursor, 'loans'):
+        cursor.execute("ALTER TABLE loans ADD COLUMN remaining_amount REAL")
+
+    # Таблица обращений
+    cursor.execute('''CREATE TABLE IF NOT EXISTS appeals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, message TEXT,
+        status TEXT DEFAULT 'open', created_at TEXT,
+        FOREIGN KEY(username) REFERENCES users(username))''')
+
+
+def _hot_path_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_username ON accounts(username)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_loans_status ON loans(status, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_loans_username ON loans(username)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appeals_status ON appeals(status)")
+
+
+def _epoch_timestamps(cursor):
+    # timestamp - строка с точностью до минуты, по ней нельзя надежно сортировать операции
+    # внутри минуты. ts - unix-время в секундах, заполняется из старой строки (локальное время).
+    if 'ts' not in _columns(cursor, 'transactions'):
+        cursor.execute("ALTER TABLE transactions ADD COLUMN ts INTEGER")
+    cursor.execute("UPDATE transactions SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) WHERE ts IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_ts ON transactions(account_number, ts DESC, id DESC)")
+
+
+def _sequences(cursor):
+    # Счетчики номеров вместо SELECT COUNT(*) по accounts при каждом открытии счета
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY, value INTEGER NOT NULL)''')
+    last = cursor.execute("SELECT MAX(CAST(SUBSTR(account_number, 3) AS INTEGER)) FROM accounts").fetchone()[0]
+    cursor.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('account_number', ?)", (max(last or 0, 2000),))
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_card_number ON accounts(card_number)")
+
+
+def _loan_engine(cursor):
+    # Кредитные продукты со своей годовой ставкой вместо ставки, зашитой в request_loan
+    cursor.execute('''CREATE TABLE IF NOT EXISTS loan_products (
+        code TEXT PRIMARY KEY, name TEXT, annual_rate REAL NOT NULL)''')
+    cursor.execute("INSERT OR IGNORE INTO loan_products VALUES ('cash', 'Кредит наличными', 0.15)")
+
+    columns = _columns(cursor, 'loans')
+    for name, decl in [('product', 'TEXT'), ('annual_rate', 'REAL DEFAULT 0'), ('monthly_payment', 'REAL'),
+                       ('accrued_interest', 'REAL DEFAULT 0'), ('last_accrual', 'TEXT')]:
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE loans ADD COLUMN {name} {decl}")
+    # У старых кредитов комиссия 15% уже включена в remaining_amount, поэтому annual_rate = 0:
+    # начисление процентов их не затрагивает.
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS loan_schedule (
+        loan_id INTEGER, installment INTEGER, due_date TEXT,
+        payment REAL, principal REAL, interest REAL, balance REAL,
+        PRIMARY KEY (loan_id, installment),
+        FOREIGN KEY(loan_id) REFERENCES loans(id)) WITHOUT ROWID''')
+
+
+def _loan_jobs(cursor):
+    # Задания фоновой очереди решений по кредитам (loan_queue.py): статус виден любому воркеру,
+    # незавершенные задания упавшего воркера подхватываются по updated_at
+    cursor.execute('''CREATE TABLE IF NOT EXISTS loan_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, params TEXT NOT NULL, state TEXT NOT NULL,
+        requested INTEGER, approved INTEGER NOT NULL DEFAULT 0, rejected INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0, error TEXT, created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_loan_jobs_unfinished ON loan_jobs(updated_at) WHERE state IN ('queued', 'running')")
+
+
+def _integer_money(cursor):
+    # Суммы переводятся из REAL (тенге) в INTEGER (тиыны). SQLite не умеет менять тип столбца,
+    # поэтому таблицы пересоздаются: новая таблица -> копирование с конвертацией -> замена.
+    tiyn = "CAST(ROUND({0} * 100) AS INTEGER)".format
+    _rebuild(cursor, 'accounts', '''CREATE TABLE accounts_new (
+        account_number TEXT PRIMARY KEY,
+        username TEXT,
+        type TEXT,
+        balance INTEGER NOT NULL DEFAULT 0,
+        card_number TEXT,
+        cvv TEXT,
+        expiry_date TEXT,
+        FOREIGN KEY(username) REFERENCES users(username))''',
+        f"SELECT account_number, username, type, {tiyn('COALESCE(balance, 0)')}, card_number, cvv, expiry_date FROM accounts")
+    _rebuild(cursor, 'transactions', '''CREATE TABLE transactions_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, account_number TEXT, type TEXT,
+        amount INTEGER, description TEXT, timestamp TEXT, ts INTEGER,
+        FOREIGN KEY(account_number) REFERENCES accounts(account_number))''',
+        f"SELECT id, account_number, type, {tiyn('amount')}, description, timestamp, ts FROM transactions")
+    _rebuild(cursor, 'loans', '''CREATE TABLE loans_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, amount INTEGER,
+        term_months INTEGER, status TEXT DEFAULT 'pending', created_at TEXT,
+        remaining_amount INTEGER, product TEXT, annual_rate REAL DEFAULT 0, monthly_payment INTEGER,
+        accrued_interest INTEGER DEFAULT 0, last_accrual TEXT,
+        FOREIGN KEY(username) REFERENCES users(username))''',
+        f'''SELECT id, username, {tiyn('amount')}, term_months, status, created_at, {tiyn('remaining_amount')},
+                   product, annual_rate, {tiyn('monthly_payment')}, {tiyn('accrued_interest')}, last_accrual FROM loans''')
+    _rebuild(cursor, 'loan_schedule', '''CREATE TABLE loan_schedule_new (
+        loan_id INTEGER, installment INTEGER, due_date TEXT,
+        payment INTEGER, principal INTEGER, interest INTEGER, balance INTEGER,
+        PRIMARY KEY (loan_id, installment),
+        FOREIGN KEY(loan_id) REFERENCES loans(id)) WITHOUT ROWID''',
+        f'''SELECT loan_id, installment, due_date, {tiyn('payment')}, {tiyn('principal')},
+                   {tiyn('interest')}, {tiyn('balance')} FROM loan_schedule''')
+
+    # Индексы удалились вместе со старыми таблицами
+    _hot_path_indexes(cursor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_ts ON transactions(account_number, ts DESC, id DESC)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_card_number ON accounts(card_number)")
+
+
+# Типы операций и столбцы daily_balances с их суммами за день
+CREDIT_TYPES = {'DEPOSIT': 'deposits', 'TRANSFER_IN': 'transfers_in', 'LOAN_APPROVED': 'loans_in'}
+DEBIT_TYPES = {'TRANSFER_OUT': 'transfers_out', 'LOAN_REPAYMENT': 'repayments'}
+TYPE_COLUMNS = {**CREDIT_TYPES, **DEBIT_TYPES}
+
+
+def _daily_balances(cursor):
+    # Агрегаты по счету за день: входящий/исходящий остаток, приход и расход (итого и по типам).
+    # Обновляются в той же транзакции, что и проводка (db.post_transactions), поэтому выписка
+    # и сверка не пересуммируют журнал. Одна строка на (счет, день) - один UPSERT на проводку.
+    type_columns = ''.join(f"{column} INTEGER NOT NULL DEFAULT 0, " for column in TYPE_COLUMNS.values())
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS daily_balances (
+        account_number TEXT, day TEXT, opening INTEGER NOT NULL, credits INTEGER NOT NULL DEFAULT 0,
+        debits INTEGER NOT NULL DEFAULT 0, closing INTEGER NOT NULL, txn_count INTEGER NOT NULL DEFAULT 0,
+        {type_columns}
+        PRIMARY KEY (account_number, day)) WITHOUT ROWID''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_balances_day ON daily_balances(day)")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reconcile_checkpoints (
+        name TEXT PRIMARY KEY, last_transaction_id INTEGER NOT NULL, checked_at TEXT)''')
+
+    # Заполнение по существующему журналу. Остаток до первой операции выводится из текущего
+    # баланса: balance - сумма всех операций (у старых счетов он мог быть задан напрямую).
+    credit_types = ', '.join(f"'{t}'" for t in CREDIT_TYPES)
+    columns = ', '.join(TYPE_COLUMNS.values())
+    sums = ', '.join(f"SUM(CASE WHEN type = '{t}' THEN amount ELSE 0 END) AS {column}" for t, column in TYPE_COLUMNS.items())
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO daily_balances (account_number, day, opening, credits, debits, closing, txn_count, {columns})
+        SELECT account_number, day, base + running - credits + debits, credits, debits, base + running, txn_count, {columns}
+        FROM (SELECT d.*, SUM(credits - debits) OVER (PARTITION BY d.account_number ORDER BY day) AS running,
+                     a.balance - SUM(credits - debits) OVER (PARTITION BY d.account_number) AS base
+              FROM (SELECT account_number, substr(timestamp, 1, 10) AS day, COUNT(*) AS txn_count,
+                           SUM(CASE WHEN type IN ({credit_types}) THEN amount ELSE 0 END) AS credits,
+                           SUM(CASE WHEN type IN ({credit_types}) THEN 0 ELSE amount END) AS debits, {sums}
+                    FROM transactions GROUP BY 1, 2) d
+              JOIN accounts a ON a.account_number = d.account_number)''')
+    # Счета с балансом, но без операций, получают стартовую строку
+    cursor.execute('''
+        INSERT OR IGNORE INTO daily_balances (account_number, day, opening, closing)
+        SELECT account_number, date('now', 'localtime'), balance, balance FROM accounts a
+        WHERE balance != 0 AND NOT EXISTS (SELECT 1 FROM daily_balances d WHERE d.account_number = a.account_number)''')
+    cursor.execute("INSERT OR IGNORE INTO reconcile_checkpoints VALUES ('daily_balances', COALESCE((SELECT MAX(id) FROM transactions), 0), NULL)")
+
+
+def _transfer_intents(cursor):
+    # Межшардовые переводы (sharding.py): на шарде отправителя - намерение 'prepared' ->
+    # 'committed'/'aborted', на шарде получателя - отметка 'applied', по которой повторное
+    # зачисление того же перевода пропускается. В одиночной базе таблица пустая.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transfer_intents (
+        id TEXT PRIMARY KEY, from_account TEXT NOT NULL, to_account TEXT NOT NULL,
+        amount INTEGER NOT NULL, state TEXT NOT NULL, created_at INTEGER NOT NULL)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transfer_intents_prepared ON transfer_intents(created_at) WHERE state = 'prepared'")
+
+
+def _journal(cursor):
+    # Журнал проводок (ledger.py): id выдаются подряд в транзакции записи, hash - цепочка sha256
+    cursor.execute('''CREATE TABLE IF NOT EXISTS journal (
+        id INTEGER PRIMARY KEY, posting INTEGER NOT NULL, account_number TEXT NOT NULL,
+        amount INTEGER NOT NULL, type TEXT NOT NULL, ts INTEGER NOT NULL, hash BLOB NOT NULL)''')
+    for action in ('UPDATE', 'DELETE'):
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS journal_no_{action.lower()} BEFORE {action} ON journal
+                           BEGIN SELECT RAISE(ABORT, 'journal is append-only'); END''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ledger_snapshots (
+        id INTEGER PRIMARY KEY, journal_id INTEGER NOT NULL, hash BLOB NOT NULL, created_at TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ledger_snapshot_balances (
+        snapshot_id INTEGER, account_number TEXT, balance INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_id, account_number)) WITHOUT ROWID''')
+
+    # Прошлые операции не дают сбалансированных проводок (балансы могли задаваться напрямую),
+    # поэтому журнал начинается с текущих остатков: одна проводка OPENING против SYS:EQUITY
+    if not cursor.execute("SELECT 1 FROM journal LIMIT 1").fetchone():
+        opening = cursor.execute("SELECT account_number, balance, 'OPENING' FROM accounts WHERE balance != 0 ORDER BY account_number").fetchall()
+        if opening:
+            ledger.append(cursor, [tuple(row) for row in opening], int(time.time()))
+
+
+def _snapshot_versions(cursor):
+    # Версии снимков дашбордов (cache.py): запись увеличивает версию затронутых ключей в своей
+    # транзакции, и кэш любого воркера видит изменение. Ключ '*' - сброс всех снимков
+    cursor.execute("CREATE TABLE IF NOT EXISTS snapshot_versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID")
+
+
+def _loan_principal(cursor):
+    # Основной долг отдельно от начисленных процентов: проценты начисляются только на него.
+    # Какая часть прошлых погашений ушла в проценты, не записано, поэтому у существующих
+    # кредитов основной долг - остаток задолженности, но не больше суммы кредита
+    if 'principal' not in _columns(cursor, 'loans'):
+        cursor.execute("ALTER TABLE loans ADD COLUMN principal INTEGER")
+    cursor.execute("UPDATE loans SET principal = MIN(amount, COALESCE(remaining_amount, amount)) WHERE principal IS NULL")
+
+
+def _rebuild(cursor, table, create_sql, select_sql):
+    cursor.execute(create_sql)
+    cursor.execute(f"INSERT INTO {table}_new {select_sql}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+# (версия, описание, функция) - только добавлять в конец, уже выпущенные не менять
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'indexes for hot query paths', _hot_path_indexes),
+    (3, 'epoch timestamps for transactions', _epoch_timestamps),
+    (4, 'account number sequence and unique card numbers', _sequences),
+    (5, 'loan products, amortization schedules and interest accrual', _loan_engine),
+    (6, 'persistent loan decision jobs', _loan_jobs),
+    (7, 'integer minor units (tiyn) for money columns', _integer_money),
+    (8, 'daily balance aggregates for statements and reconciliation', _daily_balances),
+    (9, 'cross-shard transfer intents', _transfer_intents),
+    (10, 'append-only hash-chained journal and balance snapshots', _journal),
+    (11, 'snapshot versions for cross-process cache invalidation', _snapshot_versions),
+    (12, 'outstanding loan principal for interest accrual', _loan_principal),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _columns(cursor, table):
+    return [info[1] for info in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def check_version(conn):
+    """Версия схемы; RuntimeError, если она не совпадает с LATEST_VERSION (миграции не применены)"""
+    version = current_version(conn)
+    if version != LATEST_VERSION:
+        raise RuntimeError(f"Версия схемы базы {version}, ожидается {LATEST_VERSION}: выполните flask init-db")
+    return version
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Применяет недостающие миграции, возвращает список примененных версий"""
+    applied = []
+    for version, _, apply in MIGRATIONS:
+        if version > target or current_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Версию перечитываем под блокировкой: другой воркер мог успеть раньше
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            apply(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+# Горячие запросы дашбордов. Если план любого из них содержит SCAN по таблице - индекс потерян,
+# USE TEMP B-TREE - ORDER BY сортирует все найденные строки вместо чтения индекса по порядку.
+# Тексты совпадают с запросами Database; benchmarks/check_query_plans.py сверяет их с трассировкой методов
+HOT_QUERIES = {
+    'get_history': ('''SELECT * FROM transactions WHERE account_number = ? AND (ts, id) < (?, ?)
+                       ORDER BY ts DESC, id DESC LIMIT ?''', ('KZ2001', 0, 0, 21)),
+    'get_history_accounts': ("SELECT account_number FROM accounts WHERE username=?", ('client',)),
+    'get_client_accounts': ('''SELECT a.*, u.name as owner_name FROM accounts a
+                               JOIN users u ON a.username = u.username WHERE a.username=?''', ('client',)),
+    'get_loans': ("SELECT * FROM loans WHERE status=? AND id > ? ORDER BY id LIMIT ?", ('pending', 0, 50)),
+    'get_client_loans': ("SELECT * FROM loans WHERE username=?", ('client',)),
+    'get_open_appeals': ("SELECT * FROM appeals WHERE status='open'", ()),
+    'get_statement': ("SELECT * FROM daily_balances WHERE account_number=? AND day BETWEEN ? AND ? ORDER BY day",
+                      ('KZ2001', '2026-01-01', '2026-01-31')),
+    'get_statement_opening': ("SELECT closing FROM daily_balances WHERE account_number=? AND day < ? ORDER BY day DESC LIMIT 1",
+                              ('KZ2001', '2026-01-01')),
+    'get_daily_totals': ("SELECT day, SUM(credits), SUM(debits) FROM daily_balances WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+                         ('2026-01-01', '2026-01-31')),
+}
+
+
+def explain(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def bad_plan(plan):
+    """Шаги плана, недопустимые для горячего запроса: полный просмотр таблицы или сортировка во временном B-дереве"""
+    return [step for step in plan if step.startswith('SCAN') or 'USE TEMP B-TREE' in step]
+
+
+def check_query_plans(conn, queries=None):
+    """Возвращает {имя запроса: план} для запросов со SCAN таблицы или сортировкой во временном B-дереве"""
+    offenders = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = explain(conn, sql, params)
+        if bad_plan(plan):
+            offenders[name] = plan
+    return offenders
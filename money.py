@@ -0,0 +1,92 @@
+"""Денежные суммы в целых тиынах (1 ₸ = 100 тиын).
+
+Money - подкласс int: sqlite3 пишет его как INTEGER, сложение и сравнение точные,
+SUM по столбцам тоже целочисленный. float в Money не превращается молча - только
+через parse() / tenge(), которые округляют до тиына явно.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+TIYN = 100
+
+# Предел суммы одной операции (10 трлн ₸): балансы и обороты с запасом помещаются в INTEGER
+# SQLite (int64), который на большем числе падает с OverflowError
+MAX_AMOUNT = 10 ** 15
+
+
+class Money(int):
+    def __new__(cls, tiyn=0):
+        if isinstance(tiyn, float):
+            raise TypeError("Money из float неоднозначен - используйте Money.tenge() или Money.parse()")
+        return super().__new__(cls, tiyn)
+
+    @classmethod
+    def tenge(cls, value):
+        """Сумма в тенге (int, float, Decimal или строка) -> Money, с округлением до тиына"""
+        try:
+            amount = Decimal(str(value).strip().replace(' ', '').replace(',', '.'))
+            # quantize тоже бросает InvalidOperation - на числах длиннее точности контекста ('1e30')
+            tiyn = int((amount * TIYN).quantize(Decimal(1), rounding=ROUND_HALF_UP)) if amount.is_finite() else None
+        except InvalidOperation:
+            tiyn = None
+        if tiyn is None or abs(tiyn) > MAX_AMOUNT:
+            raise ValueError(f"Некорректная сумма: {value!r}")
+        return cls(tiyn)
+
+    @classmethod
+    def parse(cls, value):
+        """Сумма из формы или файла (в тенге); ValueError, если это не число"""
+        if value is None:
+            raise ValueError("Сумма не указана")
+        return cls.tenge(value)
+
+    @property
+    def tiyn(self):
+        return int(self)
+
+    def to_decimal(self):
+        return Decimal(int(self)) / TIYN
+
+    def format(self, decimals=0):
+        return f"{self.to_decimal():,.{decimals}f}"
+
+    # Сложение и вычитание с int дают Money, с float - TypeError (раньше int() молча отбрасывал
+    # дробную часть). float слева (1.5 + Money) Python считает сам, не спрашивая Money, - результат float.
+    # Умножение и деление не переопределены: balance * rate - обычный float, и в Money он вернется
+    # только через явный round()
+    def __add__(self, other):
+        other = _operand(other)
+        return other if other is NotImplemented else Money(int(self) + other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = _operand(other)
+        return other if other is NotImplemented else Money(int(self) - other)
+
+    def __rsub__(self, other):
+        other = _operand(other)
+        return other if other is NotImplemented else Money(other - int(self))
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __repr__(self):
+        return f"Money({self.to_decimal()})"
+
+    def __str__(self):
+        return f"{self.format(2)} ₸"
+
+
+def _operand(value):
+    if isinstance(value, float):
+        raise TypeError("Арифметика Money с float неоднозначна - используйте Money.tenge() или Money.parse()")
+    return int(value) if isinstance(value, int) else NotImplemented
+
+
+def to_money(value):
+    """Аргумент суммы метода Database: Money или целое число тиынов (float - ошибка)"""
+    if isinstance(value, Money):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return Money(value)
+    raise TypeError(f"Сумма должна быть Money или int (тиыны), получено {type(value).__name__}")
@@ -0,0 +1,129 @@
+"""Хеширование паролей: соленый scrypt/PBKDF2 с параметрами, записанными в сам хеш.
+
+Формат значения в users.password:
+    scrypt$n=16384,r=8,p=1$<соль hex>$<хеш hex>
+    pbkdf2_sha256$i=200000$<соль hex>$<хеш hex>
+Старые записи - 64 hex-символа несоленого SHA-256; они проверяются по-старому
+и перехешируются при успешном входе.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+MAX_TRACKED_USERS = 10_000
+
+
+class PasswordHasher:
+    """Параметры задаются на уровне развертывания (work factor vs пропускная способность логина).
+
+    algorithm      - 'scrypt' или 'pbkdf2_sha256'
+    n, r, p        - параметры scrypt (память ~ 128 * n * r байт)
+    iterations     - число итераций PBKDF2
+    max_concurrent - сколько тяжелых проверок выполняется одновременно (остальные ждут)
+    cache_size     - сколько успешных проверок помнить (0 - без кэша)
+    max_failures, failure_window - после max_failures неудачных попыток за окно (сек)
+                     пароль пользователя не проверяется до конца окна
+    """
+
+    def __init__(self, algorithm='scrypt', n=2 ** 14, r=8, p=1, iterations=200_000,
+                 max_concurrent=4, cache_size=1024, max_failures=10, failure_window=300):
+        if algorithm not in ('scrypt', 'pbkdf2_sha256'):
+            raise ValueError(f"Неизвестный алгоритм: {algorithm}")
+        self.algorithm = algorithm
+        self.n, self.r, self.p = n, r, p
+        self.iterations = iterations
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.cache_size = cache_size
+
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._verified = OrderedDict()
+        self._failures = {}
+
+    # --- Хеширование ---
+    def _params(self):
+        if self.algorithm == 'scrypt':
+            return f"n={self.n},r={self.r},p={self.p}"
+        return f"i={self.iterations}"
+
+    def _derive(self, algorithm, params, password, salt):
+        opts = dict(item.split('=') for item in params.split(','))
+        with self._slots:
+            if algorithm == 'scrypt':
+                n, r, p = int(opts['n']), int(opts['r']), int(opts['p'])
+                return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                      maxmem=256 * n * r * p, dklen=32)
+            if algorithm == 'pbkdf2_sha256':
+                return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, int(opts['i']))
+        raise ValueError(f"Неизвестный алгоритм: {algorithm}")
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        params = self._params()
+        digest = self._derive(self.algorithm, params, password, salt)
+        return f"{self.algorithm}${params}${salt.hex()}${digest.hex()}"
+
+    def needs_rehash(self, stored):
+        # Старый SHA-256 или хеш с другими параметрами, чем текущие настройки развертывания
+        parts = stored.split('$')
+        return len(parts) != 4 or parts[0] != self.algorithm or parts[1] != self._params()
+
+    # --- Проверка ---
+    def verify(self, username, password, stored):
+        """True, если пароль подходит. Возвращает False без вычислений, пока пользователь заблокирован лимитом"""
+        if self.is_throttled(username):
+            return False
+
+        cache_key = (stored, hashlib.sha256(password.encode()).digest())
+        with self._lock:
+            if cache_key in self._verified:
+                self._verified.move_to_end(cache_key)
+                return True
+
+        ok = self._check(password, stored)
+        with self._lock:
+            if ok:
+                self._failures.pop(username, None)
+                if self.cache_size:
+                    self._verified[cache_key] = True
+                    while len(self._verified) > self.cache_size:
+                        self._verified.popitem(last=False)
+            else:
+                self._failures.setdefault(username, deque()).append(time.monotonic())
+                if len(self._failures) > MAX_TRACKED_USERS:
+                    self._forget_stale_failures()
+        return ok
+
+    def _forget_stale_failures(self):
+        # Словарь неудачных попыток не должен расти бесконечно при переборе логинов
+        border = time.monotonic() - self.failure_window
+        for name in [u for u, attempts in self._failures.items() if attempts[-1] < border]:
+            del self._failures[name]
+
+    def _check(self, password, stored):
+        parts = stored.split('$')
+        if len(parts) == 1:
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, stored)
+        if len(parts) != 4:
+            return False
+        algorithm, params, salt, digest = parts
+        candidate = self._derive(algorithm, params, password, bytes.fromhex(salt))
+        return hmac.compare_digest(candidate.hex(), digest)
+
+    def is_throttled(self, username):
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._failures.get(username)
+            if not attempts:
+                return False
+            while attempts and attempts[0] < now - self.failure_window:
+                attempts.popleft()
+            if not attempts:
+                del self._failures[username]
+                return False
+            return len(attempts) >= self.max_failures
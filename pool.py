@@ -0,0 +1,137 @@
+import sqlite3
+import threading
+import queue
+import time
+import weakref
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class _Lease:
+    # Маркер "аренды" соединения потоком. Когда поток завершается, threading.local
+    # удаляет его данные, объект собирается GC и соединение возвращается в пул.
+    pass
+
+
+class ConnectionPool:
+    """Пул SQLite-соединений: каждый поток получает свое соединение и переиспользует его.
+
+    size          - максимум одновременно открытых соединений
+    journal_mode  - режим журнала (WAL позволяет читать во время записи)
+    synchronous   - PRAGMA synchronous (NORMAL достаточно для WAL)
+    busy_timeout  - сколько мс ждать блокировку записи, прежде чем вернуть 'database is locked'
+    mmap_size     - размер memory-mapped I/O в байтах (0 - выключено)
+    timeout       - сколько секунд поток ждет свободный слот в пуле
+    factory       - класс соединения (sqlite3.Connection или подкласс, например metrics.InstrumentedConnection)
+    """
+
+    def __init__(self, db_name, size=8, journal_mode="WAL", synchronous="NORMAL",
+                 busy_timeout=5000, mmap_size=0, timeout=30.0, factory=sqlite3.Connection):
+        self.db_name = db_name
+        self.size = size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.timeout = timeout
+        self.factory = factory
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self._stats = {'hits': 0, 'checkouts': 0, 'created': 0, 'waits': 0, 'wait_time': 0.0, 'timeouts': 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row  # Позволяет обращаться к полям по имени (row['field'])
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        if self.journal_mode:
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        if self.synchronous:
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        if self.mmap_size:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def acquire(self):
+        """Соединение текущего потока (создается или берется из пула при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._count('hits')
+            return conn
+
+        if not self._slots.acquire(blocking=False):
+            # Все слоты заняты другими потоками - ждем освобождения
+            started = time.perf_counter()
+            got = self._slots.acquire(timeout=self.timeout)
+            self._count('waits')
+            self._count('wait_time', time.perf_counter() - started)
+            if not got:
+                self._count('timeouts')
+                raise PoolTimeout(f"Нет свободных соединений (size={self.size})")
+
+        try:
+            conn = self._idle.get_nowait()
+            self._count('checkouts')
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self._all.append(conn)
+                self._stats['created'] += 1
+
+        lease = _Lease()
+        weakref.finalize(lease, self._release, conn)
+        self._local.conn = conn
+        self._local.lease = lease
+        return conn
+
+    def release(self):
+        """Явно вернуть соединение текущего потока в пул (например, в teardown запроса)"""
+        lease = getattr(self._local, 'lease', None)
+        self._local.conn = None
+        self._local.lease = None
+        if lease is not None:
+            # finalize вызовется сразу, т.к. других ссылок на lease нет
+            del lease
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            # Пул уже закрыт - соединение закрыто вместе с ним
+            return
+        self._idle.put(conn)
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['size'] = self.size
+        data['open'] = len(self._all)
+        data['idle'] = self._idle.qsize()
+        requests = data['hits'] + data['checkouts'] + data['created']
+        data['hit_ratio'] = round(data['hits'] / requests, 4) if requests else 0.0
+        return data
+
+    def close(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            conn.close()
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(self.size)
+
@@ -0,0 +1,112 @@
+import random
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+
+
+class PostingStatus(Enum):
+    OK = 'ok'
+    INVALID_AMOUNT = 'invalid_amount'
+    SAME_ACCOUNT = 'same_account'
+    ACCOUNT_NOT_FOUND = 'account_not_found'
+    SENDER_NOT_FOUND = 'sender_not_found'
+    RECEIVER_NOT_FOUND = 'receiver_not_found'
+    FOREIGN_ACCOUNT = 'foreign_account'
+    INSUFFICIENT_FUNDS = 'insufficient_funds'
+    LOAN_NOT_FOUND = 'loan_not_found'
+    LOAN_NOT_ACTIVE = 'loan_not_active'
+    EXCEEDS_DEBT = 'exceeds_debt'
+    INVALID_DECISION = 'invalid_decision'
+    BUSY = 'busy'
+
+
+# Тексты для flash-сообщений (раньше методы Database возвращали их напрямую)
+MESSAGES = {
+    PostingStatus.OK: 'Успешно',
+    PostingStatus.INVALID_AMOUNT: 'Некорректная сумма',
+    PostingStatus.SAME_ACCOUNT: 'Нельзя перевести на тот же счет',
+    PostingStatus.ACCOUNT_NOT_FOUND: 'Счет не найден',
+    PostingStatus.SENDER_NOT_FOUND: 'Счет отправителя не найден',
+    PostingStatus.RECEIVER_NOT_FOUND: 'Счет получателя не найден',
+    PostingStatus.FOREIGN_ACCOUNT: 'Счет списания принадлежит другому клиенту',
+    PostingStatus.INSUFFICIENT_FUNDS: 'Недостаточно средств',
+    PostingStatus.LOAN_NOT_FOUND: 'Кредит не найден',
+    PostingStatus.LOAN_NOT_ACTIVE: 'Кредит не активен',
+    PostingStatus.EXCEEDS_DEBT: 'Сумма превышает остаток долга',
+    PostingStatus.INVALID_DECISION: 'Неизвестное решение по заявке',
+    PostingStatus.BUSY: 'Сервер занят, повторите операцию',
+}
+
+
+@dataclass(frozen=True)
+class PostingResult:
+    status: PostingStatus
+    data: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return self.status is PostingStatus.OK
+
+    @property
+    def message(self):
+        return MESSAGES[self.status]
+
+    def __bool__(self):
+        return self.ok
+
+
+def fail(status, **data):
+    return PostingResult(status, data)
+
+
+def success(**data):
+    return PostingResult(PostingStatus.OK, data)
+
+
+def is_lock_error(exc):
+    text = str(exc).lower()
+    return 'locked' in text or 'busy' in text
+
+
+def run_immediate(conn, posting, retries=5, backoff=0.005):
+    """Выполняет posting(cursor) как одну транзакцию BEGIN IMMEDIATE.
+
+    Блокировка записи берется сразу, поэтому между проверкой и UPDATE никто не вклинится.
+    Если posting вернул неуспешный PostingResult - транзакция откатывается.
+    При 'database is locked' операция повторяется с экспоненциальной задержкой,
+    после исчерпания попыток возвращается PostingStatus.BUSY.
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            _sleep(backoff, attempt)
+            continue
+
+        try:
+            result = posting(conn.cursor())
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not is_lock_error(e):
+                raise
+            _sleep(backoff, attempt)
+            continue
+        except Exception:
+            conn.rollback()
+            raise
+
+        if result.ok:
+            conn.commit()
+        else:
+            conn.rollback()
+        return result
+
+    return fail(PostingStatus.BUSY)
+
+
+def _sleep(backoff, attempt):
+    # Случайный разброс, чтобы конкурирующие воркеры не просыпались одновременно
+    time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
@@ -0,0 +1,418 @@
+"""Горизонтальное шардирование: N файлов SQLite за интерфейсом Database.
+
+Пользователь со всеми своими счетами, кредитами и обращениями живет на шарде
+crc32(username) % N. У каждого файла своя блокировка записи, поэтому проводки клиентов
+разных шардов не ждут друг друга. Шард находится без справочника:
+- счет KZ<n> - на шарде n % N (номера выдает Database.account_number);
+- кредит (а также операция, обращение) с id - на шарде id // SHARD_ID_SPAN.
+
+Перевод между счетами разных шардов выполняется в три шага через таблицу transfer_intents:
+1. шард отправителя одной транзакцией списывает сумму и записывает намерение 'prepared';
+2. шард получателя зачисляет сумму и отмечает намерение 'applied' - повтор не зачислит дважды;
+3. шард отправителя помечает намерение 'committed', а если зачислить некуда - возвращает
+   деньги и помечает 'aborted'.
+Если процесс упал между шагами, recover_transfers() завершает все намерения 'prepared'.
+Он вызывается при старте и командой flask recover-transfers.
+
+Число шардов задается при создании базы. Перераспределение данных по шардам не реализовано.
+"""
+import heapq
+import json
+import os
+import time
+import uuid
+import zlib
+from itertools import chain, islice
+
+from db import LOAN_DECISIONS, SEED_USERS, SHARD_ID_SPAN, Database
+from money import to_money
+from postings import PostingStatus, fail, success
+
+# Сколько раз перевод между шардами пытается выполнить шаги 2-3, прежде чем оставить их recover_transfers
+COMPLETE_ATTEMPTS = 4
+COMPLETE_BACKOFF = 0.02
+
+
+def shard_names(db_name, count):
+    # bank_system.db -> bank_system.shard0.db, bank_system.shard1.db, ...
+    stem, ext = os.path.splitext(db_name)
+    return [f"{stem}.shard{i}{ext}" for i in range(count)]
+
+
+def _sum_stats(stats, *lookups):
+    # Счетчики шардов суммируются (ttl одинаков); hit_ratio пересчитывается по сумме, а не усредняется
+    data = dict(stats[0])
+    for key, value in data.items():
+        if isinstance(value, (int, float)) and key not in ('ttl', 'hit_ratio'):
+            data[key] = sum(s[key] for s in stats)
+    total = sum(data[key] for key in lookups)
+    data['hit_ratio'] = round(data['hits'] / total, 4) if total else 0.0
+    data['shards'] = len(stats)
+    return data
+
+
+class ShardedDatabase:
+    """Тот же интерфейс, что у Database, поверх shards файлов.
+
+    options - параметры Database для каждого шарда (pool_size, hasher, metrics, ...).
+    migrate=False - только проверка версии схемы шардов, как у Database.
+    """
+
+    def __init__(self, db_name="bank_system.db", shards=4, recover=True, seed=True, migrate=True, **options):
+        self.db_name = db_name
+        self.shards = [Database(name, shard_index=i, shard_count=shards, seed=False, migrate=migrate, **options)
+                       for i, name in enumerate(shard_names(db_name, shards))]
+        if migrate and seed:
+            self.seed_data()
+        if recover:
+            self.recover_transfers()
+
+    # --- Маршрутизация ---
+    def shard_for_user(self, username):
+        return self.shards[zlib.crc32(username.encode()) % len(self.shards)]
+
+    def shard_for_account(self, account_number):
+        # None - номер не вида KZ<число>: такого счета нет ни на одном шарде
+        try:
+            return self.shards[int(account_number[2:]) % len(self.shards)]
+        except (TypeError, ValueError):
+            return None
+
+    def shard_for_id(self, row_id):
+        index = int(row_id) // SHARD_ID_SPAN
+        return self.shards[index] if 0 <= index < len(self.shards) else None
+
+    def release_connection(self):
+        for shard in self.shards:
+            shard.release_connection()
+
+    def pool_stats(self):
+        return _sum_stats([s.pool_stats() for s in self.shards], 'hits', 'checkouts', 'created')
+
+    def cache_stats(self):
+        return _sum_stats([s.cache_stats() for s in self.shards], 'hits', 'misses')
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    # --- Кэш снимков дашбордов ---
+    def get_client_dashboard(self, username):
+        return self.shard_for_user(username).get_client_dashboard(username)
+
+    def get_admin_dashboard(self):
+        # Снимки шардов кэшируются и сбрасываются каждым шардом отдельно
+        snapshots = [s.get_admin_dashboard() for s in self.shards]
+        return {'users': [u for snapshot in snapshots for u in snapshot['users']],
+                'appeals': [a for snapshot in snapshots for a in snapshot['appeals']]}
+
+    def invalidate_clients(self, *usernames):
+        for username in usernames:
+            self.shard_for_user(username).invalidate_clients(username)
+
+    def invalidate_admin(self):
+        for shard in self.shards:
+            shard.invalidate_admin()
+
+    def hash_password(self, password):
+        return self.shards[0].hash_password(password)
+
+    def create_tables(self):
+        return sorted({version for shard in self.shards for version in shard.create_tables()})
+
+    def init_db(self, seed=True):
+        applied = sorted({version for shard in self.shards for version in shard.init_db(seed=False)})
+        if seed:
+            self.seed_data()
+        return applied
+
+    def check_schema(self):
+        return [shard.check_schema() for shard in self.shards][0]
+
+    def seed_data(self, users=SEED_USERS):
+        for user in users:
+            self.shard_for_user(user[0]).seed_data([user])
+
+    # --- Пользователи (Users) ---
+    def get_user(self, username, password):
+        return self.shard_for_user(username).get_user(username, password)
+
+    def get_user_by_name(self, username):
+        return self.shard_for_user(username).get_user_by_name(username)
+
+    def create_user(self, username, password, role, name, email):
+        return self.shard_for_user(username).create_user(username, password, role, name, email)
+
+    def get_all_users(self):
+        return [u for shard in self.shards for u in shard.get_all_users()]
+
+    def set_block_status(self, username, status):
+        self.shard_for_user(username).set_block_status(username, status)
+
+    # --- Счета (Accounts) ---
+    def create_account(self, username, acc_type):
+        return self.shard_for_user(username).create_account(username, acc_type)
+
+    def get_account(self, account_number):
+        shard = self.shard_for_account(account_number)
+        return shard.get_account(account_number) if shard else None
+
+    def get_client_accounts(self, username):
+        return self.shard_for_user(username).get_client_accounts(username)
+
+    def transfer(self, from_acc, to_acc, amount):
+        amount = to_money(amount)
+        if amount <= 0: return fail(PostingStatus.INVALID_AMOUNT)
+        if from_acc == to_acc: return fail(PostingStatus.SAME_ACCOUNT)
+        source = self.shard_for_account(from_acc)
+        if source is not None and source is self.shard_for_account(to_acc):
+            return source.transfer(from_acc, to_acc, amount)
+        return self._transfer_across(from_acc, to_acc, amount)
+
+    def _transfer_across(self, from_acc, to_acc, amount, owner=None):
+        # Проверки в том же порядке, что в Database.bulk_transfer
+        if not isinstance(amount, int) or amount <= 0: return fail(PostingStatus.INVALID_AMOUNT)
+        if from_acc == to_acc: return fail(PostingStatus.SAME_ACCOUNT)
+        source, target = self.shard_for_account(from_acc), self.shard_for_account(to_acc)
+        sender = source.get_account(from_acc) if source else None
+        if not sender: return fail(PostingStatus.SENDER_NOT_FOUND)
+        if owner is not None and sender['username'] != owner: return fail(PostingStatus.FOREIGN_ACCOUNT)
+        # Получатель проверяется до списания, чтобы опечатка в номере не оставляла в истории списание и возврат
+        if target is None or not target.get_account(to_acc): return fail(PostingStatus.RECEIVER_NOT_FOUND)
+
+        intent_id = uuid.uuid4().hex
+        res = source.prepare_transfer(intent_id, from_acc, to_acc, amount)
+        if not res.ok: return res
+        res = self._complete_transfer(source, intent_id, from_acc, to_acc, amount, attempts=COMPLETE_ATTEMPTS)
+        if res.status is PostingStatus.RECEIVER_NOT_FOUND: return res
+        # Списание уже зафиксировано. Если шаги 2-3 не прошли и после повторов (BUSY), их завершит
+        # recover_transfers: ошибка клиенту привела бы к повторному переводу
+        return success(pending=not res.ok)
+
+    def _complete_transfer(self, source, intent_id, from_acc, to_acc, amount, attempts=1):
+        # Шаги 2 и 3. Оба безопасны при повторе, поэтому при BUSY повторяются с задержкой до attempts раз.
+        # Результат - результат зачисления; BUSY, если зачисление или отметка на шарде отправителя так и не прошли
+        target = self.shard_for_account(to_acc)
+        for attempt in range(attempts):
+            if attempt: time.sleep(COMPLETE_BACKOFF * 2 ** (attempt - 1))
+            applied = target.apply_transfer(intent_id, from_acc, to_acc, amount) if target else fail(PostingStatus.RECEIVER_NOT_FOUND)
+            if not applied.ok and applied.status is not PostingStatus.RECEIVER_NOT_FOUND:
+                continue
+            if source.finish_transfer(intent_id, committed=applied.ok).ok:
+                return applied
+        return fail(PostingStatus.BUSY)
+
+    def recover_transfers(self, older_than=0):
+        """Завершает межшардовые переводы, прерванные между шагами.
+
+        older_than - не трогать намерения моложе стольких секунд. Повторное зачисление
+        безопасно, поэтому и при 0 параллельный перевод другого воркера не задвоится.
+        Возвращает число завершенных переводов.
+        """
+        done = 0
+        before = int(time.time()) - older_than
+        for shard in self.shards:
+            for intent in shard.pending_transfers(before):
+                res = self._complete_transfer(shard, intent['id'], intent['from_account'], intent['to_account'], intent['amount'])
+                done += res.ok or res.status is PostingStatus.RECEIVER_NOT_FOUND
+        return done
+
+    def bulk_transfer(self, rows, owner=None, chunk_size=1000):
+        """Как Database.bulk_transfer. Строки внутри одного шарда копятся в пачку этого шарда,
+        межшардовые выполняются по одной трехшаговым переводом. Результаты идут в исходном порядке.
+
+        Для каждого счета строки применяются в порядке файла: перед межшардовым переводом
+        сбрасываются накопленные пачки шардов отправителя и получателя. Пачки разных шардов
+        не пересекаются по счетам, поэтому отличается только взаимный порядок проводок
+        в разных файлах (id и время операций на разных шардах), но не остатки и не отказы.
+        """
+        report = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                report.extend(self._bulk_chunk(chunk, owner))
+                chunk = []
+        if chunk:
+            report.extend(self._bulk_chunk(chunk, owner))
+        return report
+
+    def _bulk_chunk(self, chunk, owner):
+        results = [None] * len(chunk)
+        pending = {}
+
+        def flush(shard):
+            indexes = pending.pop(shard, None)
+            if indexes:
+                for i, res in zip(indexes, shard.bulk_transfer([chunk[i] for i in indexes], owner, chunk_size=len(indexes))):
+                    results[i] = res
+
+        for i, (from_acc, to_acc, _) in enumerate(chunk):
+            source, target = self.shard_for_account(from_acc), self.shard_for_account(to_acc)
+            if source is not None and source is target:
+                pending.setdefault(source, []).append(i)
+                continue
+            for shard in (source, target):
+                if shard is not None: flush(shard)
+            results[i] = self._transfer_across(*chunk[i], owner=owner)
+        for shard in list(pending):
+            flush(shard)
+        return results
+
+    def deposit(self, acc_num, amount):
+        shard = self.shard_for_account(acc_num)
+        if shard is None:
+            return fail(PostingStatus.INVALID_AMOUNT) if to_money(amount) <= 0 else fail(PostingStatus.ACCOUNT_NOT_FOUND)
+        return shard.deposit(acc_num, amount)
+
+    def get_history(self, username, limit=20, cursor=None, types=None, since=None, until=None):
+        return self.shard_for_user(username).get_history(username, limit, cursor, types, since, until)
+
+    # --- Кредиты (Loans) ---
+    def get_loan_product(self, code='cash'):
+        # Справочник продуктов одинаков на всех шардах (заполняется миграцией)
+        return self.shards[0].get_loan_product(code)
+
+    def request_loan(self, username, amount, months, product='cash'):
+        return self.shard_for_user(username).request_loan(username, amount, months, product)
+
+    def get_loan_schedule(self, loan_id):
+        shard = self.shard_for_id(loan_id)
+        return shard.get_loan_schedule(loan_id) if shard else []
+
+    def accrue_interest(self, as_of=None, chunk_size=100_000):
+        return sum(shard.accrue_interest(as_of, chunk_size) for shard in self.shards)
+
+    def get_loans(self, status, limit=None, after_id=None, username=None, min_amount=None, max_amount=None):
+        if username:
+            return self.shard_for_user(username).get_loans(status, limit, after_id, username, min_amount, max_amount)
+        # У каждого шарда свой диапазон id, поэтому слияние по id сохраняет keyset-пагинацию
+        pages = [shard.get_loans(status, limit, after_id, None, min_amount, max_amount) for shard in self.shards]
+        return list(islice(heapq.merge(*pages, key=lambda loan: loan['id']), limit))
+
+    def count_loans(self, status):
+        return sum(shard.count_loans(status) for shard in self.shards)
+
+    def get_client_loans(self, username):
+        return self.shard_for_user(username).get_client_loans(username)
+
+    def process_loan(self, loan_id, decision):
+        shard = self.shard_for_id(loan_id)
+        return shard.process_loan(loan_id, decision) if shard else fail(PostingStatus.LOAN_NOT_FOUND)
+
+    def process_loans(self, loan_ids, decision):
+        """Решение по пачке заявок: по одной транзакции на шард.
+
+        Если шард вернул ошибку, решения на предыдущих шардах уже применены (data['decided']);
+        повтор безопасен - решаются только заявки в статусе 'pending'.
+        """
+        if decision not in LOAN_DECISIONS: return fail(PostingStatus.INVALID_DECISION)
+        by_shard = {}
+        for loan_id in dict.fromkeys(int(i) for i in loan_ids):
+            shard = self.shard_for_id(loan_id)
+            if shard is not None:
+                by_shard.setdefault(shard, []).append(loan_id)
+        decided, users = [], set()
+        for shard, ids in by_shard.items():
+            res = shard.process_loans(ids, decision)
+            if not res.ok:
+                return fail(res.status, decided=decided, users=users)
+            decided += res.data['decided']
+            users |= set(res.data['users'])
+        return success(decided=decided, users=users)
+
+    # Задания очереди решений - на шарде 0: их id не привязаны к шардам заявок
+    def create_loan_job(self, kind, params, requested=None, keep=100):
+        return self.shards[0].create_loan_job(kind, params, requested, keep)
+
+    def update_loan_job(self, job_id, state=None, error=None, approved=0, rejected=0, skipped=0):
+        self.shards[0].update_loan_job(job_id, state, error, approved, rejected, skipped)
+
+    def get_loan_job(self, job_id):
+        return self.shards[0].get_loan_job(job_id)
+
+    def claim_stale_loan_jobs(self, older_than):
+        return self.shards[0].claim_stale_loan_jobs(older_than)
+
+    def repay_loan(self, loan_id, account_number, amount):
+        # Счет погашения должен быть на шарде кредита - то есть принадлежать заемщику
+        shard = self.shard_for_id(loan_id)
+        return shard.repay_loan(loan_id, account_number, amount) if shard else fail(PostingStatus.LOAN_NOT_ACTIVE)
+
+    # --- Обращения (Appeals) ---
+    def create_appeal(self, username, message):
+        self.shard_for_user(username).create_appeal(username, message)
+
+    def get_open_appeals(self):
+        return [a for shard in self.shards for a in shard.get_open_appeals()]
+
+    def resolve_appeal(self, appeal_id, username):
+        self.shard_for_user(username).resolve_appeal(appeal_id, username)
+
+    # --- Выписки и сверка (daily_balances) ---
+    def get_statement(self, username, account_number, day_from, day_to):
+        return self.shard_for_user(username).get_statement(username, account_number, day_from, day_to)
+
+    def get_daily_totals(self, day_from, day_to):
+        days = {}
+        for row in chain.from_iterable(shard.get_daily_totals(day_from, day_to) for shard in self.shards):
+            total = days.get(row['day'])
+            if total is None:
+                days[row['day']] = row
+                continue
+            total['credits'] += row['credits']
+            total['debits'] += row['debits']
+            total['count'] += row['count']
+            total['by_type'] = {t: amount + row['by_type'][t] for t, amount in total['by_type'].items()}
+        return [days[day] for day in sorted(days)]
+
+    def reconcile(self, full=False):
+        """Сверка каждого шарда; у расхождений добавлен номер шарда, last_transaction_id - список по шардам"""
+        reports = [shard.reconcile(full=full) for shard in self.shards]
+        return {'checked_days': sum(r['checked_days'] for r in reports),
+                'checked_accounts': sum(r['checked_accounts'] for r in reports),
+                'last_transaction_id': [r['last_transaction_id'] for r in reports],
+                'mismatches': [dict(m, shard=i) for i, r in enumerate(reports) for m in r['mismatches']]}
+
+    # --- Журнал проводок (ledger.py) ---
+    # У каждого шарда свой журнал и своя цепочка хешей; отчеты сводятся, у записей - номер шарда
+    def replay_ledger(self, full=False, verify=True, rebuild=False, batch_size=50_000):
+        return self._merge_ledger_reports([shard.replay_ledger(full, verify, rebuild, batch_size) for shard in self.shards])
+
+    def snapshot_ledger(self, keep=3, batch_size=50_000):
+        reports = [shard.snapshot_ledger(keep, batch_size) for shard in self.shards]
+        return {**self._merge_ledger_reports(reports), 'snapshot_id': [r['snapshot_id'] for r in reports]}
+
+    def _merge_ledger_reports(self, reports):
+        system = {}
+        for report in reports:
+            for acc, balance in report.get('system', {}).items():
+                system[acc] = system.get(acc, 0) + balance
+        return {'events': sum(r['events'] for r in reports), 'verified': reports[0]['verified'],
+                'snapshot': [r['snapshot'] for r in reports], 'to_id': [r['to_id'] for r in reports],
+                'problems': [dict(p, shard=i) for i, r in enumerate(reports) for p in r['problems']],
+                'mismatches': [dict(m, shard=i) for i, r in enumerate(reports) for m in r.get('mismatches', [])],
+                'system': system}
+
+    # --- Выгрузка (export.py) ---
+    # Watermark - JSON-список последних ключей по шардам: шарды выгружаются по очереди,
+    # и у каждого своя граница для следующей инкрементальной выгрузки.
+    def export_columns(self, table):
+        return self.shards[0].export_columns(table)
+
+    def parse_export_key(self, table, value):
+        keys = json.loads(value) if isinstance(value, str) else value
+        if not isinstance(keys, list) or len(keys) != len(self.shards):
+            raise ValueError(f"Watermark должен быть JSON-списком из {len(self.shards)} ключей")
+        return [None if key is None else shard.parse_export_key(table, key) for shard, key in zip(self.shards, keys)]
+
+    def export_watermark(self, table):
+        keys = [shard.export_watermark(table) for shard in self.shards]
+        return None if all(key is None for key in keys) else json.dumps(keys, ensure_ascii=False)
+
+    def iter_export(self, table, after=None, upto=None, since=None, batch_size=5000):
+        after = self.parse_export_key(table, after) if after is not None else [None] * len(self.shards)
+        upto = self.parse_export_key(table, upto) if upto is not None else [s.export_watermark(table) for s in self.shards]
+        for shard, low, high in zip(self.shards, after, upto):
+            if high is not None:
+                yield from shard.iter_export(table, after=low, upto=high, since=since, batch_size=batch_size)